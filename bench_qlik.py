@@ -0,0 +1,494 @@
+"""
+Benchmark offline do qlik_to_pdf contra um stage Qlik falso servido localmente.
+
+Sobe um mashup de mentira (#qv-stage-container, article.qv-object, footnotes,
+abas role=tab, botões com background-image, loaders com atraso configurável),
+roda o roteiro completo do PLAN contra ele em Chromium headless e reporta
+tempo total, latência por helper, chamadas ao driver (≈ round trips CDP) e
+pico de memória. Um engine falso num WebSocket (/app/mock) responde o
+JSON-RPC dos gráficos com atraso de --engine-ms, para exercitar a espera
+pelo engine do wait_qlik. Depois das rodadas, remonta o PDF com as capturas
+em cada contagem de --pdf-workers, para cada --scales (device_scale_factor).
+Serve para pegar regressão antes de ir para produção.
+
+Uso:
+    python bench_qlik.py --loader-ms 800 --render-ms 200 --anim-ms 600 --engine-ms 500 --runs 2
+    python bench_qlik.py --json atual.json --baseline anterior.json
+    python bench_qlik.py --scales 1,2 --pdf-workers 1,2,4
+"""
+import argparse
+import base64
+import glob
+import hashlib
+import http.server
+import json
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from urllib.parse import urlparse
+
+import qlik_to_pdf as q
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# PNG 1x1 servido para qualquer imagem de extensão (click1.png, cbnb_egovens_2.png, ...)
+TINY_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360f8cfc0f01f0005000201e2a2"
+    "3b5c0000000049454e44ae426082"
+)
+
+MOCK_HTML = r"""<!doctype html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Mock e-GovEns</title>
+<style>
+    body { margin: 0; font-family: sans-serif; background: #f4f4f4; }
+    #menu { display: flex; gap: 6px; padding: 8px; background: #1d3557; }
+    #menu button { color: #fff; background: #457b9d; border: 0; padding: 6px 10px; }
+    .sheet-title-logo-img { height: 60px; background: #a8dadc; }
+    #qv-stage-container { display: flex; flex-wrap: wrap; gap: 12px; padding: 12px; min-height: 900px; }
+    article.qv-object { background: #fff; width: 420px; min-height: 160px; padding: 8px; position: relative; }
+    article.qv-object.wide { width: 880px; }
+    article.qv-object.tall { min-height: 1400px; }
+    footer.qv-object-footnote { position: absolute; bottom: 6px; left: 8px; font-size: 13px; }
+    .bar { display: inline-block; width: 24px; margin-right: 4px; background: #e63946; vertical-align: bottom; }
+    .qv-loader { width: 100%; height: 40px; background: #ddd; }
+    button.bg { width: 120px; height: 80px; border: 0; background-size: cover; }
+    [role='tab'][aria-selected='true'] { font-weight: bold; }
+</style>
+</head>
+<body>
+<div id="menu"></div>
+<div class="sheet-title-logo-img"></div>
+<div id="qv-stage-container"></div>
+<script>
+const params = new URLSearchParams(location.search);
+const LOADER_MS = +(params.get("loader_ms") || 600);
+const RENDER_MS = +(params.get("render_ms") || 150);
+const ANIM_MS = +(params.get("anim_ms") || 400);
+const APP = "/mashup/sense/app/mock";
+
+const OMS = ["AFA", "EPCAR", "EEAR", "CIAAR", "IEAD", "UNIFA", "ECEMAR", "EAOAR", "DIRENS", "ASSISTENCIAIS"];
+const AFA_HEADER = [
+    ["Formação Aviadores", "afa_aviadores"],
+    ["Formação Intendência", "afa_intendencia"],
+    ["Formação Infantaria", "afa_infantaria"],
+    ["Aeronave / Simulador", "afa_simulador"],
+    ["Instrução T25", "afa_t25"],
+    ["Instrução T27", "afa_t27"],
+    ["Esforço Aéreo", "afa_esforco"],
+];
+const card = (foot, go, extra) => Object.assign({ foot, go }, extra || {});
+const back = card("Voltar", "__back");
+const cursos = (om, label) => ({ cards: [card(label, om.toLowerCase() + "_cursos"), card("Indicadores " + om, null, { chart: true })] });
+
+const SHEETS = {
+    home: { cards: OMS.map((om) => card(om, om.toLowerCase())) },
+    afa: { cards: AFA_HEADER.map(([t, g]) => card(t, g)).concat([card("Resumo AFA", null, { chart: true })]) },
+    afa_t25: { header: true, cards: [card("CFOAV 2º Ano", null, { detalhar: "afa_det" }), card("CFOAV 4º Ano", null, { detalhar: "afa_det" })] },
+    afa_t27: { header: true, cards: [card("CFOAV 4º Ano", null, { detalhar: "afa_det" })] },
+    afa_det: { cards: [card("Horas voadas", null, { tabs: ["VISÃO MENSAL", "VISÃO ACUMULADO MENSAL"], wide: true }),
+                       card("Missões", null, { tabs: ["VISÃO MENSAL", "VISÃO SEMANAL"], wide: true }), back] },
+    epcar: cursos("EPCAR", "Cursos da EPCAR"),
+    eear: cursos("EEAR", "Cursos da EEAR"),
+    ciaar: cursos("CIAAR", "Cursos do CIAAR"),
+    iead: cursos("IEAD", "Cursos do IEAD"),
+    unifa: cursos("UNIFA", "Cursos da UNIFA"),
+    eaoar: cursos("EAOAR", "Cursos da EAOAR"),
+    ecemar: { cards: [card("Cursos da ECEMAR", "ecemar_cursos"), card("PLAMENS exterior", "ecemar_plamens")] },
+    ecemar_plamens: { cards: [card("PLAMENS exterior - detalhe", null, { chart: true, tall: true }), back] },
+    direns: { cards: [card("Exames", null, { bg: "click1.png", go: "direns_exames" })] },
+    assistenciais: { cards: [
+        card("CBNB", null, { bg: "cbnb_egovens_2.png", go: "assist_cbnb" }),
+        card("CTRB", null, { bg: "ctrb_egovens_2.png", go: "assist_ctrb" }),
+        card("ECE", null, { bg: "ece_egovens_2.png", go: "assist_ece" }),
+    ] },
+};
+for (const [, g] of AFA_HEADER) if (!SHEETS[g]) SHEETS[g] = { header: true, cards: [card(g, null, { chart: true })] };
+const sheetOf = (id) => SHEETS[id] || { cards: [card(id, null, { chart: true }), back] };
+
+const stage = document.getElementById("qv-stage-container");
+const history_ = [];
+let current = (location.pathname.match(/\/sheet\/([^/]+)/) || [])[1] || "home";
+
+// engine falso: cada gráfico pede GetLayout + GetHyperCubeData e só
+// desenha as barras quando as duas respostas chegam
+const engine = new WebSocket(`ws://${location.host}/app/mock`);
+const waiting = new Map();
+let rpcId = 0;
+const rpc = (method, handle) => new Promise((resolve) => {
+    const id = ++rpcId;
+    waiting.set(id, resolve);
+    const send = () => engine.send(JSON.stringify({ jsonrpc: "2.0", id, method, handle, params: [] }));
+    if (engine.readyState === WebSocket.OPEN) send();
+    else engine.addEventListener("open", send, { once: true });
+});
+engine.addEventListener("message", (ev) => {
+    const msg = JSON.parse(ev.data);
+    const resolve = waiting.get(msg.id);
+    if (resolve) {
+        waiting.delete(msg.id);
+        resolve(msg.result);
+    }
+});
+const fetchChart = (c, handle) => {
+    c.innerHTML = '<div class="qv-loader"></div>';
+    rpc("GetLayout", handle)
+        .then(() => rpc("GetHyperCubeData", handle))
+        .then(() => { c.innerHTML = chart(); animate(c); });
+};
+
+const animate = (root) => {
+    const bars = Array.from(root.querySelectorAll(".bar"));
+    if (!bars.length) return;
+    const t0 = performance.now();
+    const tick = () => {
+        if (performance.now() - t0 > ANIM_MS) return;
+        bars.forEach((b) => { b.style.height = (20 + Math.random() * 100) + "px"; });
+        setTimeout(tick, 50);
+    };
+    tick();
+};
+
+const chart = () => Array.from({ length: 8 }, () => '<span class="bar" style="height:40px"></span>').join("");
+
+const renderCard = (c, i) => {
+    const art = document.createElement("article");
+    art.className = "qv-object" + (c.wide ? " wide" : "") + (c.tall ? " tall" : "");
+    if (c.go && !c.bg) art.dataset.go = c.go;
+    let html = "";
+    if (c.tabs) {
+        html += c.tabs.map((t, j) => `<button role="tab" aria-selected="${j === 0}">${t}</button>`).join(" ");
+        html += `<div class="chart">${chart()}</div>`;
+    }
+    if (c.chart) html += `<div class="chart">${chart()}</div>`;
+    if (c.detalhar) html += `<div class="chart">${chart()}</div><button data-go="${c.detalhar}">Detalhar</button>`;
+    if (c.bg) html += `<button class="bg" data-go="${c.go}" style="background-image: url('/extensions/img/${c.bg}')"></button>`;
+    html += `<footer class="qv-object-footnote">${c.foot}</footer>`;
+    art.innerHTML = html;
+    return art;
+};
+
+const render = (id, push) => {
+    if (push) {
+        history_.push(current);
+        history.pushState({}, "", `${APP}/sheet/${id}/state/analysis${location.search}`);
+    }
+    current = id;
+    stage.innerHTML = '<div class="qv-loader"></div>';
+    setTimeout(() => {
+        stage.innerHTML = "";
+        setTimeout(() => {
+            const sh = sheetOf(id);
+            const cards = (sh.header ? AFA_HEADER.map(([t, g]) => card(t, g)) : []).concat(sh.cards);
+            cards.forEach((c, i) => stage.appendChild(renderCard(c, i)));
+            stage.querySelectorAll(".chart").forEach((c, i) => fetchChart(c, i + 1));
+        }, RENDER_MS);
+    }, LOADER_MS);
+};
+
+const goBack = () => {
+    const prev = history_.pop() || "home";
+    history.pushState({}, "", `${APP}/sheet/${prev}/state/analysis${location.search}`);
+    render(prev, false);
+};
+
+document.getElementById("menu").innerHTML = OMS.map((om) => `<button role="button" data-go="${om.toLowerCase()}">${om}</button>`).join("");
+document.addEventListener("click", (ev) => {
+    const tab = ev.target.closest("[role='tab']");
+    if (tab) {
+        tab.parentElement.querySelectorAll("[role='tab']").forEach((t) => t.setAttribute("aria-selected", String(t === tab)));
+        fetchChart(tab.parentElement.querySelector(".chart"), 99);
+        return;
+    }
+    const el = ev.target.closest("[data-go]");
+    if (!el) return;
+    if (el.dataset.go === "__back") goBack();
+    else render(el.dataset.go, true);
+});
+render(current, false);
+</script>
+</body>
+</html>
+"""
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    # atraso de cada resposta do engine falso (ms)
+    engine_ms = 300
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path.startswith("/app/") and self.headers.get("Upgrade", "").lower() == "websocket":
+            self.serve_engine()
+            return
+        if path.endswith(".png"):
+            body, ctype = TINY_PNG, "image/png"
+        else:
+            body, ctype = MOCK_HTML.encode("utf-8"), "text/html; charset=utf-8"
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def serve_engine(self):
+        """
+        WebSocket mínimo (RFC 6455, só frames de texto sem fragmentação):
+        responde cada requisição JSON-RPC com {"id", "result"} depois de
+        engine_ms, fora de ordem quando os atrasos se sobrepõem.
+        """
+        accept = base64.b64encode(
+            hashlib.sha1((self.headers["Sec-WebSocket-Key"] + WS_GUID).encode()).digest()
+        ).decode()
+        # navegador só aceita o 101 em HTTP/1.1
+        self.protocol_version = "HTTP/1.1"
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.close_connection = True
+        lock = threading.Lock()
+
+        def send(text):
+            data = text.encode("utf-8")
+            if len(data) < 126:
+                head = struct.pack("!BB", 0x81, len(data))
+            elif len(data) < 65536:
+                head = struct.pack("!BBH", 0x81, 126, len(data))
+            else:
+                head = struct.pack("!BBQ", 0x81, 127, len(data))
+            with lock:
+                try:
+                    self.wfile.write(head + data)
+                    self.wfile.flush()
+                except OSError:
+                    pass
+
+        while True:
+            head = self.rfile.read(2)
+            if len(head) < 2:
+                break
+            opcode, size = head[0] & 0x0F, head[1] & 0x7F
+            if size == 126:
+                size = struct.unpack("!H", self.rfile.read(2))[0]
+            elif size == 127:
+                size = struct.unpack("!Q", self.rfile.read(8))[0]
+            mask = self.rfile.read(4) if head[1] & 0x80 else b"\0\0\0\0"
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(self.rfile.read(size)))
+            if opcode == 0x8:
+                break
+            if opcode != 0x1:
+                continue
+            msg = json.loads(payload)
+            reply = json.dumps({"jsonrpc": "2.0", "id": msg.get("id"), "result": {"qReturn": {}}})
+            threading.Timer(self.engine_ms / 1000, send, args=(reply,)).start()
+
+    def log_message(self, *args):
+        pass
+
+def start_mock_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# ----- contagem de chamadas ao driver do Playwright -----
+# Cada chamada da API sync vira uma mensagem Channel -> driver (-> CDP).
+# API interna do Playwright: se mudar, o contador só fica indisponível.
+DRIVER_CALLS = {}
+
+def install_call_counter() -> bool:
+    try:
+        from playwright._impl._connection import Channel
+    except ImportError:
+        return False
+
+    inner = Channel._inner_send
+    no_reply = Channel.send_no_reply
+
+    async def counted_inner_send(self, method, *args, **kwargs):
+        DRIVER_CALLS[method] = DRIVER_CALLS.get(method, 0) + 1
+        return await inner(self, method, *args, **kwargs)
+
+    def counted_no_reply(self, method, *args, **kwargs):
+        DRIVER_CALLS[method] = DRIVER_CALLS.get(method, 0) + 1
+        return no_reply(self, method, *args, **kwargs)
+
+    Channel._inner_send = counted_inner_send
+    Channel.send_no_reply = counted_no_reply
+    return True
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux devolve KiB, macOS bytes
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def reset_state():
+    q._TRACE_EVENTS.clear()
+    q.WAIT_LOG.clear()
+    q.SHOT_SETTLE_LOG.clear()
+    q.SHEET_STATS.clear()
+    q.LOCATOR_STATS.update(hit=0, miss=0)
+    q.ENGINE_STATS.update(requests=0, methods={}, waits=0)
+    q.WAIT_BUDGET_STATS.update(adaptive=0, saved_ms=0)
+    DRIVER_CALLS.clear()
+
+def run_once(base_url, workdir, label):
+    q.QLIK_URL = base_url
+    q.TMP_DIR = os.path.join(workdir, "tmp")
+    q.OUTPUT_DIR = os.path.join(workdir, "pdfs")
+    reset_state()
+
+    # sessão do mock na pasta do bench: não sobrescreve o login salvo de produção
+    session_dir = q.SESSION_DIR
+    q.SESSION_DIR = os.path.join(workdir, "session")
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    try:
+        q.main([])
+    finally:
+        q.SESSION_DIR = session_dir
+    wall_s = time.perf_counter() - t0
+    _cur, py_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rows = {name: (n, total, own, mx) for name, n, total, own, mx in q.trace_summary(top=1000)}
+    helpers = {
+        name: {"n": n, "media_ms": round(total / n, 1), "max_ms": round(mx, 1), "total_ms": round(total, 1)}
+        for name, (n, total, own, mx) in rows.items()
+        if not name.startswith(("step:", "branch:"))
+    }
+    plan = q.load_plan_state()
+    return {
+        "rodada": label,
+        "wall_s": round(wall_s, 2),
+        "paginas": sum(1 for s in plan.values() if s.get("status") == "ok"),
+        "esperas_ms": sum(w for _cap, w, _ok in q.WAIT_LOG),
+        "tetos_historico": q.WAIT_BUDGET_STATS["adaptive"],
+        "estabilizacao_ms": sum(q.SHOT_SETTLE_LOG),
+        "driver_calls": sum(DRIVER_CALLS.values()) if DRIVER_CALLS else None,
+        "driver_calls_top": dict(sorted(DRIVER_CALLS.items(), key=lambda kv: -kv[1])[:8]),
+        "cache": dict(q.LOCATOR_STATS),
+        "engine": {"requisicoes": q.ENGINE_STATS["requests"], "esperas": q.ENGINE_STATS["waits"]},
+        "pico_python_mb": round(py_peak / (1024 * 1024), 1),
+        "pico_rss_mb": round(peak_rss_mb(), 1) if resource else None,
+        "helpers": helpers,
+    }
+
+def bench_pdf(png_paths, workers_list, workdir):
+    """
+    Monta o mesmo PDF com cada número de processos de codificação.
+    """
+    rows = []
+    for workers in workers_list:
+        out = os.path.join(workdir, f"bench_w{workers}.pdf")
+        t0 = time.perf_counter()
+        writer = q.PdfStreamWriter(out, expected_pages=len(png_paths), workers=workers)
+        for p in png_paths:
+            writer.add_page(p)
+        writer.close()
+        rows.append({
+            "workers": workers,
+            "s": round(time.perf_counter() - t0, 2),
+            "mb": round(os.path.getsize(out) / 1024 / 1024, 2),
+        })
+    return rows
+
+def print_pdf_report(scale, rows):
+    print(f"\n  PDF com device_scale_factor={scale:g}:")
+    base = rows[0]["s"] if rows else 0
+    for r in rows:
+        speedup = f"{base / r['s']:.2f}x" if r["s"] else "-"
+        print(f"  {r['workers']:>3} processo(s): {r['s']:>7} s  {r['mb']:>7} MB  ({speedup})")
+
+def print_report(result, baseline=None):
+    print(f"\n=== {result['rodada']} ===")
+    print(f"tempo total: {result['wall_s']} s   páginas ok: {result['paginas']}   "
+          f"esperas: {result['esperas_ms'] / 1000:.1f} s")
+    print(f"chamadas ao driver: {result['driver_calls']}   cache: {result['cache']}   engine: {result['engine']}")
+    print(f"pico memória python: {result['pico_python_mb']} MB   pico RSS: {result['pico_rss_mb']} MB")
+    print(f"  {'helper':<28} {'n':>5} {'média ms':>10} {'máx ms':>10} {'total ms':>10}")
+    for name, h in sorted(result["helpers"].items(), key=lambda kv: -kv[1]["total_ms"]):
+        print(f"  {name:<28} {h['n']:>5} {h['media_ms']:>10} {h['max_ms']:>10} {h['total_ms']:>10}")
+
+    if baseline:
+        print("\n  comparação com baseline:")
+        for key in ("wall_s", "driver_calls", "pico_python_mb"):
+            old, new = baseline.get(key), result.get(key)
+            if old and new is not None:
+                delta = (new - old) / old * 100
+                flag = "  <-- REGRESSÃO" if delta > 10 else ""
+                print(f"  {key:<18} {old:>10} -> {new:<10} ({delta:+.1f}%){flag}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline do qlik_to_pdf contra um stage Qlik falso.")
+    parser.add_argument("--loader-ms", type=int, default=600, help="tempo com loader visível a cada navegação")
+    parser.add_argument("--render-ms", type=int, default=150, help="atraso entre o loader sumir e os cards aparecerem")
+    parser.add_argument("--anim-ms", type=int, default=400, help="duração da animação dos gráficos após o render")
+    parser.add_argument("--engine-ms", type=int, default=300, help="atraso de cada resposta JSON-RPC do engine falso")
+    parser.add_argument("--runs", type=int, default=1, help="rodadas (a 2ª em diante usa o cache de localizadores quente)")
+    parser.add_argument("--scales", default="1",
+                        help="device_scale_factor de cada série de rodadas, separados por vírgula (ex.: 1,2)")
+    parser.add_argument("--pdf-workers", default=f"1,{q.PDF_WORKERS}",
+                        help="contagens de processos para o benchmark do PDF (ex.: 1,2,4)")
+    parser.add_argument("--json", help="grava o resultado da última rodada neste arquivo")
+    parser.add_argument("--baseline", help="JSON de uma rodada anterior para comparar")
+    args = parser.parse_args(argv)
+
+    counting = install_call_counter()
+    if not counting:
+        print("[AVISO] Contador de chamadas ao driver indisponível nesta versão do Playwright.")
+
+    # stage local: Chromium headless sem canal "chrome"
+    q.HEADLESS = True
+    q.BROWSER_CHANNEL = None
+    q.TRACE_ENABLED = True
+    q.PDF_REPORT = False
+    # o bench mede a codificação: sem cache de páginas entre rodadas
+    q.PAGE_CACHE = False
+
+    MockHandler.engine_ms = args.engine_ms
+    server = start_mock_server()
+    host, port = server.server_address
+    base_url = (f"http://{host}:{port}/mashup/sense/app/mock/sheet/home/state/analysis"
+                f"?loader_ms={args.loader_ms}&render_ms={args.render_ms}&anim_ms={args.anim_ms}")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    scales = [float(s) for s in args.scales.split(",") if s.strip()]
+    workers_list = [int(w) for w in args.pdf_workers.split(",") if w.strip()]
+    result = None
+    with tempfile.TemporaryDirectory(prefix="bench_qlik_") as workdir:
+        for scale in scales:
+            q.CONTEXT_OPTIONS["device_scale_factor"] = scale
+            for i in range(args.runs):
+                label = "fria" if i == 0 else f"quente #{i}"
+                result = run_once(base_url, workdir, f"escala {scale:g}x, rodada {i + 1} ({label})")
+                print_report(result, baseline)
+            pngs = sorted(glob.glob(os.path.join(workdir, "tmp", "page_*.png")))
+            result["pdf"] = bench_pdf(pngs, workers_list, workdir)
+            print_pdf_report(scale, result["pdf"])
+    server.shutdown()
+
+    if args.json and result:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
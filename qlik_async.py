@@ -0,0 +1,650 @@
+"""
+Versão asyncio da camada de navegador do qlik_to_pdf (playwright.async_api).
+
+Tudo que é decisão vem do qlik_to_pdf: o executor do plano, os links
+diretos, a recuperação, as esperas e a estabilização da tela são os
+geradores *_ops de lá, rodados aqui pelo run_ops async; a ordem das
+estratégias de clique, as escolhas no índice do stage, os seletores e os
+JS também. Aqui só ficam as chamadas ao Playwright, com await. Com isso
+várias páginas andam ao mesmo tempo num único event loop, sem uma thread
+(e um driver) por ramo como no modo paralelo sync: as esperas de uma
+página correm enquanto a outra clica ou captura.
+
+Uso: python qlik_to_pdf.py --async (PARALLEL_WORKERS = páginas simultâneas),
+ou run_capture(branches, run, workers) a partir de outro código.
+"""
+import asyncio
+import base64
+import re
+
+from playwright.async_api import async_playwright
+
+import qlik_to_pdf as q
+from qlik_to_pdf import (
+    ARTICLE_OF_XPATH,
+    CLICK_BG_IMAGE_JS,
+    CLICK_STAGE_TEXT_JS,
+    CLICK_TAB_JS,
+    FOOTNOTE_SELECTOR,
+    INDEX_HANDLE_CENTER_JS,
+    STAGE_INDEX_JS,
+    STAGE_SELECTOR,
+    TAB_BUTTON_SELECTOR,
+    VOLTAR_RX,
+    _text_rx,
+    bg_image_tokens,
+    bg_picks,
+    bg_style_selector,
+    exact_rx,
+    invalidate_stage_index,
+    is_acronym,
+    locator_candidates,
+    locator_found,
+    match_cards,
+    menu_picks,
+    normalize,
+    retry_wait_ms,
+    tab_labels,
+    tab_picks,
+    trace_note,
+    trace_span,
+    traced,
+)
+
+# ====== OPERAÇÕES DE PÁGINA ======
+
+async def run_ops(page, gen):
+    """
+    Roda um gerador *_ops do qlik_to_pdf com a API async e devolve o valor final dele.
+    """
+    result, error = None, None
+    try:
+        while True:
+            try:
+                op = gen.throw(error) if error else gen.send(result)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                result, error = await PAGE_OPS[op[0]](page, *op[1:]), None
+            except Exception as e:
+                result, error = None, e
+    finally:
+        gen.close()
+
+async def _first_box(page, selector):
+    loc = page.locator(selector)
+    return await loc.first.bounding_box() if await loc.count() > 0 else None
+
+async def _screenshot(page, path, clip):
+    if clip:
+        return await page.screenshot(path=path, clip=clip)
+    return await page.screenshot(path=path, full_page=False)
+
+PAGE_OPS = {
+    "sleep": lambda page, ms: page.wait_for_timeout(ms),
+    "evaluate": lambda page, js, arg=None: page.evaluate(js, arg),
+    "count": lambda page, selector: page.locator(selector).count(),
+    "box": _first_box,
+    "goto": lambda page, url: page.goto(url, wait_until="domcontentloaded", timeout=q.WAIT_MAX_MS),
+    "start": lambda page: open_start_page(page),
+    "wait": lambda page, extra_ms: wait_qlik(page, extra_ms=extra_ms),
+    "action": lambda page, action, args: PLAN_ACTIONS[action](page, *args),
+    "shot": lambda page, idx, label: capture_shot(page, idx, label),
+    "probe": lambda page, clip: probe_frame(page, clip),
+    "screenshot": _screenshot,
+}
+
+@traced
+async def wait_qlik(page, extra_ms=0):
+    return await run_ops(page, q.wait_qlik_ops(page, extra_ms))
+
+async def capture_shot(page, idx, label):
+    return await run_ops(page, q.capture_shot_ops(page, idx, label))
+
+# ====== CACHE DE LOCALIZADORES E ÍNDICE DO STAGE ======
+
+async def resolve_cached(page, helper: str, target: str, strategies, nth_options=(0,)) -> bool:
+    key, candidates, first = locator_candidates(page, helper, target, nth_options)
+    for tries, (name, nth) in enumerate(candidates, start=1):
+        if await strategies[name](page, nth):
+            return locator_found(page, key, (name, nth), tries, first)
+    return locator_found(page, key, None, len(candidates), first)
+
+async def stage_index(page):
+    key = id(page)
+    q.hook_stage_index(page)
+    snap = q._STAGE_INDEX.get(key)
+    if snap is None:
+        with trace_span("stage_index"):
+            try:
+                snap = await page.evaluate(STAGE_INDEX_JS)
+            except:
+                snap = {"cards": [], "tabs": [], "buttons": []}
+        q._STAGE_INDEX[key] = snap
+    return snap
+
+async def click_indexed(page, item) -> bool:
+    invalidate_stage_index(page)
+    if item.get("inView"):
+        await page.mouse.click(item["cx"], item["cy"])
+        return True
+    try:
+        pos = await page.evaluate(INDEX_HANDLE_CENTER_JS, item["h"])
+    except:
+        pos = None
+    if not pos:
+        return False
+    await page.mouse.click(pos[0], pos[1])
+    return True
+
+async def index_cards(page, text: str, whole_word: bool):
+    return match_cards((await stage_index(page))["cards"], text, whole_word)
+
+async def _click_pick(page, items, nth: int) -> bool:
+    return len(items) > nth and await click_indexed(page, items[nth])
+
+async def _click_picks(page, picks, nth: int) -> bool:
+    for items in picks:
+        if await _click_pick(page, items, nth):
+            return True
+    return False
+
+async def _click_nth(loc, nth: int = 0, **kwargs) -> bool:
+    if await loc.count() > nth:
+        await loc.nth(nth).click(**kwargs)
+        return True
+    return False
+
+async def _click_article_of(loc, nth: int = 0) -> bool:
+    if await loc.count() <= nth:
+        return False
+    art = loc.nth(nth).locator(ARTICLE_OF_XPATH)
+    if await art.count() > 0:
+        await art.first.click()
+    else:
+        await loc.nth(nth).click()
+    return True
+
+# ====== HELPERS DE CLIQUE ======
+
+@traced
+async def click_stage_action_by_text(page, text: str, nth: int = 0, whole_word: bool = False) -> bool:
+    target = normalize(text)
+    if not target:
+        return False
+    try:
+        return bool(await page.evaluate(
+            CLICK_STAGE_TEXT_JS,
+            {"target": target, "nth": nth, "wholeWord": whole_word},
+        ))
+    except:
+        return False
+
+@traced
+async def click_menu_item(page, name: str) -> bool:
+    rx_name = exact_rx(name)
+    whole_word = is_acronym(name)
+
+    async def by_index(page, nth):
+        return await _click_picks(page, menu_picks(await stage_index(page), name, whole_word), nth)
+
+    async def by_role(page, nth):
+        try:
+            await page.get_by_role("button", name=rx_name).first.wait_for(state="visible", timeout=2500)
+        except:
+            pass
+        return await _click_nth(page.get_by_role("button", name=rx_name), nth)
+
+    async def by_stage_js(page, nth):
+        return await click_stage_action_by_text(page, name, nth=nth, whole_word=whole_word)
+
+    async def by_stage_text(page, nth):
+        return await _click_nth(page.locator(STAGE_SELECTOR).get_by_text(name, exact=whole_word), nth)
+
+    async def by_text(page, nth):
+        return not whole_word and await _click_nth(page.locator(f"text={name}"), nth)
+
+    strategies = {
+        "index": by_index,
+        "role": by_role,
+        "stage_js": by_stage_js,
+        "stage_text": by_stage_text,
+        "text": by_text,
+    }
+
+    for attempt in range(6):
+        try:
+            await page.mouse.wheel(0, -3000)
+        except:
+            pass
+        await page.wait_for_timeout(300)
+
+        trace_note(target=name, attempts=attempt + 1)
+        if await resolve_cached(page, "menu", name, strategies):
+            return True
+
+        wait_ms = retry_wait_ms(attempt, 6)
+        if wait_ms is None:
+            break
+        await wait_qlik(page, extra_ms=wait_ms)
+
+    print(f"[AVISO] Menu '{name}' não encontrado.")
+    return False
+
+@traced
+async def click_text(page, text: str, nth: int = 0) -> bool:
+    stage = page.locator(STAGE_SELECTOR)
+    whole_word = is_acronym(text)
+    txt_rx = _text_rx(text, whole_word)
+
+    async def by_index(page, n):
+        return await _click_pick(page, await index_cards(page, text, whole_word), n)
+
+    async def by_footnote(page, n):
+        return await _click_article_of(stage.locator(FOOTNOTE_SELECTOR, has_text=txt_rx), n)
+
+    async def by_stage_text(page, n):
+        return await _click_nth(stage.get_by_text(text, exact=whole_word), n)
+
+    async def by_stage_js(page, n):
+        return await click_stage_action_by_text(page, text, nth=n, whole_word=whole_word)
+
+    strategies = {
+        "index": by_index,
+        "footnote": by_footnote,
+        "stage_text": by_stage_text,
+        "stage_js": by_stage_js,
+    }
+    return await resolve_cached(page, "text", f"{text}#{nth}", strategies, nth_options=(nth,))
+
+@traced
+async def click_button(page, name: str, nth: int = 0) -> bool:
+    return await _click_nth(page.get_by_role("button", name=name), nth)
+
+def _tab_strategies(page, label_options):
+    labels = tab_labels(label_options)
+    stage = page.locator(STAGE_SELECTOR)
+
+    async def by_index(page, nth):
+        return await _click_picks(page, tab_picks(await stage_index(page), labels), nth)
+
+    async def by_role(page, nth):
+        for label in labels:
+            if await _click_nth(stage.get_by_role("tab", name=exact_rx(label)), nth):
+                return True
+        return False
+
+    async def by_tab_button(page, nth):
+        for label in labels:
+            rx = re.compile(re.escape(label), re.IGNORECASE)
+            if await _click_nth(stage.locator(TAB_BUTTON_SELECTOR, has_text=rx), nth):
+                return True
+        return False
+
+    async def by_js(page, nth):
+        try:
+            return bool(await page.evaluate(CLICK_TAB_JS, {"labels": labels, "nth": nth}))
+        except:
+            return False
+
+    return {"index": by_index, "role": by_role, "tab_button": by_tab_button, "js": by_js}
+
+@traced
+async def click_tab(page, label_options, nth: int = 0) -> bool:
+    if not label_options:
+        return False
+    return await resolve_cached(page, "tab", f"{label_options[0]}#{nth}", _tab_strategies(page, label_options),
+                                nth_options=(nth,))
+
+@traced
+async def click_tab_any_nth(page, label_options, nth_options) -> bool:
+    nth_options = list(nth_options or [0])
+    if not label_options:
+        return False
+    target = f"{label_options[0]}@{','.join(map(str, nth_options))}"
+    return await resolve_cached(page, "tab", target, _tab_strategies(page, label_options), nth_options=nth_options)
+
+@traced
+async def click_by_bg_image(page, img_substring: str, nth: int = 0) -> bool:
+    raw = (img_substring or "").strip()
+    if not raw:
+        return False
+    tokens = bg_image_tokens(raw)
+
+    async def by_index(page, n):
+        return await _click_picks(page, bg_picks(await stage_index(page), raw, tokens), n)
+
+    async def by_stage_style(page, n):
+        return await _click_nth(page.locator(bg_style_selector(raw, True)), n, force=True)
+
+    async def by_page_style(page, n):
+        return await _click_nth(page.locator(bg_style_selector(raw, False)), n, force=True)
+
+    async def by_js(page, n):
+        try:
+            return bool(await page.evaluate(CLICK_BG_IMAGE_JS, {"tokens": tokens, "nth": n}))
+        except:
+            return False
+
+    strategies = {
+        "index": by_index,
+        "stage_style": by_stage_style,
+        "page_style": by_page_style,
+        "js": by_js,
+    }
+    return await resolve_cached(page, "bg", f"{raw}#{nth}", strategies, nth_options=(nth,))
+
+@traced
+async def click_card_like(page, contains_text: str, nth: int = 0) -> bool:
+    txt = (contains_text or "").strip()
+    if not txt:
+        return False
+
+    stage = page.locator(STAGE_SELECTOR)
+    whole_word = is_acronym(txt)
+    txt_rx = _text_rx(txt, whole_word)
+
+    async def by_index(page, n):
+        return await _click_pick(page, await index_cards(page, txt, whole_word), n)
+
+    async def by_footnote(page, n):
+        return await _click_article_of(stage.locator(FOOTNOTE_SELECTOR, has_text=txt_rx), n)
+
+    async def by_stage_text(page, n):
+        return await _click_article_of(stage.get_by_text(txt, exact=whole_word), n)
+
+    async def by_stage_js(page, n):
+        return await click_stage_action_by_text(page, txt, nth=n, whole_word=whole_word)
+
+    strategies = {
+        "index": by_index,
+        "footnote": by_footnote,
+        "stage_text": by_stage_text,
+        "stage_js": by_stage_js,
+    }
+    return await resolve_cached(page, "card", f"{txt}#{nth}", strategies, nth_options=(nth,))
+
+@traced
+async def open_card(page, text_options=None, image_options=None, attempts: int = 4) -> bool:
+    text_options = text_options or []
+    image_options = image_options or []
+
+    for attempt in range(max(1, attempts)):
+        trace_note(attempts=attempt + 1)
+        for txt in text_options:
+            if await click_card_like(page, txt):
+                return True
+
+        for img in image_options:
+            if await click_by_bg_image(page, img, nth=0):
+                return True
+
+        wait_ms = retry_wait_ms(attempt, attempts)
+        if wait_ms is None:
+            break
+        await wait_qlik(page, extra_ms=wait_ms)
+
+    return False
+
+@traced
+async def back(page) -> bool:
+    if await click_stage_action_by_text(page, "Voltar"):
+        await wait_qlik(page, extra_ms=3500)
+        return True
+
+    stage = page.locator(STAGE_SELECTOR)
+    loc = stage.get_by_role("button", name=VOLTAR_RX)
+    if await loc.count() > 0:
+        await loc.first.click()
+        await wait_qlik(page, extra_ms=3500)
+        return True
+
+    if await _click_article_of(stage.locator(FOOTNOTE_SELECTOR, has_text=VOLTAR_RX)):
+        await wait_qlik(page, extra_ms=3500)
+        return True
+
+    return False
+
+@traced
+async def back_to_om(page, om: str) -> bool:
+    if await back(page):
+        return True
+
+    if await click_menu_item(page, om):
+        await wait_qlik(page, extra_ms=5000)
+        return True
+
+    return False
+
+@traced
+async def ensure_stage_texts(page, om: str, groups) -> bool:
+    found = False
+    for _ in range(2):
+        stage = page.locator(STAGE_SELECTOR)
+        found = True
+        for texts in groups:
+            counts = [await stage.get_by_text(t, exact=False).count() for t in texts]
+            if not any(counts):
+                found = False
+                break
+        if found:
+            break
+        await click_menu_item(page, om)
+        await wait_qlik(page, extra_ms=4500)
+
+    if not found:
+        print(f"[AVISO] {om}: tela principal não confirmou os {len(groups)} cards antes da captura.")
+    return True
+
+async def _wheel(page, dy: int, pause_ms: int = 1500) -> bool:
+    try:
+        await page.mouse.wheel(0, dy)
+        await page.wait_for_timeout(pause_ms)
+    except:
+        pass
+    invalidate_stage_index(page)
+    return True
+
+PLAN_ACTIONS = {
+    "menu": click_menu_item,
+    "text": click_text,
+    "button": click_button,
+    "card": click_card_like,
+    "open": lambda page, texts, images: open_card(page, text_options=texts, image_options=images),
+    "bg": click_by_bg_image,
+    "tab": click_tab_any_nth,
+    "back": back,
+    "back_to_om": back_to_om,
+    "ensure": ensure_stage_texts,
+    "wheel": _wheel,
+}
+
+# ====== CAPTURA ======
+
+async def _cdp_session(page):
+    key = id(page)
+    if key not in q._CDP_SESSIONS:
+        try:
+            q._CDP_SESSIONS[key] = await page.context.new_cdp_session(page)
+        except:
+            q._CDP_SESSIONS[key] = None
+        q.hook_stage_index(page)
+    return q._CDP_SESSIONS[key]
+
+async def probe_frame(page, clip) -> bytes:
+    cdp = await _cdp_session(page)
+    if cdp is not None:
+        try:
+            res = await cdp.send("Page.captureScreenshot", {
+                "format": "png",
+                "clip": q.cdp_clip(clip, await page.evaluate(q.SCROLL_JS)),
+                "captureBeyondViewport": False,
+            })
+            return base64.b64decode(res["data"])
+        except:
+            q.drop_cdp_session(page)
+    return await page.screenshot(clip=clip, type="jpeg", quality=30)
+
+# ====== REDE, SESSÃO E NAVEGADOR ======
+
+async def _route_request(route, request):
+    kind, *hit = q.route_decision(request)
+    if kind == "abort":
+        await route.abort()
+    elif kind == "fulfill":
+        status, headers, body = hit
+        await route.fulfill(status=status, headers=headers, body=body)
+    elif kind == "fetch":
+        try:
+            resp = await route.fetch()
+            body = await resp.body()
+        except:
+            await route.continue_()
+            return
+        q.cache_fetched(request, resp.status, resp.headers, body)
+        await route.fulfill(response=resp, body=body)
+    else:
+        await route.continue_()
+
+async def _replay_route(route, request):
+    hit = q.replay_http(request)
+    if hit is None:
+        await route.abort()
+        return
+    status, headers, body, delay_ms = hit
+    if delay_ms:
+        await asyncio.sleep(delay_ms / 1000)
+    await route.fulfill(status=status, headers=headers, body=body)
+
+_REPLAY_TASKS = set()
+
+async def setup_replay_page(page):
+    if q.REPLAY_DIR:
+        await page.route_web_socket(re.compile(r"^wss?://"), lambda ws: _replay_socket(page, ws))
+
+def _replay_socket(page, ws):
+    state, hello = q.replay_socket_opened(page)
+
+    async def reply(msg):
+        for payload, delay_ms in q.replay_rpc(msg):
+            if delay_ms:
+                await asyncio.sleep(delay_ms / 1000)
+            ws.send(payload)
+            q.replay_replied(state, ws, payload)
+
+    def on_message(payload):
+        for msg in q.replay_requests(state, ws, payload):
+            # uma tarefa por pedido: as respostas se sobrepõem como no servidor
+            task = asyncio.ensure_future(reply(msg))
+            _REPLAY_TASKS.add(task)
+            task.add_done_callback(_REPLAY_TASKS.discard)
+
+    ws.on_message(on_message)
+    for payload in hello:
+        ws.send(payload)
+
+async def setup_network(context, use_route: bool = True):
+    context.on("response", q._count_response)
+    if q.REPLAY_DIR:
+        await context.route("**/*", _replay_route)
+    elif q.NETWORK_FILTER and use_route:
+        await context.route("**/*", _route_request)
+
+async def launch_browser(p):
+    if q.CDP_ENDPOINT:
+        return await p.chromium.connect_over_cdp(q.CDP_ENDPOINT)
+    return await p.chromium.launch(**q.launch_options())
+
+async def new_capture_context(browser):
+    context = await browser.new_context(**q.context_options())
+    await setup_network(context)
+    return context
+
+async def save_storage_state(context):
+    if not q.REUSE_STORAGE_STATE:
+        return
+    try:
+        tmp = q.storage_state_tmp()
+        await context.storage_state(path=tmp)
+        q.commit_storage_state(tmp)
+    except Exception as e:
+        print(f"[AVISO] Não consegui salvar a sessão ({e}).")
+
+@traced
+async def open_start_page(page):
+    q.track_engine(page)
+    await setup_replay_page(page)
+    await page.goto(q.QLIK_URL, wait_until="domcontentloaded", timeout=q.WAIT_MAX_MS)
+    await wait_qlik(page, extra_ms=4500)
+
+async def open_capture_context(p):
+    """
+    Contexto do roteiro sequencial, como o open_capture_context sync
+    (perfil persistente ou navegador novo). Devolve (context, fechar).
+    """
+    if q.PERSISTENT_PROFILE and not q.CDP_ENDPOINT:
+        context = await p.chromium.launch_persistent_context(**q.persistent_context_options())
+        await setup_network(context, use_route=False)
+        return context, context.close
+
+    browser = await launch_browser(p)
+    context = await new_capture_context(browser)
+
+    async def close():
+        await context.close()
+        await browser.close()
+    return context, close
+
+async def capture_sequential(p, branches, run):
+    q.trace_lane("roteiro")
+    context, close = await open_capture_context(p)
+    page = context.pages[0] if context.pages else await context.new_page()
+    await run_ops(page, q.run_branches_ops(page, branches, run))
+    await save_storage_state(context)
+    await close()
+
+async def capture_branch_isolated(browser, name, steps, run):
+    """
+    Um ramo em contexto/página próprios, na sua própria faixa do trace.
+    """
+    q.trace_lane(name)
+    context = await new_capture_context(browser)
+    try:
+        page = await context.new_page()
+        await run_ops(page, q.run_branches_ops(page, [(name, steps)], run))
+        await save_storage_state(context)
+    except Exception as e:
+        q.branch_interrupted(run, name, e)
+    finally:
+        try:
+            await context.close()
+        except:
+            pass
+
+async def capture_async(branches, run, workers: int = 1):
+    """
+    Captura os ramos com até `workers` páginas ao mesmo tempo num único
+    navegador e event loop. workers=1 = roteiro sequencial numa página só;
+    senão cada ramo tem contexto próprio, como no modo paralelo sync.
+    """
+    async with async_playwright() as p:
+        if workers <= 1:
+            await capture_sequential(p, branches, run)
+            return
+        browser = await launch_browser(p)
+        sem = asyncio.Semaphore(workers)
+
+        async def one(name, steps):
+            async with sem:
+                await capture_branch_isolated(browser, name, steps, run)
+                print(f"[INFO] Ramo {name} concluído.")
+        try:
+            await asyncio.gather(*(one(name, steps) for name, steps in branches))
+        finally:
+            await browser.close()
+
+def run_capture(branches, run, workers: int = 1):
+    """
+    Entrada sync: roda o roteiro async até o fim.
+    """
+    asyncio.run(capture_async(branches, run, workers))
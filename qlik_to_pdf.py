@@ -1,17 +1,128 @@
+import argparse
+import base64
+import contextlib
+import contextvars
+import functools
+import hashlib
+import inspect
+import io
+import itertools
+import json
 import os
+import queue
 import re
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
 import unicodedata
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
 from PIL import Image
-from playwright.sync_api import sync_playwright, TimeoutError as PWTimeout
+from playwright.sync_api import sync_playwright
 
 # ====== CONFIGURE AQUI ======
 QLIK_URL = r"https://acesso.sigaer.intraer:5432/mashup/sense/app/85e81e92-7767-4397-896a-3c78068598b8/sheet/cf6953e4-a968-4199-9046-436886ba2fe0/state/analysis"
 OUTPUT_DIR = r"K:\e-GovEns\print\pdfs"
 TMP_DIR = r"K:\e-GovEns\print\tmp"
 WAIT_MAX_MS = 300_000
+# headless para rodar nos servidores Linux; BROWSER_CHANNEL=None usa o Chromium do Playwright
+HEADLESS = False
+BROWSER_CHANNEL = "chrome"
+# filtro de rede (ver NETWORK_RULES): bloqueia telemetria e cacheia fontes/JS/CSS/imagens
+NETWORK_FILTER = True
+# Sessão entre execuções, na máquina local (não no K:, o storage state tem cookies):
+# storage state (login) sempre; PERSISTENT_PROFILE = perfil do Chrome com cache HTTP
+SESSION_DIR = os.path.join(os.path.expanduser("~"), ".qlik_to_pdf")
+REUSE_STORAGE_STATE = True
+PERSISTENT_PROFILE = False
+SESSION_MAX_AGE_H = 12
+# 1 = roteiro sequencial numa única página; >1 = cada OM em contexto próprio
+PARALLEL_WORKERS = 1
+# True = captura pelo qlik_async (playwright.async_api): as páginas do modo
+# paralelo rodam num único event loop, sem uma thread/driver por ramo
+ASYNC_CAPTURE = False
+# Lote (--batch jobs.json): quantos jobs rodam ao mesmo tempo, cada um num
+# contexto do mesmo Chrome, e o tempo máximo de cada job
+BATCH_SLOTS = 3
+BATCH_JOB_TIMEOUT_MIN = 60
+# wait_qlik: janela sem mutações no stage, tempo com objetos parados e teto mínimo
+WAIT_QUIET_MS = 600
+WAIT_STABLE_MS = 400
+WAIT_MIN_CAP_MS = 2500
+WAIT_VERBOSE = False
+# Tetos do wait_qlik pelo histórico (TMP_DIR/wait_history.json). Cada ponto de
+# espera (passo + teto fixo do código) guarda as últimas WAIT_HISTORY_N medições
+# até ficar pronto; com WAIT_HISTORY_MIN delas o teto vira
+# p95 * WAIT_BUDGET_FACTOR + WAIT_BUDGET_MARGIN_MS (no máximo 2x o fixo).
+# Espera que bate no teto ou passo que falha dobra o teto daquele ponto (até
+# 3 dobras) e cada execução sem estouro desfaz uma.
+ADAPTIVE_WAITS = True
+WAIT_HISTORY_N = 30
+WAIT_HISTORY_MIN = 5
+WAIT_BUDGET_FACTOR = 1.2
+WAIT_BUDGET_MARGIN_MS = 500
+# Prazos: RUN_DEADLINE_MIN = tempo máximo da captura (0 = sem prazo; o que
+# ficar de fora sai no --resume). STEP_BUDGET_S = tempo máximo de um passo:
+# as esperas e tentativas dos helpers param aí, e o passo que falha por
+# estouro recarrega o QLIK_URL e entra de novo na OM do ramo.
+RUN_DEADLINE_MIN = 45
+STEP_BUDGET_S = 40
+# wait_qlik pelo engine: pronto = nenhuma requisição JSON-RPC em voo no
+# WebSocket do Qlik há WAIT_ENGINE_GRACE_MS (sem WebSocket: só o critério do DOM)
+WAIT_ENGINE = True
+WAIT_ENGINE_GRACE_MS = 300
+# True = capturas ficam em memória (bytes do page.screenshot) até o PDF,
+# sem ida e volta ao TMP_DIR; DEBUG_SAVE_PNG ainda grava cópia para depuração
+SHOTS_IN_MEMORY = False
+DEBUG_SAVE_PNG = True
+# Duplicatas por hash de blocos: "flag" avisa e mantém a página, "drop"
+# descarta quase-cópia da captura anterior, "off" desliga. O roteiro é fixo
+# (páginas na ordem do anexo): descartar só em capturas que pedem no plano,
+# shot(..., dup="drop"). Limiar = nº de blocos diferentes.
+DUP_MODE = "flag"
+DUP_HASH_GRID = (32, 18)
+DUP_BLOCK_TOLERANCE = 4
+DUP_HASH_THRESHOLD = 0
+# Codificação das páginas do PDF: "auto" = o menor entre Flate sem perdas
+# (paleta quando a tela tem até 256 cores) e JPEG; ou fixo "flate", "palette"
+# (quantiza em 256 cores, texto continua nítido) ou "jpeg". PDF_MAX_MB é o
+# orçamento do arquivo (0 = sem limite): página acima da sua fatia desce para
+# paleta/JPEG mais baixo. PDF_REPORT lista bytes e tempo de cada página.
+PDF_ENCODER = "auto"
+PDF_JPEG_QUALITY = 85
+PDF_MAX_MB = 0
+PDF_REPORT = True
+# processos que decodificam/codificam as páginas em paralelo (1 = no próprio processo)
+PDF_WORKERS = 2
+# Cache de páginas já codificadas (SESSION_DIR/page_cache, disco local e não
+# o K:), pelo sha256 do PNG capturado: tela idêntica à de uma execução
+# anterior entra no PDF sem decodificar/codificar de novo. Compartilhado
+# pelos jobs do lote e shards da máquina. PAGE_CACHE_MB = teto (sai a menos usada).
+PAGE_CACHE = True
+PAGE_CACHE_MB = 300
+# Trace de tempos por passo/helper (JSON do Chrome ao lado do PDF + resumo no fim)
+TRACE_ENABLED = True
+# Antes do screenshot: "pixels" = espera N quadros reduzidos idênticos do clip
+# (teto SHOT_MAX_SETTLE_MS); "fixed" = 1500 ms fixos como antes
+SHOT_SETTLE_MODE = "pixels"
+SHOT_STABLE_FRAMES = 3
+SHOT_FRAME_INTERVAL_MS = 120
+SHOT_MAX_SETTLE_MS = 5000
+SHOT_PROBE_SCALE = 0.125
+# Replay (--replay DIR): REPLAY_SPEED multiplica os tempos de resposta gravados
+# (0 = sem espera, 1 = como gravado, 2 = servidor duas vezes mais lento) e
+# REPLAY_LATENCY_MS soma uma latência fixa a cada resposta HTTP e do engine
+REPLAY_SPEED = 1.0
+REPLAY_LATENCY_MS = 0
+# Links diretos (sheet_links.json): passo de navegação já visto vira page.goto
+# na URL da tela, e o "Voltar" antes dele é pulado; False = sempre por clique
+DEEP_LINKS = True
 
 # ============================K:\e-GovEns\print\pdfs
 
@@ -32,6 +143,258 @@ def is_acronym(text: str) -> bool:
     txt = (text or "").strip()
     return bool(re.fullmatch(r"[A-Za-z0-9]{2,4}", txt))
 
+# ====== TRACE (perfil da execução) ======
+# Spans aninhados por thread (ou por tarefa asyncio, ver trace_lane),
+# exportados no formato "trace event" do Chrome (abrir em chrome://tracing
+# ou https://ui.perfetto.dev). A pilha fica num ContextVar: cada thread e
+# cada tarefa asyncio tem a sua.
+_TRACE_EVENTS = []
+_TRACE_THREADS = {}
+_TRACE_STACK = contextvars.ContextVar("trace_stack", default=())
+_TRACE_LANE = contextvars.ContextVar("trace_lane", default=None)
+_TRACE_T0 = time.perf_counter()
+
+def _trace_tid() -> int:
+    lane = _TRACE_LANE.get()
+    if lane is not None:
+        return lane
+    tid = threading.get_ident()
+    if tid not in _TRACE_THREADS:
+        _TRACE_THREADS[tid] = threading.current_thread().name
+    return tid
+
+def trace_lane(name: str):
+    """
+    Dá à tarefa asyncio atual uma raia própria no trace: as tarefas dividem
+    a mesma thread e os spans delas se sobreporiam numa raia só.
+    """
+    lane = 1_000_000 + len(_TRACE_THREADS)
+    _TRACE_THREADS[lane] = name
+    _TRACE_LANE.set(lane)
+
+@contextlib.contextmanager
+def trace_span(name: str, **args):
+    """
+    Mede um trecho. Os args do span podem ser completados com trace_note()
+    enquanto ele estiver aberto (tentativas, estratégia vencedora...).
+    """
+    if not TRACE_ENABLED:
+        yield args
+        return
+    ev = {"name": name, "args": args}
+    token = _TRACE_STACK.set(_TRACE_STACK.get() + (ev,))
+    t0 = time.perf_counter()
+    try:
+        yield args
+    finally:
+        _TRACE_STACK.reset(token)
+        ev.update(
+            ph="X",
+            ts=(t0 - _TRACE_T0) * 1e6,
+            dur=(time.perf_counter() - t0) * 1e6,
+            pid=os.getpid(),
+            tid=_trace_tid(),
+        )
+        _TRACE_EVENTS.append(ev)
+
+def trace_note(**kwargs):
+    stack = _TRACE_STACK.get() if TRACE_ENABLED else None
+    if stack:
+        stack[-1]["args"].update(kwargs)
+
+def traced(fn):
+    """
+    Envolve o helper num span com o nome da função; resultado bool vira args.ok.
+    Serve também para os helpers async (qlik_async) e para os geradores de
+    operações (ver run_ops), com o nome sem o sufixo _ops.
+    """
+    name = fn.__name__[:-len("_ops")] if fn.__name__.endswith("_ops") else fn.__name__
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            with trace_span(name) as span_args:
+                result = await fn(*args, **kwargs)
+                if isinstance(result, bool):
+                    span_args["ok"] = result
+                return result
+        return async_wrapper
+
+    if inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def gen_wrapper(*args, **kwargs):
+            with trace_span(name) as span_args:
+                result = yield from fn(*args, **kwargs)
+                if isinstance(result, bool):
+                    span_args["ok"] = result
+                return result
+        return gen_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with trace_span(name) as span_args:
+            result = fn(*args, **kwargs)
+            if isinstance(result, bool):
+                span_args["ok"] = result
+            return result
+    return wrapper
+
+def export_trace(path: str):
+    events = sorted(_TRACE_EVENTS, key=lambda ev: ev["ts"])
+    meta = [
+        {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+         "args": {"name": _TRACE_THREADS.get(tid, str(tid))}}
+        for tid in sorted({ev["tid"] for ev in events})
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": meta + events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+def trace_summary(top: int = 15):
+    """
+    Agrega os spans por nome: chamadas, tempo total (inclusivo) e tempo
+    próprio (sem os filhos). Ordena pelos maiores consumidores de tempo próprio.
+    """
+    rows = {}
+    by_tid = {}
+    for ev in _TRACE_EVENTS:
+        by_tid.setdefault(ev["tid"], []).append(ev)
+
+    for events in by_tid.values():
+        events.sort(key=lambda ev: (ev["ts"], -ev["dur"]))
+        stack = []
+        self_us = {}
+        for ev in events:
+            while stack and stack[-1]["ts"] + stack[-1]["dur"] <= ev["ts"]:
+                stack.pop()
+            if stack:
+                self_us[id(stack[-1])] -= ev["dur"]
+            self_us[id(ev)] = ev["dur"]
+            stack.append(ev)
+        for ev in events:
+            row = rows.setdefault(ev["name"], [0, 0.0, 0.0, 0.0])
+            row[0] += 1
+            row[1] += ev["dur"]
+            row[2] += self_us[id(ev)]
+            row[3] = max(row[3], ev["dur"])
+
+    ranked = sorted(rows.items(), key=lambda kv: kv[1][2], reverse=True)[:top]
+    return [(name, n, total / 1000, own / 1000, mx / 1000) for name, (n, total, own, mx) in ranked]
+
+def print_trace_summary(top: int = 15):
+    rows = trace_summary(top)
+    if not rows:
+        return
+    print("\n[INFO] Maiores consumidores de tempo (ms):")
+    print(f"  {'span':<44} {'n':>5} {'total':>10} {'próprio':>10} {'máx':>9}")
+    for name, n, total, own, mx in rows:
+        print(f"  {name[:44]:<44} {n:>5} {total:>10.0f} {own:>10.0f} {mx:>9.0f}")
+
+# ====== OPERAÇÕES DE PÁGINA ======
+# O que é decisão (esperas, estabilização da tela, executor do plano,
+# links diretos, recuperação) fica em geradores *_ops, comuns ao roteiro
+# sync e ao qlik_async: eles não falam com o navegador, só pedem operações
+# (yield ("goto", url)) e recebem o resultado no lugar do yield; se a
+# operação falhar, a exceção sobe dentro do gerador, no mesmo ponto. Cada
+# driver tem o seu run_ops e a sua tabela de operações (aqui, a API sync).
+#
+#   sleep ms               espera fixa (deixa o Playwright entregar eventos)
+#   evaluate js, arg       page.evaluate
+#   count seletor          quantos elementos casam
+#   box seletor            bounding box do 1º elemento (ou None)
+#   goto url               navega (domcontentloaded, WAIT_MAX_MS)
+#   start                  abre o QLIK_URL (open_start_page)
+#   wait extra_ms          wait_qlik
+#   action nome, args      helper do PLAN_ACTIONS
+#   shot n, rótulo         capture_shot
+#   probe clip             quadro reduzido para a estabilização
+#   screenshot png, clip   captura final (clip None = viewport)
+
+def run_ops(page, gen):
+    """
+    Roda um gerador *_ops na página com a API sync e devolve o valor final dele.
+    """
+    result, error = None, None
+    try:
+        while True:
+            try:
+                op = gen.throw(error) if error else gen.send(result)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                result, error = PAGE_OPS[op[0]](page, *op[1:]), None
+            except Exception as e:
+                result, error = None, e
+    finally:
+        gen.close()
+
+def _first_box(page, selector):
+    loc = page.locator(selector)
+    return loc.first.bounding_box() if loc.count() > 0 else None
+
+def _screenshot(page, path, clip):
+    if clip:
+        return page.screenshot(path=path, clip=clip)
+    # fallback: se não achar o logo, captura normal
+    return page.screenshot(path=path, full_page=False)
+
+# as funções são procuradas na hora: valem as trocas de config/testes
+PAGE_OPS = {
+    "sleep": lambda page, ms: page.wait_for_timeout(ms),
+    "evaluate": lambda page, js, arg=None: page.evaluate(js, arg),
+    "count": lambda page, selector: page.locator(selector).count(),
+    "box": _first_box,
+    "goto": lambda page, url: page.goto(url, wait_until="domcontentloaded", timeout=WAIT_MAX_MS),
+    "start": lambda page: open_start_page(page),
+    "wait": lambda page, extra_ms: wait_qlik(page, extra_ms=extra_ms),
+    "action": lambda page, action, args: PLAN_ACTIONS[action](page, *args),
+    "shot": lambda page, idx, label: capture_shot(page, idx, label),
+    "probe": lambda page, clip: probe_frame(page, clip),
+    "screenshot": _screenshot,
+}
+
+# clica no nth card do stage cujo texto normalizado casa com o alvo
+CLICK_STAGE_TEXT_JS = """({ target, nth, wholeWord }) => {
+    const norm = (s) => (s || "")
+        .normalize("NFD")
+        .replace(/[\\u0300-\\u036f]/g, "")
+        .toLowerCase()
+        .replace(/\\s+/g, " ")
+        .trim();
+
+    const isVisible = (el) => {
+        if (!el) return false;
+        const r = el.getBoundingClientRect();
+        if (!r || r.width < 1 || r.height < 1) return false;
+        const st = window.getComputedStyle(el);
+        return st.display !== "none" && st.visibility !== "hidden";
+    };
+
+    const root = document.querySelector("#qv-stage-container") || document;
+    const cards = Array.from(root.querySelectorAll("article.qv-object"));
+    const matches = cards.filter((card) => {
+        if (!isVisible(card)) return false;
+        const txt = norm(card.innerText || card.textContent || "");
+        if (wholeWord) {
+            if (txt === target) return true;
+            const words = txt.split(/[^a-z0-9]+/).filter(Boolean);
+            return words.includes(target);
+        }
+        return txt.includes(target);
+    });
+
+    const picked = matches[nth];
+    if (!picked) return false;
+
+    picked.scrollIntoView({ block: "center", inline: "center" });
+    const btn = picked.querySelector("button");
+    if (btn && !btn.disabled) {
+        btn.click();
+        return true;
+    }
+    picked.click();
+    return true;
+}"""
+
+@traced
 def click_stage_action_by_text(page, text: str, nth: int = 0, whole_word: bool = False) -> bool:
     """
     Fallback robusto para clicar cards/ações no stage do Qlik, com match
@@ -43,235 +406,892 @@ def click_stage_action_by_text(page, text: str, nth: int = 0, whole_word: bool =
 
     try:
         return bool(page.evaluate(
-            """({ target, nth, wholeWord }) => {
-                const norm = (s) => (s || "")
-                    .normalize("NFD")
-                    .replace(/[\\u0300-\\u036f]/g, "")
-                    .toLowerCase()
-                    .replace(/\\s+/g, " ")
-                    .trim();
-
-                const isVisible = (el) => {
-                    if (!el) return false;
-                    const r = el.getBoundingClientRect();
-                    if (!r || r.width < 1 || r.height < 1) return false;
-                    const st = window.getComputedStyle(el);
-                    return st.display !== "none" && st.visibility !== "hidden";
-                };
-
-                const root = document.querySelector("#qv-stage-container") || document;
-                const cards = Array.from(root.querySelectorAll("article.qv-object"));
-                const matches = cards.filter((card) => {
-                    if (!isVisible(card)) return false;
-                    const txt = norm(card.innerText || card.textContent || "");
-                    if (wholeWord) {
-                        if (txt === target) return true;
-                        const words = txt.split(/[^a-z0-9]+/).filter(Boolean);
-                        return words.includes(target);
-                    }
-                    return txt.includes(target);
-                });
-
-                const picked = matches[nth];
-                if (!picked) return false;
-
-                picked.scrollIntoView({ block: "center", inline: "center" });
-                const btn = picked.querySelector("button");
-                if (btn && !btn.disabled) {
-                    btn.click();
-                    return true;
-                }
-                picked.click();
-                return true;
-            }""",
+            CLICK_STAGE_TEXT_JS,
             {"target": target, "nth": nth, "wholeWord": whole_word},
         ))
     except:
         return False
 
+# Seletores de loaders/spinners do Qlik (ajuste se necessário)
+QLIK_LOADERS = [
+    ".qv-loading",
+    ".qv-loader",
+    ".qv-spinner",
+    ".lui-loading",
+    "[class*='loading']",
+    "[class*='spinner']",
+]
+
+# Roda dentro da página e só resolve quando o stage "assentou":
+# - MutationObserver sem mutações em #qv-stage-container por quietMs;
+# - nenhum loader visível;
+# - bounding boxes dos article.qv-object iguais há stableMs.
+# capMs é só o teto: em dia rápido volta bem antes.
+WAIT_READY_JS = """async ({ capMs, quietMs, stableMs, pollMs, loaders }) => {
+    const t0 = performance.now();
+    const root = document.querySelector("#qv-stage-container") || document.body;
+    let lastMutation = t0;
+    const obs = new MutationObserver(() => { lastMutation = performance.now(); });
+    obs.observe(root, { subtree: true, childList: true, attributes: true, characterData: true });
+
+    const hasLoader = () => loaders.some((s) => {
+        try {
+            return Array.from(document.querySelectorAll(s)).some((el) => {
+                const r = el.getBoundingClientRect();
+                return r.width > 0 && r.height > 0;
+            });
+        } catch {
+            return false;
+        }
+    });
+    const boxes = () => Array.from(root.querySelectorAll("article.qv-object"))
+        .map((el) => {
+            const r = el.getBoundingClientRect();
+            return [r.x, r.y, r.width, r.height].map(Math.round).join(",");
+        })
+        .join("|");
+
+    let lastBoxes = boxes();
+    let boxesSince = t0;
+    let loading = true;
+    try {
+        while (true) {
+            await new Promise((r) => setTimeout(r, pollMs));
+            const now = performance.now();
+            const b = boxes();
+            if (b !== lastBoxes) {
+                lastBoxes = b;
+                boxesSince = now;
+            }
+            loading = hasLoader();
+            const settled = !loading
+                && now - lastMutation >= quietMs
+                && now - boxesSince >= stableMs;
+            if (settled) return { ready: true, ms: now - t0 };
+            if (now - t0 >= capMs) return { ready: false, ms: now - t0, loading };
+        }
+    } finally {
+        obs.disconnect();
+    }
+}"""
+
+# ====== ENGINE (WebSocket JSON-RPC) ======
+# O cliente do Qlik fala com o engine por JSON-RPC num WebSocket: cada
+# requisição ({"id", "method"}: GetLayout, GetHyperCubeData...) recebe uma
+# resposta com o mesmo id. Contando as que estão em voo por página dá para
+# saber quando os cálculos da tela terminaram, sem adivinhar pelo CSS.
+_ENGINE = {}
+ENGINE_STATS = {"requests": 0, "methods": {}, "waits": 0}
+
+def track_engine(page):
+    """
+    Passa a acompanhar os WebSockets da página. Chamar antes do goto,
+    para pegar o socket do engine desde a abertura.
+    """
+    if id(page) in _ENGINE:
+        return
+    _ENGINE[id(page)] = {"pending": {}, "idle_since": time.monotonic(), "sockets": 0}
+    page.on("websocket", lambda ws: _watch_socket(_ENGINE[id(page)], ws))
+    page.on("close", lambda _p: _ENGINE.pop(id(page), None))
+
+def _watch_socket(state, ws):
+    if RECORD_DIR:
+        record_socket(ws)
+    if REPLAY_DIR:
+        # no replay o socket é simulado e quem alimenta o estado é o _replay_socket
+        return
+    state["sockets"] += 1
+    ws.on("framesent", lambda payload: _engine_sent(state, ws, payload))
+    ws.on("framereceived", lambda payload: _engine_received(state, ws, payload))
+    ws.on("close", lambda _ws: _engine_closed(state, ws))
+
+def _rpc_messages(payload):
+    try:
+        msg = json.loads(payload)
+    except:
+        return []
+    return [m for m in (msg if isinstance(msg, list) else [msg]) if isinstance(m, dict)]
+
+def _engine_sent(state, ws, payload):
+    for msg in _rpc_messages(payload):
+        if "id" in msg and "method" in msg:
+            state["pending"][(id(ws), msg["id"])] = msg["method"]
+            state["idle_since"] = None
+            ENGINE_STATS["requests"] += 1
+            methods = ENGINE_STATS["methods"]
+            methods[msg["method"]] = methods.get(msg["method"], 0) + 1
+
+def _engine_received(state, ws, payload):
+    for msg in _rpc_messages(payload):
+        # resposta = tem id e não tem method (notificações do engine não têm id)
+        if "id" in msg and "method" not in msg:
+            state["pending"].pop((id(ws), msg["id"]), None)
+    if not state["pending"] and state["idle_since"] is None:
+        state["idle_since"] = time.monotonic()
+
+def _engine_closed(state, ws):
+    for key in [k for k in state["pending"] if k[0] == id(ws)]:
+        del state["pending"][key]
+    if not state["pending"] and state["idle_since"] is None:
+        state["idle_since"] = time.monotonic()
+
+def engine_in_flight(page):
+    """
+    Métodos JSON-RPC sem resposta nesta página, ou None se a página não
+    tem WebSocket acompanhado (aí o engine não serve de sinal).
+    """
+    state = _ENGINE.get(id(page))
+    if not state or not state["sockets"]:
+        return None
+    return list(state["pending"].values())
+
+def engine_idle_ops(page, cap_ms: float):
+    """
+    Espera nenhuma requisição em voo por WAIT_ENGINE_GRACE_MS seguidos,
+    contados a partir do início da espera (o clique pode ainda não ter
+    disparado o GetLayout quando a espera começa). Página sem estado do
+    engine (nunca acompanhada ou já fechada no meio da espera) devolve False.
+    """
+    t0 = time.monotonic()
+    grace_s = WAIT_ENGINE_GRACE_MS / 1000
+    while True:
+        state = _ENGINE.get(id(page))
+        if state is None:
+            return False
+        now = time.monotonic()
+        if not state["pending"] and now - max(state["idle_since"] or now, t0) >= grace_s:
+            return True
+        if (now - t0) * 1000 >= cap_ms:
+            return False
+        # a espera deixa o Playwright entregar os eventos de frame
+        yield ("sleep", 25)
+
+def print_engine_summary():
+    if not ENGINE_STATS["requests"]:
+        return
+    top = sorted(ENGINE_STATS["methods"].items(), key=lambda kv: -kv[1])[:5]
+    print(
+        f"[INFO] Engine: {ENGINE_STATS['requests']} requisições JSON-RPC "
+        f"({', '.join(f'{m} {n}' for m, n in top)}); {ENGINE_STATS['waits']} esperas pelo engine."
+    )
+
+# Registro de todas as esperas: (teto_ms, esperado_ms, pronto)
+WAIT_LOG = []
+
+# Histórico de esperas: "passo@teto fixo" -> {"ms": [...], "widen": dobras}
+WAIT_HISTORY_FILE = "wait_history.json"
+WAIT_HISTORY = {}
+WAIT_BUDGET_MAX_FACTOR = 2
+WAIT_WIDEN_MAX = 3
+# pontos usados/estourados nesta execução e quanto de teto o histórico cortou
+_WAIT_RUN = {"used": set(), "timeouts": set()}
+WAIT_BUDGET_STATS = {"adaptive": 0, "saved_ms": 0}
+# passo do plano em execução (por thread/tarefa): chave do histórico
+_WAIT_STEP = contextvars.ContextVar("wait_step", default=None)
+
+@contextlib.contextmanager
+def step_span(st):
+    """
+    Span do passo no trace; marca também o passo corrente para o histórico
+    de esperas e abre o prazo do passo (STEP_BUDGET_S).
+    """
+    token = _WAIT_STEP.set(st["id"])
+    deadline = _STEP_DEADLINE.set(time.monotonic() + STEP_BUDGET_S if STEP_BUDGET_S else None)
+    try:
+        with trace_span(f"step:{st['id']}") as args:
+            yield args
+    finally:
+        _STEP_DEADLINE.reset(deadline)
+        _WAIT_STEP.reset(token)
+
+# prazo da execução (time.monotonic), definido no main; vale para todas as threads
+RUN_DEADLINE_AT = None
+_STEP_DEADLINE = contextvars.ContextVar("step_deadline", default=None)
+
+def time_left_ms() -> float:
+    """
+    Quanto falta para o prazo do passo corrente ou da execução (o que vier
+    antes); infinito sem prazo.
+    """
+    deadlines = [d for d in (_STEP_DEADLINE.get(), RUN_DEADLINE_AT) if d is not None]
+    if not deadlines:
+        return float("inf")
+    return (min(deadlines) - time.monotonic()) * 1000
+
+def run_expired() -> bool:
+    return RUN_DEADLINE_AT is not None and time.monotonic() >= RUN_DEADLINE_AT
+
+def _p95(values) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, -(-len(ordered) * 95 // 100) - 1)]
+
+def wait_budget(extra_ms):
+    """
+    Teto da espera: o fixo do código (extra_ms) ou, com histórico
+    suficiente desse ponto, o p95 medido + margem, dobrado a cada estouro
+    recente. Nunca passa do prazo do passo/execução; espera cortada pelo
+    prazo não entra no histórico (chave None). Devolve (chave, teto_ms).
+    """
+    default_ms = max(int(extra_ms or 0), WAIT_MIN_CAP_MS)
+    left_ms = time_left_ms()
+    if left_ms < default_ms:
+        return None, max(int(left_ms), 0)
+    key = f"{_WAIT_STEP.get() or 'inicio'}@{int(extra_ms or 0)}"
+    _WAIT_RUN["used"].add(key)
+    hist = WAIT_HISTORY.get(key)
+    if not ADAPTIVE_WAITS or not hist or len(hist["ms"]) < WAIT_HISTORY_MIN:
+        return key, default_ms
+    budget = (_p95(hist["ms"]) * WAIT_BUDGET_FACTOR + WAIT_BUDGET_MARGIN_MS) * 2 ** hist.get("widen", 0)
+    cap_ms = int(min(max(budget, WAIT_MIN_CAP_MS), default_ms * WAIT_BUDGET_MAX_FACTOR, left_ms))
+    WAIT_BUDGET_STATS["adaptive"] += 1
+    WAIT_BUDGET_STATS["saved_ms"] += default_ms - cap_ms
+    return key, cap_ms
+
+def record_wait(key: str, waited_ms: int, ready: bool):
+    hist = WAIT_HISTORY.setdefault(key, {"ms": [], "widen": 0})
+    if ready:
+        hist["ms"] = (hist["ms"] + [waited_ms])[-WAIT_HISTORY_N:]
+    elif key not in _WAIT_RUN["timeouts"]:
+        # estourou: já vale para as próximas esperas deste ponto nesta execução
+        _WAIT_RUN["timeouts"].add(key)
+        hist["widen"] = min(hist.get("widen", 0) + 1, WAIT_WIDEN_MAX)
+
+def load_wait_history():
+    _WAIT_RUN["used"].clear()
+    _WAIT_RUN["timeouts"].clear()
+    try:
+        with open(os.path.join(TMP_DIR, WAIT_HISTORY_FILE), "r", encoding="utf-8") as f:
+            WAIT_HISTORY.update(json.load(f))
+    except:
+        pass
+
+def save_wait_history(run=None):
+    """
+    Fecha a execução no histórico: passo que falhou ganha uma dobra nos
+    pontos de espera dele; ponto usado sem estouro perde uma.
+    """
+    failed = {sid for sid, status in (run or {}).get("status", {}).items() if status == "fail"}
+    for key in _WAIT_RUN["used"]:
+        hist = WAIT_HISTORY.get(key)
+        if hist is None or key in _WAIT_RUN["timeouts"]:
+            continue
+        if key.split("@")[0] in failed:
+            hist["widen"] = min(hist.get("widen", 0) + 1, WAIT_WIDEN_MAX)
+        elif hist.get("widen"):
+            hist["widen"] -= 1
+    try:
+        with open(os.path.join(TMP_DIR, WAIT_HISTORY_FILE), "w", encoding="utf-8") as f:
+            json.dump(WAIT_HISTORY, f, ensure_ascii=False, indent=1, sort_keys=True)
+    except Exception as e:
+        print(f"[AVISO] Não consegui gravar o histórico de esperas ({e}).")
+
+@traced
 def wait_qlik(page, extra_ms=0):
+    """
+    Espera o Qlik estabilizar (ver wait_qlik_ops). Retorna quanto tempo a
+    espera realmente levou (ms).
+    """
+    return run_ops(page, wait_qlik_ops(page, extra_ms))
+
+def wait_qlik_ops(page, extra_ms=0):
     """
     Espera o Qlik estabilizar SEM depender de networkidle (que costuma nunca ficar idle).
-    Critério: sumir loaders/spinners e dar um settle curto.
-    """
-    # 1) dá um micro-tempo para iniciar transição
-    page.wait_for_timeout(250 + min(extra_ms, 800))
-
-    # 2) espera loaders comuns do Qlik sumirem (ajuste seletores se necessário)
-    loaders = [
-        ".qv-loading",
-        ".qv-loader",
-        ".qv-spinner",
-        ".lui-loading",
-        "[class*='loading']",
-        "[class*='spinner']",
-    ]
+    Critério (avaliado dentro da página): stage sem mutações, sem loaders e com
+    os objetos parados. Com WAIT_ENGINE e o WebSocket do engine à vista, antes
+    espera o engine responder tudo e o DOM só precisa da folga de render.
+    extra_ms é o teto da espera, não um sleep fixo (com ADAPTIVE_WAITS, o
+    ponto de partida do teto pelo histórico, ver wait_budget).
+    """
+    key, cap_ms = wait_budget(extra_ms)
+    t0 = time.monotonic()
+    ready = False
+    quiet_ms = WAIT_QUIET_MS
 
-    # tenta alguns passes rápidos (sem travar 12s)
-    for _ in range(3):
+    if WAIT_ENGINE and engine_in_flight(page) is not None:
         try:
-            page.wait_for_function(
-                """(sels) => sels.every(s => document.querySelectorAll(s).length === 0)""",
-                arg=loaders,
-                timeout=2500  # curto
-            )
+            engine_ok = yield from engine_idle_ops(page, cap_ms)
+        except Exception:
+            engine_ok = False
+        if engine_ok:
+            ENGINE_STATS["waits"] += 1
+            quiet_ms = min(WAIT_QUIET_MS, WAIT_ENGINE_GRACE_MS)
+        trace_note(engine=engine_ok, in_flight=len(engine_in_flight(page) or []))
+
+    # o evaluate pode cair se a página navegar no meio; repete com o tempo que sobrou
+    while True:
+        left_ms = cap_ms - (time.monotonic() - t0) * 1000
+        if left_ms <= 0:
             break
-        except PWTimeout:
-            pass
+        try:
+            res = yield ("evaluate", WAIT_READY_JS, wait_ready_args(left_ms, quiet_ms))
+            ready = bool(res and res.get("ready"))
+            break
+        except Exception:
+            try:
+                yield ("sleep", 250)
+            except Exception:
+                break
+    return finish_wait(page, cap_ms, t0, ready, key)
+
+def wait_ready_args(left_ms: float, quiet_ms: int):
+    return {
+        "capMs": left_ms,
+        "quietMs": quiet_ms,
+        "stableMs": WAIT_STABLE_MS,
+        "pollMs": 100,
+        "loaders": QLIK_LOADERS,
+    }
+
+def finish_wait(page, cap_ms: int, t0: float, ready: bool, key: str = None) -> int:
+    # o stage assentou num estado novo: o índice anterior não vale mais
+    invalidate_stage_index(page)
+    waited_ms = int((time.monotonic() - t0) * 1000)
+    WAIT_LOG.append((cap_ms, waited_ms, ready))
+    if key:
+        record_wait(key, waited_ms, ready)
+    _sheet_stats(sheet_key(page))["wait_ms"] += waited_ms
+    if WAIT_VERBOSE:
+        status = "pronto" if ready else "teto atingido"
+        print(f"[WAIT] {waited_ms} ms (teto {cap_ms} ms, {status})")
+    return waited_ms
+
+def print_wait_summary():
+    if not WAIT_LOG:
+        return
+    total_ms = sum(w for _cap, w, _ok in WAIT_LOG)
+    cap_total_ms = sum(c for c, _w, _ok in WAIT_LOG)
+    timeouts = sum(1 for _c, _w, ok in WAIT_LOG if not ok)
+    print(
+        f"[INFO] wait_qlik: {len(WAIT_LOG)} esperas, {total_ms / 1000:.1f} s no total "
+        f"(teto somado {cap_total_ms / 1000:.1f} s), {timeouts} no teto."
+    )
+    if WAIT_BUDGET_STATS["adaptive"]:
+        saved_s = WAIT_BUDGET_STATS["saved_ms"] / 1000
+        print(
+            f"[INFO] Tetos pelo histórico: {WAIT_BUDGET_STATS['adaptive']} esperas, teto somado "
+            f"{abs(saved_s):.1f} s {'menor' if saved_s >= 0 else 'maior'} que o dos valores fixos."
+        )
 
-    # 3) settle final pequeno (para garantir render antes do screenshot)
-    page.wait_for_timeout(350 + min(extra_ms, 1200))
+# Cache de estratégias: para cada alvo (helper + tela + texto) guarda qual
+# estratégia da cascata e qual índice nth funcionaram, para tentar essa
+# primeiro nas próximas execuções.
+LOCATOR_CACHE_FILE = "locator_cache.json"
+LOCATOR_CACHE = {}
+LOCATOR_STATS = {"hit": 0, "miss": 0}
 
-def click_menu_item(page, name: str) -> bool:
-    rx_name = re.compile(rf"^\s*{re.escape(name)}\s*$", re.IGNORECASE)
-    whole_word = is_acronym(name)
+def sheet_key(page) -> str:
+    return url_sheet(page.url)
 
-    for attempt in range(6):
-        # evita ficar no meio da rolagem em máquinas mais lentas
-        try:
-            page.mouse.wheel(0, -3000)
-        except:
-            pass
+def url_sheet(url: str) -> str:
+    url = url or ""
+    m = re.search(r"/sheet/([^/?#]+)", url)
+    return m.group(1) if m else url.split("?")[0].split("#")[0]
 
-        try:
-            page.wait_for_timeout(300)
-            # se o seu menu é por role=button com name, isso ajuda o playwright a “ver” o elemento
-            page.get_by_role("button", name=rx_name).first.wait_for(state="visible", timeout=2500)
-        except:
-            pass
+def load_locator_cache():
+    try:
+        with open(os.path.join(TMP_DIR, LOCATOR_CACHE_FILE), "r", encoding="utf-8") as f:
+            LOCATOR_CACHE.update(json.load(f))
+    except:
+        pass
 
-        loc = page.get_by_role("button", name=rx_name)
-        if loc.count() > 0:
-            loc.first.click()
-            return True
+def save_locator_cache():
+    try:
+        with open(os.path.join(TMP_DIR, LOCATOR_CACHE_FILE), "w", encoding="utf-8") as f:
+            json.dump(LOCATOR_CACHE, f, ensure_ascii=False, indent=2, sort_keys=True)
+    except Exception as e:
+        print(f"[AVISO] Não consegui gravar o cache de localizadores ({e}).")
+
+def print_locator_summary():
+    total = LOCATOR_STATS["hit"] + LOCATOR_STATS["miss"]
+    if total:
+        print(f"[INFO] Cache de localizadores: {LOCATOR_STATS['hit']} acertos, {LOCATOR_STATS['miss']} faltas.")
+
+# cascata de cada helper de clique, da estratégia mais barata à mais ampla
+STRATEGY_ORDER = {
+    "menu": ("index", "role", "stage_js", "stage_text", "text"),
+    "text": ("index", "footnote", "stage_text", "stage_js"),
+    "card": ("index", "footnote", "stage_text", "stage_js"),
+    "tab": ("index", "role", "tab_button", "js"),
+    "bg": ("index", "stage_style", "page_style", "js"),
+}
+
+def locator_candidates(page, helper: str, target: str, nth_options=(0,)):
+    """
+    Tentativas (estratégia, nth) de um helper de clique, na ordem: a que
+    funcionou da última vez para este alvo nesta tela e depois a cascata
+    completa. Devolve (chave do cache, tentativas, a tentativa do cache ou None).
+    Entrada com estratégia que o helper não tem mais é descartada.
+    """
+    key = f"{helper}|{sheet_key(page)}|{target}"
+    order = STRATEGY_ORDER[helper]
+    cached = LOCATOR_CACHE.get(key) or {}
+    first = (cached["strategy"], cached.get("nth", 0)) if cached.get("strategy") in order else None
+    if cached and first is None:
+        LOCATOR_CACHE.pop(key, None)
+    rest = [(name, nth) for nth in nth_options for name in order if (name, nth) != first]
+    return key, ([first] if first else []) + rest, first
+
+def locator_found(page, key: str, found, tries: int, first) -> bool:
+    """
+    Fecha a cascata: conta acerto/falta do cache e guarda a tentativa que
+    funcionou (found, ou None se nenhuma: aí a entrada antiga, que também
+    falhou, sai do cache).
+    """
+    if found is not None and found == first:
+        LOCATOR_STATS["hit"] += 1
+        trace_note(strategy=found[0], nth=found[1], cache="hit", tries=tries)
+    else:
+        LOCATOR_STATS["miss"] += 1
+        if found is None:
+            LOCATOR_CACHE.pop(key, None)
+            trace_note(cache="miss", tries=tries)
+            return False
+        LOCATOR_CACHE[key] = {"strategy": found[0], "nth": found[1]}
+        trace_note(strategy=found[0], nth=found[1], cache="miss", tries=tries)
+    invalidate_stage_index(page)
+    return True
 
-        if click_stage_action_by_text(page, name, whole_word=whole_word):
-            return True
+def resolve_cached(page, helper: str, target: str, strategies, nth_options=(0,)) -> bool:
+    """
+    Roda a cascata de estratégias {nome: fn(page, nth)} de um helper de
+    clique na ordem de locator_candidates: a cascata completa só roda quando
+    o cache falha.
+    """
+    key, candidates, first = locator_candidates(page, helper, target, nth_options)
+    for tries, (name, nth) in enumerate(candidates, start=1):
+        if strategies[name](page, nth):
+            return locator_found(page, key, (name, nth), tries, first)
+    return locator_found(page, key, None, len(candidates), first)
 
-        # para siglas curtas (AFA/ECE), evita substring.
-        stage = page.locator("#qv-stage-container")
-        stage_loc = stage.get_by_text(name, exact=whole_word)
-        if stage_loc.count() > 0:
-            stage_loc.first.click()
-            return True
+def retry_wait_ms(attempt: int, attempts: int):
+    """
+    Teto da espera antes da próxima tentativa de um helper de clique, ou
+    None para desistir: era a última ou estourou o STEP_BUDGET_S (o
+    run_steps recupera a página).
+    """
+    if attempt >= attempts - 1 or time_left_ms() <= 0:
+        return None
+    return 1200 + attempt * 350
+
+# Índice do stage: um único evaluate tira um retrato dos elementos clicáveis
+# visíveis (cards, abas, botões) com texto normalizado e centro; os helpers
+# resolvem o alvo no Python e clicam por coordenada/handle, sem a série de
+# count()/nth()/evaluate de cada estratégia. Invalida ao navegar, ao clicar
+# e a cada wait_qlik.
+STAGE_INDEX_JS = """() => {
+    const norm = (s) => (s || "")
+        .normalize("NFD")
+        .replace(/[\\u0300-\\u036f]/g, "")
+        .toLowerCase()
+        .replace(/\\s+/g, " ")
+        .trim();
+    const isVisible = (el) => {
+        if (!el) return false;
+        const r = el.getBoundingClientRect();
+        if (!r || r.width < 1 || r.height < 1) return false;
+        const st = window.getComputedStyle(el);
+        return st.display !== "none" && st.visibility !== "hidden";
+    };
+    const expand = (s) => {
+        const low = (s || "").toLowerCase();
+        try {
+            return low + " " + decodeURIComponent(low);
+        } catch {
+            return low;
+        }
+    };
+
+    const root = document.querySelector("#qv-stage-container") || document;
+    const handles = window.__qlikStageIndex = [];
+    const add = (el) => {
+        handles.push(el);
+        const r = el.getBoundingClientRect();
+        return {
+            h: handles.length - 1,
+            cx: r.x + r.width / 2,
+            cy: r.y + r.height / 2,
+            inView: r.top >= 0 && r.left >= 0 && r.bottom <= window.innerHeight && r.right <= window.innerWidth,
+        };
+    };
+
+    const cards = Array.from(root.querySelectorAll("article.qv-object")).filter(isVisible).map((art) => {
+        const btn = art.querySelector("button");
+        return {
+            ...add(art),
+            text: norm(art.innerText || art.textContent || ""),
+            foot: norm(Array.from(art.querySelectorAll("footer.qv-object-footnote"))
+                .map((f) => f.innerText || f.textContent || "").join(" ")),
+            button: btn && !btn.disabled && isVisible(btn) ? add(btn) : null,
+        };
+    });
+    const tabs = Array.from(root.querySelectorAll("button[role='tab'], [role='tab']")).filter(isVisible).map((tab) => ({
+        ...add(tab),
+        text: norm(tab.innerText || tab.textContent || ""),
+        title: norm(tab.getAttribute("title") || ""),
+        aria: norm(tab.getAttribute("aria-label") || ""),
+    }));
+    const buttons = Array.from(document.querySelectorAll("button, [role='button']")).filter(isVisible).map((btn) => ({
+        ...add(btn),
+        name: norm(btn.getAttribute("aria-label") || btn.innerText || btn.textContent || btn.getAttribute("title") || ""),
+        style: btn.getAttribute("style") || "",
+        bg: expand(btn.getAttribute("style") || "") + " " + expand(window.getComputedStyle(btn).backgroundImage || ""),
+        inStage: root !== document && root.contains(btn),
+    }));
+    return { cards, tabs, buttons };
+}"""
+
+# rola até o elemento do índice e devolve o centro dele (ou null se sumiu do DOM)
+INDEX_HANDLE_CENTER_JS = """(h) => {
+    const el = (window.__qlikStageIndex || [])[h];
+    if (!el || !el.isConnected) return null;
+    el.scrollIntoView({ block: "center", inline: "center" });
+    const r = el.getBoundingClientRect();
+    return [r.x + r.width / 2, r.y + r.height / 2];
+}"""
+
+_STAGE_INDEX = {}
+_INDEX_HOOKED = set()
+
+def invalidate_stage_index(page):
+    _STAGE_INDEX.pop(id(page), None)
+
+def hook_stage_index(page):
+    """
+    Invalida o índice quando a página navega e o esquece quando ela fecha:
+    o id(page) é reaproveitado pelas páginas novas (recarga, pool de
+    contextos) e não pode herdar o gancho nem o índice da página morta.
+    """
+    key = id(page)
+    if key in _INDEX_HOOKED:
+        return
+    _INDEX_HOOKED.add(key)
+    page.on("framenavigated", lambda frame: frame == page.main_frame and invalidate_stage_index(page))
+    page.on("close", lambda _p: _forget_stage_index(key))
 
-        loc2 = page.locator(f"text={name}")
-        if loc2.count() > 0 and not whole_word:
-            loc2.first.click()
-            return True
+def _forget_stage_index(key):
+    _INDEX_HOOKED.discard(key)
+    _STAGE_INDEX.pop(key, None)
+    _CDP_SESSIONS.pop(key, None)
 
-        if attempt < 5:
-            wait_qlik(page, extra_ms=1200 + attempt * 350)
+def stage_index(page):
+    """
+    Retrato do stage da página (em cache até a próxima invalidação).
+    """
+    key = id(page)
+    hook_stage_index(page)
+    snap = _STAGE_INDEX.get(key)
+    if snap is None:
+        with trace_span("stage_index"):
+            try:
+                snap = page.evaluate(STAGE_INDEX_JS)
+            except:
+                snap = {"cards": [], "tabs": [], "buttons": []}
+        _STAGE_INDEX[key] = snap
+    return snap
+
+def click_indexed(page, item) -> bool:
+    """
+    Clica num elemento do índice: direto pela coordenada se estava visível
+    no viewport, senão pelo handle (rola até ele e clica no centro).
+    """
+    invalidate_stage_index(page)
+    if item.get("inView"):
+        page.mouse.click(item["cx"], item["cy"])
+        return True
+    try:
+        pos = page.evaluate(INDEX_HANDLE_CENTER_JS, item["h"])
+    except:
+        pos = None
+    if not pos:
+        return False
+    page.mouse.click(pos[0], pos[1])
+    return True
 
-    print(f"[AVISO] Menu '{name}' não encontrado.")
-    return False
+def _blob_matches(blob: str, target: str, whole_word: bool) -> bool:
+    if whole_word:
+        return blob == target or target in re.split(r"[^a-z0-9]+", blob)
+    return target in blob
 
-def click_text(page, text: str, nth: int = 0) -> bool:
-    stage = page.locator("#qv-stage-container")
-    whole_word = is_acronym(text)
+def match_cards(cards, text: str, whole_word: bool):
+    """
+    Cards do índice que casam com o texto: primeiro pelo footnote,
+    depois pelo texto inteiro do card (mesma prioridade das estratégias).
+    """
+    target = normalize(text)
+    if not target:
+        return []
+    by_foot = [c for c in cards if _blob_matches(c["foot"], target, whole_word)]
+    return by_foot + [c for c in cards if c not in by_foot and _blob_matches(c["text"], target, whole_word)]
 
-    # tenta clicar como footnote (muito comum no Qlik)
-    if whole_word:
-        txt_rx = re.compile(rf"(?<!\w){re.escape(text)}(?!\w)", re.IGNORECASE)
-    else:
-        txt_rx = re.compile(re.escape(text), re.IGNORECASE)
+# Escolhas no índice: listas de candidatos em ordem de preferência; o
+# helper clica o nth da primeira lista que o tiver.
+def menu_picks(index, name: str, whole_word: bool):
+    """
+    Botão com o nome exato; senão o card com o texto (o botão dele, se houver).
+    """
+    target = normalize(name)
+    cards = [c for c in index["cards"] if _blob_matches(c["text"], target, whole_word)]
+    return [[b for b in index["buttons"] if b["name"] == target], [c["button"] or c for c in cards]]
 
-    foot = stage.locator("footer.qv-object-footnote", has_text=txt_rx)
-    if foot.count() > nth:
-        art = foot.nth(nth).locator("xpath=ancestor::article[contains(@class,'qv-object')]")
-        if art.count() > 0:
-            art.first.click()
-        else:
-            foot.nth(nth).click()
-        return True
+def tab_picks(index, labels):
+    """
+    Abas com um dos rótulos exatos (texto ou aria-label), na ordem dos
+    rótulos; senão as que contêm algum deles no texto/title/aria-label.
+    """
+    targets = [normalize(lbl) for lbl in labels]
+    tabs = index["tabs"]
+    exact = [[t for t in tabs if t["text"] == target or t["aria"] == target] for target in targets]
+    return exact + [[t for t in tabs if any(x in f"{t['text']} {t['title']} {t['aria']}" for x in targets)]]
 
-    # fallback: texto normal
-    loc = stage.get_by_text(text, exact=whole_word)
-    if loc.count() > nth:
-        loc.nth(nth).click()
-        return True
+def bg_picks(index, raw: str, tokens):
+    """
+    Botões com a imagem no style (os do stage antes), depois pelos tokens
+    no background (style ou computado, com decode de URL), o que casa o
+    token mais longo primeiro (nome inteiro antes de um pedaço solto).
+    """
+    buttons = index["buttons"]
+    best = {id(b): max((len(t) for t in tokens if t in b["bg"]), default=0) for b in buttons}
+    return [
+        [b for b in buttons if b["inStage"] and raw in b["style"]],
+        [b for b in buttons if raw in b["style"]],
+        sorted((b for b in buttons if best[id(b)]), key=lambda b: -best[id(b)]),
+    ]
 
-    if click_stage_action_by_text(page, text, nth=nth, whole_word=whole_word):
-        return True
+def bg_image_tokens(raw: str):
+    """
+    Pedaços do nome da imagem para achar o botão pelo background: caminho,
+    nome do arquivo, nome sem extensão e as partes dele com 3+ letras.
+    """
+    token_base = raw.lower()
+    base_name = os.path.basename(token_base)
+    stem = base_name.rsplit(".", 1)[0]
+    tokens = {token_base, base_name, stem}
+    tokens.update(part for part in re.split(r"[_\-\s]+", stem) if len(part) >= 3)
+    return [t for t in tokens if t]
 
-    return False
+def index_cards(page, text: str, whole_word: bool):
+    return match_cards(stage_index(page)["cards"], text, whole_word)
 
-def click_button(page, name: str, nth: int = 0) -> bool:
-    loc = page.get_by_role("button", name=name)
+def _click_pick(page, items, nth: int) -> bool:
+    return len(items) > nth and click_indexed(page, items[nth])
+
+def _click_picks(page, picks, nth: int) -> bool:
+    return any(_click_pick(page, items, nth) for items in picks)
+
+# seletores e regex comuns aos dois drivers
+STAGE_SELECTOR = "#qv-stage-container"
+STAGE_OBJECTS_SELECTOR = "#qv-stage-container article.qv-object"
+FOOTNOTE_SELECTOR = "footer.qv-object-footnote"
+ARTICLE_OF_XPATH = "xpath=ancestor::article[contains(@class,'qv-object')]"
+TAB_BUTTON_SELECTOR = "button[role='tab']"
+LOGO_SELECTOR = "div.sheet-title-logo-img"
+
+def exact_rx(text: str):
+    return re.compile(rf"^\s*{re.escape(text)}\s*$", re.IGNORECASE)
+
+VOLTAR_RX = exact_rx("voltar")
+
+def bg_style_selector(raw: str, in_stage: bool) -> str:
+    return f'{STAGE_SELECTOR + " " if in_stage else ""}button[style*="{raw}"]'
+
+def tab_labels(label_options):
+    labels = [(lbl or "").strip() for lbl in (label_options or [])]
+    return [lbl for lbl in labels if lbl]
+
+def _click_nth(loc, nth: int = 0, **kwargs) -> bool:
     if loc.count() > nth:
-        loc.nth(nth).click()
+        loc.nth(nth).click(**kwargs)
         return True
     return False
 
-def click_tab(page, label_options, nth: int = 0) -> bool:
+def _click_article_of(loc, nth: int = 0) -> bool:
     """
-    Clica em abas (role=tab) com variações de rótulo.
+    Clica no article.qv-object pai do nth elemento (área inteira clicável);
+    sem article, clica no próprio elemento.
     """
-    label_options = label_options or []
-    stage = page.locator("#qv-stage-container")
+    if loc.count() <= nth:
+        return False
+    art = loc.nth(nth).locator(ARTICLE_OF_XPATH)
+    if art.count() > 0:
+        art.first.click()
+    else:
+        loc.nth(nth).click()
+    return True
 
-    for label in label_options:
-        label = (label or "").strip()
-        if not label:
-            continue
+def _text_rx(text: str, whole_word: bool):
+    if whole_word:
+        return re.compile(rf"(?<!\w){re.escape(text)}(?!\w)", re.IGNORECASE)
+    return re.compile(re.escape(text), re.IGNORECASE)
 
-        # 1) Role tab com nome (mais confiável)
-        rx = re.compile(rf"^\s*{re.escape(label)}\s*$", re.IGNORECASE)
-        loc = stage.get_by_role("tab", name=rx)
-        if loc.count() > nth:
-            loc.nth(nth).click()
-            return True
+@traced
+def click_menu_item(page, name: str) -> bool:
+    rx_name = exact_rx(name)
+    whole_word = is_acronym(name)
 
-        # 2) Fallback por texto dentro de botões de aba
-        loc2 = stage.locator("button[role='tab']", has_text=re.compile(re.escape(label), re.IGNORECASE))
-        if loc2.count() > nth:
-            loc2.nth(nth).click()
-            return True
+    def by_role(page, nth):
+        try:
+            # se o seu menu é por role=button com name, isso ajuda o playwright a “ver” o elemento
+            page.get_by_role("button", name=rx_name).first.wait_for(state="visible", timeout=2500)
+        except:
+            pass
+        return _click_nth(page.get_by_role("button", name=rx_name), nth)
 
-    # 3) Fallback JS para title/aria-label/texto
-    try:
-        ok = bool(page.evaluate(
-            """({ labels, nth }) => {
-                const norm = (s) => (s || "")
-                    .normalize("NFD")
-                    .replace(/[\\u0300-\\u036f]/g, "")
-                    .toLowerCase()
-                    .replace(/\\s+/g, " ")
-                    .trim();
-                const isVisible = (el) => {
-                    if (!el) return false;
-                    const r = el.getBoundingClientRect();
-                    if (!r || r.width < 1 || r.height < 1) return false;
-                    const st = window.getComputedStyle(el);
-                    return st.display !== "none" && st.visibility !== "hidden";
-                };
-                const targets = (labels || []).map(norm).filter(Boolean);
-                if (!targets.length) return false;
-                const root = document.querySelector("#qv-stage-container") || document;
-                const tabs = Array.from(root.querySelectorAll("button[role='tab'], [role='tab']"));
-                const matches = tabs.filter((tab) => {
-                    if (!isVisible(tab)) return false;
-                    const txt = norm(tab.innerText || tab.textContent || "");
-                    const ttl = norm(tab.getAttribute("title") || "");
-                    const aria = norm(tab.getAttribute("aria-label") || "");
-                    const blob = `${txt} ${ttl} ${aria}`;
-                    return targets.some((t) => blob.includes(t));
-                });
-                const picked = matches[nth];
-                if (!picked) return false;
-                picked.scrollIntoView({ block: "center", inline: "center" });
-                picked.click();
-                return true;
-            }""",
-            {"labels": label_options, "nth": nth},
-        ))
-        if ok:
+    strategies = {
+        "index": lambda page, nth: _click_picks(page, menu_picks(stage_index(page), name, whole_word), nth),
+        "role": by_role,
+        "stage_js": lambda page, nth: click_stage_action_by_text(page, name, nth=nth, whole_word=whole_word),
+        # para siglas curtas (AFA/ECE), evita substring.
+        "stage_text": lambda page, nth: _click_nth(page.locator(STAGE_SELECTOR).get_by_text(name, exact=whole_word), nth),
+        "text": lambda page, nth: not whole_word and _click_nth(page.locator(f"text={name}"), nth),
+    }
+
+    for attempt in range(6):
+        # evita ficar no meio da rolagem em máquinas mais lentas
+        try:
+            page.mouse.wheel(0, -3000)
+        except:
+            pass
+        page.wait_for_timeout(300)
+
+        trace_note(target=name, attempts=attempt + 1)
+        if resolve_cached(page, "menu", name, strategies):
             return True
-    except:
-        pass
 
+        wait_ms = retry_wait_ms(attempt, 6)
+        if wait_ms is None:
+            break
+        wait_qlik(page, extra_ms=wait_ms)
+
+    print(f"[AVISO] Menu '{name}' não encontrado.")
     return False
 
+@traced
+def click_text(page, text: str, nth: int = 0) -> bool:
+    stage = page.locator(STAGE_SELECTOR)
+    whole_word = is_acronym(text)
+    txt_rx = _text_rx(text, whole_word)
+
+    strategies = {
+        "index": lambda page, n: _click_pick(page, index_cards(page, text, whole_word), n),
+        # tenta clicar como footnote (muito comum no Qlik)
+        "footnote": lambda page, n: _click_article_of(stage.locator(FOOTNOTE_SELECTOR, has_text=txt_rx), n),
+        # fallback: texto normal
+        "stage_text": lambda page, n: _click_nth(stage.get_by_text(text, exact=whole_word), n),
+        "stage_js": lambda page, n: click_stage_action_by_text(page, text, nth=n, whole_word=whole_word),
+    }
+    return resolve_cached(page, "text", f"{text}#{nth}", strategies, nth_options=(nth,))
+
+@traced
+def click_button(page, name: str, nth: int = 0) -> bool:
+    return _click_nth(page.get_by_role("button", name=name), nth)
+
+def _tab_strategies(page, label_options):
+    labels = tab_labels(label_options)
+    stage = page.locator(STAGE_SELECTOR)
+
+    def by_role(page, nth):
+        # 1) Role tab com nome (mais confiável)
+        return any(_click_nth(stage.get_by_role("tab", name=exact_rx(label)), nth) for label in labels)
+
+    def by_tab_button(page, nth):
+        # 2) Fallback por texto dentro de botões de aba
+        return any(
+            _click_nth(stage.locator(TAB_BUTTON_SELECTOR, has_text=re.compile(re.escape(label), re.IGNORECASE)), nth)
+            for label in labels
+        )
+
+    def by_js(page, nth):
+        # 3) Fallback JS para title/aria-label/texto
+        try:
+            return bool(page.evaluate(CLICK_TAB_JS, {"labels": labels, "nth": nth}))
+        except:
+            return False
+
+    return {
+        "index": lambda page, nth: _click_picks(page, tab_picks(stage_index(page), labels), nth),
+        "role": by_role,
+        "tab_button": by_tab_button,
+        "js": by_js,
+    }
+
+CLICK_TAB_JS = """({ labels, nth }) => {
+    const norm = (s) => (s || "")
+        .normalize("NFD")
+        .replace(/[\\u0300-\\u036f]/g, "")
+        .toLowerCase()
+        .replace(/\\s+/g, " ")
+        .trim();
+    const isVisible = (el) => {
+        if (!el) return false;
+        const r = el.getBoundingClientRect();
+        if (!r || r.width < 1 || r.height < 1) return false;
+        const st = window.getComputedStyle(el);
+        return st.display !== "none" && st.visibility !== "hidden";
+    };
+    const targets = (labels || []).map(norm).filter(Boolean);
+    if (!targets.length) return false;
+    const root = document.querySelector("#qv-stage-container") || document;
+    const tabs = Array.from(root.querySelectorAll("button[role='tab'], [role='tab']"));
+    const matches = tabs.filter((tab) => {
+        if (!isVisible(tab)) return false;
+        const txt = norm(tab.innerText || tab.textContent || "");
+        const ttl = norm(tab.getAttribute("title") || "");
+        const aria = norm(tab.getAttribute("aria-label") || "");
+        const blob = `${txt} ${ttl} ${aria}`;
+        return targets.some((t) => blob.includes(t));
+    });
+    const picked = matches[nth];
+    if (!picked) return false;
+    picked.scrollIntoView({ block: "center", inline: "center" });
+    picked.click();
+    return true;
+}"""
+
+@traced
+def click_tab(page, label_options, nth: int = 0) -> bool:
+    """
+    Clica em abas (role=tab) com variações de rótulo.
+    """
+    if not label_options:
+        return False
+    return resolve_cached(page, "tab", f"{label_options[0]}#{nth}", _tab_strategies(page, label_options), nth_options=(nth,))
+
+CLICK_BG_IMAGE_JS = """({ tokens, nth }) => {
+    const isVisible = (el) => {
+        if (!el) return false;
+        const r = el.getBoundingClientRect();
+        if (!r || r.width < 1 || r.height < 1) return false;
+        const st = window.getComputedStyle(el);
+        return st.display !== "none" && st.visibility !== "hidden";
+    };
+
+    const expand = (s) => {
+        const low = (s || "").toLowerCase();
+        try {
+            return low + " " + decodeURIComponent(low);
+        } catch {
+            return low;
+        }
+    };
+
+    const root = document.querySelector("#qv-stage-container") || document;
+    const buttons = Array.from(root.querySelectorAll("article.qv-object button, button"));
+    const matches = buttons.filter((btn) => {
+        if (!isVisible(btn)) return false;
+        const inlineStyle = expand(btn.getAttribute("style") || "");
+        const computedBg = expand(window.getComputedStyle(btn).backgroundImage || "");
+        const blob = inlineStyle + " " + computedBg;
+        return tokens.some((t) => blob.includes(t));
+    });
+
+    const picked = matches[nth];
+    if (!picked) return false;
+    picked.scrollIntoView({ block: "center", inline: "center" });
+    picked.click();
+    return true;
+}"""
+
+@traced
 def click_by_bg_image(page, img_substring: str, nth: int = 0) -> bool:
     """
     Clica em botões do Qlik que não têm texto, mas têm background-image no style.
@@ -281,87 +1301,46 @@ def click_by_bg_image(page, img_substring: str, nth: int = 0) -> bool:
     if not raw:
         return False
 
-    # Tentativa 1: seletor direto (mais rápido)
-    for sel in (f'#qv-stage-container button[style*="{raw}"]', f'button[style*="{raw}"]'):
-        loc = page.locator(sel)
-        if loc.count() > nth:
-            loc.nth(nth).click(force=True)
-            return True
-
     # Tentativa 2: match case-insensitive + decode de URL + background computado
-    token_base = raw.lower()
-    base_name = os.path.basename(token_base)
-    stem = base_name.rsplit(".", 1)[0]
-    tokens = {token_base, base_name, stem}
-    tokens.update(part for part in re.split(r"[_\-\s]+", stem) if len(part) >= 3)
-    tokens = [t for t in tokens if t]
+    tokens = bg_image_tokens(raw)
 
-    try:
-        return bool(page.evaluate(
-            """({ tokens, nth }) => {
-                const isVisible = (el) => {
-                    if (!el) return false;
-                    const r = el.getBoundingClientRect();
-                    if (!r || r.width < 1 || r.height < 1) return false;
-                    const st = window.getComputedStyle(el);
-                    return st.display !== "none" && st.visibility !== "hidden";
-                };
-
-                const expand = (s) => {
-                    const low = (s || "").toLowerCase();
-                    try {
-                        return low + " " + decodeURIComponent(low);
-                    } catch {
-                        return low;
-                    }
-                };
-
-                const root = document.querySelector("#qv-stage-container") || document;
-                const buttons = Array.from(root.querySelectorAll("article.qv-object button, button"));
-                const matches = buttons.filter((btn) => {
-                    if (!isVisible(btn)) return false;
-                    const inlineStyle = expand(btn.getAttribute("style") || "");
-                    const computedBg = expand(window.getComputedStyle(btn).backgroundImage || "");
-                    const blob = inlineStyle + " " + computedBg;
-                    return tokens.some((t) => blob.includes(t));
-                });
-
-                const picked = matches[nth];
-                if (!picked) return false;
-                picked.scrollIntoView({ block: "center", inline: "center" });
-                picked.click();
-                return true;
-            }""",
-            {"tokens": tokens, "nth": nth},
-        ))
-    except:
-        return False
+    def by_js(page, n):
+        try:
+            return bool(page.evaluate(CLICK_BG_IMAGE_JS, {"tokens": tokens, "nth": n}))
+        except:
+            return False
 
+    strategies = {
+        "index": lambda page, n: _click_picks(page, bg_picks(stage_index(page), raw, tokens), n),
+        # Tentativa 1: seletor direto (mais rápido)
+        "stage_style": lambda page, n: _click_nth(page.locator(bg_style_selector(raw, True)), n, force=True),
+        "page_style": lambda page, n: _click_nth(page.locator(bg_style_selector(raw, False)), n, force=True),
+        "js": by_js,
+    }
+    return resolve_cached(page, "bg", f"{raw}#{nth}", strategies, nth_options=(nth,))
+
+@traced
 def back(page) -> bool:
     # Prioridade: voltar no stage, evitando o "Voltar uma etapa" da barra superior
     if click_stage_action_by_text(page, "Voltar"):
         wait_qlik(page, extra_ms=3500)
         return True
 
-    stage = page.locator("#qv-stage-container")
-    loc = stage.get_by_role("button", name=re.compile(r"^\s*voltar\s*$", re.IGNORECASE))
+    stage = page.locator(STAGE_SELECTOR)
+    loc = stage.get_by_role("button", name=VOLTAR_RX)
     if loc.count() > 0:
         loc.first.click()
         wait_qlik(page, extra_ms=3500)
         return True
 
-    foot = stage.locator("footer.qv-object-footnote", has_text=re.compile(r"^\s*voltar\s*$", re.IGNORECASE))
-    if foot.count() > 0:
-        art = foot.first.locator("xpath=ancestor::article[contains(@class,'qv-object')]")
-        if art.count() > 0:
-            art.first.click()
-        else:
-            foot.first.click()
+    foot = stage.locator(FOOTNOTE_SELECTOR, has_text=VOLTAR_RX)
+    if _click_article_of(foot):
         wait_qlik(page, extra_ms=3500)
         return True
 
     return False
 
+@traced
 def back_to_om(page, om: str) -> bool:
     """
     Volta para a OM de forma robusta.
@@ -377,130 +1356,699 @@ def back_to_om(page, om: str) -> bool:
 
     return False
 
-def screenshot_page(page, out_png: str):
+_CDP_SESSIONS = {}
+# último tempo de estabilização por página (id(page) -> ms), para o log da captura
+SHOT_SETTLE_MS = {}
+SHOT_SETTLE_LOG = []
+
+SCROLL_JS = "() => [window.scrollX, window.scrollY]"
+
+def _cdp_session(page):
+    key = id(page)
+    if key not in _CDP_SESSIONS:
+        try:
+            _CDP_SESSIONS[key] = page.context.new_cdp_session(page)
+        except:
+            # sem CDP (navegador não-Chromium): usa screenshot comum em JPEG
+            _CDP_SESSIONS[key] = None
+        # o id(page) volta a ser usado por páginas novas: o gancho de close
+        # do índice (um por página) também esquece a sessão
+        hook_stage_index(page)
+    return _CDP_SESSIONS[key]
+
+def drop_cdp_session(page):
+    _CDP_SESSIONS.pop(id(page), None)
+
+def cdp_clip(clip, scroll):
     """
-    Captura a tela começando a partir do logo da página (sheet-title-logo-img).
-    Recorta tudo que estiver acima do logo.
+    Clip do Page.captureScreenshot: o CDP mede no documento e o clip é do
+    viewport (o page.screenshot soma a rolagem sozinho; aqui somamos nós).
     """
+    x, y = scroll or (0, 0)
+    return dict(clip, x=clip["x"] + x, y=clip["y"] + y, scale=SHOT_PROBE_SCALE)
 
-    # espera garantir render
-    page.wait_for_timeout(1500)
+def probe_frame(page, clip) -> bytes:
+    """
+    Quadro barato da área do clip: via CDP sai já reduzido (SHOT_PROBE_SCALE),
+    sem passar pela captura em resolução cheia.
+    """
+    cdp = _cdp_session(page)
+    if cdp is not None:
+        try:
+            res = cdp.send("Page.captureScreenshot", {
+                "format": "png",
+                "clip": cdp_clip(clip, page.evaluate(SCROLL_JS)),
+                "captureBeyondViewport": False,
+            })
+            return base64.b64decode(res["data"])
+        except:
+            # sessão caiu (página recarregada/fechada): a próxima sonda abre outra
+            drop_cdp_session(page)
+    return page.screenshot(clip=clip, type="jpeg", quality=30)
 
-    logo = page.locator("div.sheet-title-logo-img")
+@traced
+def wait_pixels_stable_ops(page, clip):
+    """
+    Tira quadros de baixa resolução do clip até SHOT_STABLE_FRAMES seguidos
+    saírem idênticos (gráficos do Qlik ainda animam depois dos loaders
+    sumirem), limitado a SHOT_MAX_SETTLE_MS. Devolve o tempo gasto (ms).
+    """
+    t0 = time.monotonic()
+    last = None
+    same = 0
+    while True:
+        frame = yield ("probe", clip)
+        if frame == last:
+            same += 1
+            if same >= SHOT_STABLE_FRAMES - 1:
+                break
+        else:
+            same = 0
+            last = frame
+        if (time.monotonic() - t0) * 1000 >= SHOT_MAX_SETTLE_MS:
+            print(f"[AVISO] Tela não estabilizou em {SHOT_MAX_SETTLE_MS} ms; capturando assim mesmo.")
+            break
+        yield ("sleep", SHOT_FRAME_INTERVAL_MS)
+    settle_ms = int((time.monotonic() - t0) * 1000)
+    trace_note(settle_ms=settle_ms, stable=same >= SHOT_STABLE_FRAMES - 1)
+    return settle_ms
 
-    if logo.count() > 0:
-        box = logo.first.bounding_box()
+def screenshot_clip_ops(page):
+    """
+    Área da captura: do topo do logo da página (sheet-title-logo-img) até
+    o fim do viewport; sem logo, o viewport inteiro.
+    """
+    box = yield ("box", LOGO_SELECTOR)
+    if box:
+        viewport = page.viewport_size
+        return {
+            "x": 0,
+            "y": box["y"],  # começa no topo do logo
+            "width": viewport["width"],
+            "height": viewport["height"] - box["y"]
+        }
+    return None
+
+@traced
+def screenshot_page_ops(page, out_png: str = None):
+    """
+    Captura a tela começando a partir do logo da página (sheet-title-logo-img).
+    Recorta tudo que estiver acima do logo.
+    Devolve os bytes do PNG; out_png=None não grava nada em disco.
+    """
+    clip = yield from screenshot_clip_ops(page)
 
-        if box:
-            viewport = page.viewport_size
+    # espera garantir render
+    if SHOT_SETTLE_MODE == "pixels":
+        settle_ms = yield from wait_pixels_stable_ops(page, clip or {"x": 0, "y": 0, **page.viewport_size})
+    else:
+        yield ("sleep", 1500)
+        settle_ms = 1500
+    record_settle(page, settle_ms)
+    return (yield ("screenshot", out_png, clip))
 
-            clip = {
-                "x": 0,
-                "y": box["y"],  # começa no topo do logo
-                "width": viewport["width"],
-                "height": viewport["height"] - box["y"]
-            }
+def record_settle(page, settle_ms: int):
+    SHOT_SETTLE_MS[id(page)] = settle_ms
+    SHOT_SETTLE_LOG.append(settle_ms)
 
-            page.screenshot(path=out_png, clip=clip)
-            return
+def print_settle_summary():
+    if not SHOT_SETTLE_LOG:
+        return
+    print(
+        f"[INFO] Estabilização das capturas: média {sum(SHOT_SETTLE_LOG) / len(SHOT_SETTLE_LOG):.0f} ms, "
+        f"máx {max(SHOT_SETTLE_LOG)} ms, {len(SHOT_SETTLE_LOG)} capturas."
+    )
 
-    # fallback: se não achar o logo, captura normal
-    page.screenshot(path=out_png, full_page=False)
+def shot_png_path(idx, label) -> str:
+    return os.path.join(TMP_DIR, f"page_{idx:03d}_{safe(label)}.png")
 
-def add_shot(page, shots, idx, label):
-    png = os.path.join(TMP_DIR, f"page_{idx:03d}_{safe(label)}.png")
-    screenshot_page(page, png)
-    shots.append(png)
-    print(f"[OK] Capturada: {label}")
-    return idx + 1
+def capture_shot(page, idx, label):
+    return run_ops(page, capture_shot_ops(page, idx, label))
 
-def click_tab_any_nth(page, label_options, nth_options) -> bool:
+def capture_shot_ops(page, idx, label):
     """
-    Tenta clicar a aba com vários índices possíveis (útil quando existem
-    abas com mesmo nome em gráficos diferentes na mesma tela).
+    Captura a página e devolve (item para o PDF, bytes do PNG). Com
+    SHOTS_IN_MEMORY o item é o próprio PNG (bytes) e o TMP_DIR só recebe
+    cópia se DEBUG_SAVE_PNG.
     """
-    nth_options = nth_options or [0]
-    for nth in nth_options:
-        if click_tab(page, label_options, nth=nth):
-            return True
-    return False
+    png = shot_png_path(idx, label)
+    if SHOTS_IN_MEMORY:
+        data = yield from screenshot_page_ops(page, png if DEBUG_SAVE_PNG else None)
+        return data, data
+    return png, (yield from screenshot_page_ops(page, png))
+
+@traced
+def image_hash(data: bytes) -> bytes:
+    """
+    Hash por blocos do PNG: média de cinza de cada bloco de uma grade
+    DUP_HASH_GRID. Recodificação do PNG ou um cursor piscando quase não
+    mexem nas médias; troca de aba/gráfico mexe em muitos blocos.
+    """
+    with open_shot(data) as im:
+        return im.convert("L").resize(DUP_HASH_GRID, Image.BOX).tobytes()
 
-def capture_detalhar_tabs(page, shots, idx, base_label):
+def hash_distance(a: bytes, b: bytes) -> int:
     """
-    Dentro da tela Detalhar, captura 2 combinações na ordem:
-    1) gráfico de cima em Visão Mensal + gráfico de baixo em Visão Mensal
-    2) gráfico de cima em Visão Acumulado Mensal + gráfico de baixo em Visão Semanal
+    Quantos blocos diferem mais que DUP_BLOCK_TOLERANCE níveis de cinza.
     """
-    mensal_labels = [
-        "VISÃO MENSAL",
-        "Visão MENSAL",
-        "Visão Mensal",
-    ]
-    acumulado_labels = [
-        "VISÃO ACUMULADO MENSAL",
-        "Visão ACUMULADO MENSAL",
-        "Visão MENSAL ACUMULADO",
-        "VISÃO MENSAL ACUMULADO",
-    ]
-    semanal_labels = [
-        "VISÃO SEMANAL",
-        "Visão SEMANAL",
-        "Visão Semanal",
-    ]
+    if len(a) != len(b):
+        return len(a) + len(b)
+    return sum(1 for x, y in zip(a, b) if abs(x - y) > DUP_BLOCK_TOLERANCE)
 
-    # Captura 1: Mensal/Mensal
-    top_monthly_ok = click_tab_any_nth(page, mensal_labels, [0, 1, 2])
-    bottom_monthly_ok = click_tab_any_nth(page, mensal_labels, [1, 0, 2, 3])
-    if not top_monthly_ok:
-        print(f"[AVISO] {base_label}: não achei aba mensal do gráfico de cima.")
-    if not bottom_monthly_ok:
-        print(f"[AVISO] {base_label}: não achei aba mensal do gráfico de baixo.")
-    wait_qlik(page, extra_ms=4500)
-    idx = add_shot(page, shots, idx, f"{base_label} - Mensal/Mensal")
-
-    # Captura 2: Acumulado Mensal/Semanal
-    top_acc_ok = click_tab_any_nth(page, acumulado_labels, [0, 1, 2])
-    bottom_weekly_ok = click_tab_any_nth(page, semanal_labels, [0, 1, 2, 3])
-    if not top_acc_ok:
-        print(f"[AVISO] {base_label}: não achei aba acumulado mensal do gráfico de cima.")
-    if not bottom_weekly_ok:
-        print(f"[AVISO] {base_label}: não achei aba semanal do gráfico de baixo.")
-    wait_qlik(page, extra_ms=4500)
-    idx = add_shot(page, shots, idx, f"{base_label} - Acumulado/Semanal")
+@traced
+def click_tab_any_nth(page, label_options, nth_options) -> bool:
+    """
+    Tenta clicar a aba com vários índices possíveis (útil quando existem
+    abas com mesmo nome em gráficos diferentes na mesma tela).
+    """
+    nth_options = list(nth_options or [0])
+    if not label_options:
+        return False
+    target = f"{label_options[0]}@{','.join(map(str, nth_options))}"
+    return resolve_cached(page, "tab", target, _tab_strategies(page, label_options), nth_options=nth_options)
+
+# Rótulos das abas da tela Detalhar (variações de grafia encontradas no app)
+MENSAL_LABELS = [
+    "VISÃO MENSAL",
+    "Visão MENSAL",
+    "Visão Mensal",
+]
+ACUMULADO_LABELS = [
+    "VISÃO ACUMULADO MENSAL",
+    "Visão ACUMULADO MENSAL",
+    "Visão MENSAL ACUMULADO",
+    "VISÃO MENSAL ACUMULADO",
+]
+SEMANAL_LABELS = [
+    "VISÃO SEMANAL",
+    "Visão SEMANAL",
+    "Visão Semanal",
+]
+
+@traced
+def ensure_stage_texts(page, om: str, groups) -> bool:
+    """
+    Garante que estamos na tela principal da OM antes da 1ª captura:
+    cada grupo de textos precisa ter ao menos um presente no stage.
+    Se não confirmar, clica de novo no menu da OM (2x) e só avisa.
+    """
+    found = False
+    for _ in range(2):
+        stage = page.locator(STAGE_SELECTOR)
+        found = all(
+            any(stage.get_by_text(t, exact=False).count() > 0 for t in texts)
+            for texts in groups
+        )
+        if found:
+            break
+        click_menu_item(page, om)
+        wait_qlik(page, extra_ms=4500)
 
-    return idx
+    if not found:
+        print(f"[AVISO] {om}: tela principal não confirmou os {len(groups)} cards antes da captura.")
+    return True
 
-def files_are_identical(path_a: str, path_b: str) -> bool:
+def open_shot(src):
     """
-    Compara dois arquivos byte a byte.
-    Usado para descartar capturas duplicadas.
+    Abre uma captura que pode ser caminho de arquivo ou PNG em memória.
     """
+    if isinstance(src, (bytes, bytearray)):
+        return Image.open(io.BytesIO(src))
+    return Image.open(src)
+
+# ====== CODIFICAÇÃO DAS PÁGINAS ======
+# Cada codificador devolve (dados, /Filter, /ColorSpace, /DecodeParms, bits).
+# O Flate reaproveita o IDAT de um PNG do Pillow: o PDF aceita o mesmo zlib
+# com os preditores do PNG (/Predictor 15), então não há recompressão.
+JPEG_FALLBACK_QUALITIES = (75, 60, 45, 30)
+
+def _png_flate(im):
+    buf = io.BytesIO()
+    im.save(buf, format="PNG")
+    png = buf.getvalue()
+    pos, idat, plte = 8, [], b""
+    bits = color_type = 0
+    while pos < len(png):
+        size = int.from_bytes(png[pos:pos + 4], "big")
+        kind = png[pos + 4:pos + 8]
+        body = png[pos + 8:pos + 8 + size]
+        if kind == b"IHDR":
+            bits, color_type = body[8], body[9]
+        elif kind == b"PLTE":
+            plte = body
+        elif kind == b"IDAT":
+            idat.append(body)
+        pos += size + 12
+    if color_type == 3:
+        colorspace = b"[/Indexed /DeviceRGB %d <%s>]" % (len(plte) // 3 - 1, plte.hex().encode())
+        colors = 1
+    else:
+        colorspace, colors = b"/DeviceRGB", 3
+    parms = b"<< /Predictor 15 /Colors %d /BitsPerComponent %d /Columns %d >>" % (colors, bits, im.width)
+    return b"".join(idat), b"/FlateDecode", colorspace, parms, bits
+
+def encode_flate(rgb):
+    """
+    Sem perdas: com até 256 cores vira paleta exata, senão RGB.
+    """
+    colors = rgb.getcolors(256)
+    if colors is not None:
+        # median cut com cores <= 256 separa cada cor numa caixa: paleta exata
+        pal = rgb.quantize(colors=len(colors), method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+        if pal.convert("RGB").tobytes() == rgb.tobytes():
+            return _png_flate(pal)
+    return _png_flate(rgb)
+
+def encode_palette(rgb):
+    return _png_flate(rgb.quantize(colors=256, dither=Image.Dither.NONE))
+
+def encode_jpeg(rgb, quality=None):
+    buf = io.BytesIO()
+    rgb.save(buf, format="JPEG", quality=quality or PDF_JPEG_QUALITY)
+    return buf.getvalue(), b"/DCTDecode", b"/DeviceRGB", b"", 8
+
+PDF_ENCODERS = {
+    "flate": encode_flate,
+    "palette": encode_palette,
+    "jpeg": encode_jpeg,
+}
+
+def encode_page(rgb, encoder: str, max_bytes: int = 0, jpeg_quality: int = None):
+    """
+    Codifica a página com o codificador pedido ("auto" = o menor entre
+    flate e jpeg). Com max_bytes, se passar do limite tenta paleta e JPEG
+    cada vez mais baixo e fica com o primeiro que couber (ou o menor).
+    Devolve (nome, dados, filtro, colorspace, decode_parms, bits).
+    """
+    if encoder == "auto":
+        tries = [("flate", encode_flate(rgb)), ("jpeg", encode_jpeg(rgb, jpeg_quality))]
+    elif encoder == "jpeg":
+        tries = [("jpeg", encode_jpeg(rgb, jpeg_quality))]
+    else:
+        tries = [(encoder, PDF_ENCODERS[encoder](rgb))]
+    best = min(tries, key=lambda t: len(t[1][0]))
+    if max_bytes and len(best[1][0]) > max_bytes:
+        fallbacks = [("palette", lambda: encode_palette(rgb))] + [
+            (f"jpeg{q}", functools.partial(encode_jpeg, rgb, q)) for q in JPEG_FALLBACK_QUALITIES
+        ]
+        for name, fn in fallbacks:
+            enc = (name, fn())
+            if len(enc[1][0]) < len(best[1][0]):
+                best = enc
+            if len(best[1][0]) <= max_bytes:
+                break
+    name, (data, filter_name, colorspace, parms, bits) = best
+    return name, data, filter_name, colorspace, parms, bits
+
+def encode_shot(src, encoder: str, max_bytes: int, jpeg_quality: int):
+    """
+    Abre, converte e codifica uma captura (caminho ou PNG em memória).
+    Roda também nos processos do PDF_WORKERS: a configuração vem por
+    parâmetro, porque o processo filho não vê o que o main() mudou.
+    Devolve (largura, altura, nome, dados, filtro, colorspace, decode_parms, bits, ms).
+    """
+    t0 = time.perf_counter()
+    with open_shot(src) as im:
+        rgb = im.convert("RGB")
+    width, height = rgb.size
+    enc = encode_page(rgb, encoder, max_bytes, jpeg_quality)
+    return (width, height) + enc + ((time.perf_counter() - t0) * 1000,)
+
+# ====== CACHE DE PÁGINAS CODIFICADAS ======
+# Um arquivo <chave>.bin por página codificada + índice JSON com o que o PDF
+# precisa (dimensões, filtro, colorspace...) e a última vez que foi usada.
+# A chave junta o sha256 do PNG com o codificador e a qualidade do JPEG.
+PAGE_CACHE_DIR = "page_cache"
+PAGE_CACHE_INDEX = {}
+PAGE_CACHE_STATS = {"hit": 0, "miss": 0, "evicted": 0}
+
+def page_cache_dir() -> str:
+    # local: cada página lida/gravada no caminho da captura não passa pela rede
+    return os.path.join(SESSION_DIR, PAGE_CACHE_DIR)
+
+def shot_key(src) -> str:
+    """
+    sha256 da captura (PNG em memória ou arquivo).
+    """
+    if isinstance(src, (bytes, bytearray)):
+        return hashlib.sha256(src).hexdigest()
+    with open(src, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def _page_cache_key(key: str, encoder: str, jpeg_quality: int) -> str:
+    return f"{key[:40]}_{encoder}_{jpeg_quality}"
+
+def _degraded(name: str, encoder: str) -> bool:
+    # paleta/JPEG mais baixo escolhidos só para caber no orçamento da página
+    if encoder == "auto":
+        return name not in ("flate", "jpeg")
+    return name != encoder
+
+def _read_page_cache_index():
     try:
-        if not (os.path.exists(path_a) and os.path.exists(path_b)):
-            return False
-        if os.path.getsize(path_a) != os.path.getsize(path_b):
-            return False
+        with open(os.path.join(page_cache_dir(), "index.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except:
+        return {}
 
-        with open(path_a, "rb") as fa, open(path_b, "rb") as fb:
-            while True:
-                chunk_a = fa.read(1024 * 1024)
-                chunk_b = fb.read(1024 * 1024)
-                if chunk_a != chunk_b:
-                    return False
-                if not chunk_a:
-                    return True
+def load_page_cache():
+    PAGE_CACHE_INDEX.update(_read_page_cache_index())
+
+def save_page_cache():
+    """
+    Junta ao índice o que outros processos (jobs do lote, shards) gravaram
+    na mesma pasta desde o load, descarta as páginas usadas há mais tempo
+    até caber em PAGE_CACHE_MB e grava o índice.
+    """
+    if not PAGE_CACHE_INDEX:
+        return
+    for ck, entry in _read_page_cache_index().items():
+        mine = PAGE_CACHE_INDEX.get(ck)
+        if mine is None or entry["used"] > mine["used"]:
+            PAGE_CACHE_INDEX[ck] = entry
+    total = sum(e["bytes"] for e in PAGE_CACHE_INDEX.values())
+    for ck, entry in sorted(PAGE_CACHE_INDEX.items(), key=lambda kv: kv[1]["used"]):
+        if total <= PAGE_CACHE_MB * 1024 * 1024:
+            break
+        try:
+            os.remove(os.path.join(page_cache_dir(), ck + ".bin"))
+        except:
+            pass
+        del PAGE_CACHE_INDEX[ck]
+        total -= entry["bytes"]
+        PAGE_CACHE_STATS["evicted"] += 1
+    try:
+        path = os.path.join(page_cache_dir(), "index.json")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(PAGE_CACHE_INDEX, f, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"[AVISO] Não consegui gravar o índice do cache de páginas ({e}).")
+
+def cached_page(key: str, encoder: str, max_bytes: int, jpeg_quality: int):
+    """
+    Página já codificada desta captura, no formato do encode_shot, ou None.
+    Não serve se passar do orçamento atual nem se foi rebaixada para caber
+    num orçamento mais apertado que o atual.
+    """
+    ck = _page_cache_key(key, encoder, jpeg_quality)
+    entry = PAGE_CACHE_INDEX.get(ck)
+    if entry is None:
+        return None
+    if max_bytes and entry["bytes"] > max_bytes:
+        return None
+    if _degraded(entry["name"], encoder) and not (max_bytes and max_bytes <= entry["budget"]):
+        return None
+    try:
+        with open(os.path.join(page_cache_dir(), ck + ".bin"), "rb") as f:
+            data = f.read()
     except:
-        return False
+        del PAGE_CACHE_INDEX[ck]
+        return None
+    entry["used"] = time.time()
+    return (entry["width"], entry["height"], entry["name"], data, entry["filter"].encode("latin-1"),
+            entry["colorspace"].encode("latin-1"), entry["parms"].encode("latin-1"), entry["bits"], 0.0)
+
+def store_page(key: str, encoder: str, max_bytes: int, jpeg_quality: int, encoded):
+    width, height, name, data, filter_name, colorspace, parms, bits, _ms = encoded
+    ck = _page_cache_key(key, encoder, jpeg_quality)
+    try:
+        Path(page_cache_dir()).mkdir(parents=True, exist_ok=True)
+        path = os.path.join(page_cache_dir(), ck + ".bin")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"[AVISO] Não consegui gravar a página no cache ({e}).")
+        return
+    PAGE_CACHE_INDEX[ck] = {
+        "width": width, "height": height, "name": name, "bytes": len(data),
+        "filter": filter_name.decode("latin-1"), "colorspace": colorspace.decode("latin-1"),
+        "parms": parms.decode("latin-1"), "bits": bits, "budget": max_bytes, "used": time.time(),
+    }
+
+def print_page_cache_summary():
+    total = PAGE_CACHE_STATS["hit"] + PAGE_CACHE_STATS["miss"]
+    if total:
+        print(
+            f"[INFO] Cache de páginas: {PAGE_CACHE_STATS['hit']} de {total} copiadas sem recodificar"
+            f" ({PAGE_CACHE_STATS['evicted']} descartadas pelo limite de {PAGE_CACHE_MB} MB)."
+        )
+
+class PdfStreamWriter:
+    """
+    Escreve o PDF uma página por vez: decodifica, codifica e grava cada
+    imagem e já libera a memória. O consumo fica constante qualquer que seja
+    o número de páginas, e dá para ir adicionando páginas durante a captura.
+    O arquivo é escrito em <out_pdf>.part e só é renomeado no close().
+    expected_pages reparte o PDF_MAX_MB entre as páginas que ainda faltam.
+    Com workers > 1 a codificação vai para um pool de processos e as
+    páginas são gravadas na ordem em que foram adicionadas, conforme ficam
+    prontas (durante a captura, a codificação corre junto com o navegador).
+    Com PAGE_CACHE, página já codificada numa execução anterior é copiada
+    do cache.
+    """
+
+    def __init__(self, out_pdf: str, expected_pages: int = 0, workers: int = None):
+        self.out_pdf = out_pdf
+        self.part = out_pdf + ".part"
+        self.f = open(self.part, "wb")
+        self.offsets = {}
+        self.page_ids = []
+        self.expected_pages = expected_pages
+        # (codificador, bytes, ms, veio do cache) de cada página, para o relatório
+        self.report = []
+        workers = PDF_WORKERS if workers is None else workers
+        self.pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        self.pending = deque()
+        # 1 = Catalog, 2 = Pages (gravados no close, quando os Kids são conhecidos)
+        self.next_id = 3
+        self.f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _obj(self, body: bytes, stream: bytes = None, obj_id: int = None) -> int:
+        if obj_id is None:
+            obj_id = self.next_id
+            self.next_id += 1
+        self.offsets[obj_id] = self.f.tell()
+        self.f.write(b"%d 0 obj\n" % obj_id)
+        self.f.write(body)
+        if stream is not None:
+            self.f.write(b"\nstream\n")
+            self.f.write(stream)
+            self.f.write(b"\nendstream")
+        self.f.write(b"\nendobj\n")
+        return obj_id
+
+    def page_budget(self) -> int:
+        if not PDF_MAX_MB:
+            return 0
+        # no pool, as páginas ainda em codificação contam pelo tamanho médio
+        done = len(self.page_ids)
+        avg = self.f.tell() / done if done else 0
+        left = PDF_MAX_MB * 1024 * 1024 - self.f.tell() - avg * len(self.pending)
+        pages_left = max(self.expected_pages - done - len(self.pending), 1)
+        return max(int(left // pages_left), 1)
+
+    @traced
+    def add_page(self, png_path, key: str = None):
+        """
+        key = shot_key(png_path), se quem chama já tiver calculado.
+        """
+        job = (png_path, PDF_ENCODER, self.page_budget(), PDF_JPEG_QUALITY)
+        hit = None
+        if PAGE_CACHE:
+            key = key or shot_key(png_path)
+            hit = cached_page(key, *job[1:])
+            PAGE_CACHE_STATS["hit" if hit else "miss"] += 1
+        else:
+            key = None
+
+        if hit and not self.pending:
+            self._write(hit, cached=True)
+        elif hit:
+            # atrás de páginas ainda no pool: entra na fila já pronta
+            future = Future()
+            future.set_result(hit)
+            self.pending.append((future, None, job, True))
+        elif self.pool is None:
+            self._write(encode_shot(*job), key, job)
+        else:
+            self.pending.append((self.pool.submit(encode_shot, *job), key, job, False))
+        self._drain(block=False)
+
+    def _drain(self, block: bool):
+        while self.pending and (block or self.pending[0][0].done()):
+            future, key, job, cached = self.pending.popleft()
+            self._write(future.result(), key, job, cached)
+
+    def _write(self, encoded, key: str = None, job=None, cached: bool = False):
+        width, height, name, data, filter_name, colorspace, parms, bits, ms = encoded
+        self.add_encoded_page(width, height, data, filter_name, colorspace, parms, bits)
+        self.report.append((name, len(data), ms, cached))
+        trace_note(encoder=name, bytes=len(data), cached=cached)
+        if key:
+            store_page(key, *job[1:], encoded)
+
+    def add_encoded_page(self, width: int, height: int, data: bytes, filter_name: bytes, colorspace: bytes,
+                         decode_parms: bytes = b"", bits: int = 8):
+        parms = b" /DecodeParms %s" % decode_parms if decode_parms else b""
+        img_id = self._obj(
+            b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s"
+            b" /BitsPerComponent %d /Filter %s%s /Length %d >>"
+            % (width, height, colorspace, bits, filter_name, parms, len(data)),
+            data,
+        )
+        content = b"q %d 0 0 %d 0 0 cm /Im0 Do Q" % (width, height)
+        content_id = self._obj(b"<< /Length %d >>" % len(content), content)
+        page_id = self._obj(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d]"
+            b" /Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>"
+            % (width, height, img_id, content_id)
+        )
+        self.page_ids.append(page_id)
+
+    def add_pdf_page(self, src, page_id: int):
+        """
+        Copia uma página de outro PDF (PdfPageSource) com os objetos que ela
+        referencia (imagem, conteúdo), só renumerando as referências.
+        """
+        mapping = {}
+
+        def renumber(head):
+            return re.sub(rb"(\d+) 0 R", lambda m: b"%d 0 R" % mapping.get(int(m.group(1)), int(m.group(1))), head)
+
+        def copy(n):
+            if n not in mapping:
+                head, stream = src.obj(n)
+                for ref in re.findall(rb"(\d+) 0 R", head):
+                    copy(int(ref))
+                mapping[n] = self._obj(renumber(head), stream)
+                copied.append(len(stream or b""))
+
+        copied = []
+        head, _stream = src.obj(page_id)
+        head = re.sub(rb"/Parent \d+ 0 R", b"", head)
+        for ref in re.findall(rb"(\d+) 0 R", head):
+            copy(int(ref))
+        head = renumber(head).replace(b"/Type /Page", b"/Type /Page /Parent 2 0 R", 1)
+        self.page_ids.append(self._obj(head))
+        self.report.append(("copiada", sum(copied), 0.0, False))
+
+    def abort(self):
+        if self.pool:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
+        self.f.close()
+        try:
+            os.remove(self.part)
+        except:
+            pass
 
+    def close(self) -> int:
+        """
+        Fecha o PDF (Pages, Catalog, xref). Devolve o número de páginas;
+        sem páginas, descarta o arquivo parcial.
+        """
+        with trace_span("pdf_drain", pending=len(self.pending)):
+            self._drain(block=True)
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+        if not self.page_ids:
+            self.abort()
+            return 0
+
+        kids = b" ".join(b"%d 0 R" % pid for pid in self.page_ids)
+        self._obj(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.page_ids)), obj_id=2)
+        self._obj(b"<< /Type /Catalog /Pages 2 0 R >>", obj_id=1)
+
+        xref_at = self.f.tell()
+        size = self.next_id
+        self.f.write(b"xref\n0 %d\n" % size)
+        self.f.write(b"0000000000 65535 f \n")
+        for obj_id in range(1, size):
+            self.f.write(b"%010d 00000 n \n" % self.offsets[obj_id])
+        self.f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, xref_at))
+        self.f.close()
+        os.replace(self.part, self.out_pdf)
+        self.print_report()
+        return len(self.page_ids)
+
+    def print_report(self):
+        if not self.report:
+            return
+        size = os.path.getsize(self.out_pdf)
+        by_encoder = {}
+        for name, _n, _ms, _cached in self.report:
+            by_encoder[name] = by_encoder.get(name, 0) + 1
+        enc_ms = sum(ms for _name, _n, ms, _cached in self.report)
+        cached = sum(1 for *_rest, c in self.report if c)
+        print(
+            f"[INFO] PDF: {len(self.report)} páginas, {size / 1024 / 1024:.1f} MB "
+            f"(média {size // len(self.report) // 1024} KB/página; "
+            f"{', '.join(f'{k} {v}' for k, v in sorted(by_encoder.items()))}), codificação {enc_ms / 1000:.1f} s somando as páginas"
+            + (f", {cached} do cache" if cached else "")
+        )
+        if PDF_MAX_MB and size > PDF_MAX_MB * 1024 * 1024:
+            print(f"[AVISO] PDF passou do orçamento de {PDF_MAX_MB} MB mesmo no JPEG mais baixo.")
+        if PDF_REPORT:
+            print(f"  {'pág':>4} {'codificador':<12} {'KB':>8} {'ms':>7}")
+            for n, (name, nbytes, ms, from_cache) in enumerate(self.report, start=1):
+                print(f"  {n:>4} {name:<12} {nbytes // 1024:>8} {ms:>7.0f}{'  cache' if from_cache else ''}")
+
+class PdfPageSource:
+    """
+    Leitura mínima de um PDF gerado pelo PdfStreamWriter (xref clássico,
+    /Length direto): dá os objetos crus das páginas para copiá-las para
+    outro PDF sem decodificar as imagens.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = f.read()
+        xref_at = int(re.findall(rb"startxref\s+(\d+)", self.data)[-1])
+        m = re.compile(rb"xref\s+(\d+) (\d+)\s+").match(self.data, xref_at)
+        first, count = int(m.group(1)), int(m.group(2))
+        self.offsets = {}
+        pos = m.end()
+        for n in range(first, first + count):
+            entry = self.data[pos:pos + 20]
+            if entry[17:18] == b"n":
+                self.offsets[n] = int(entry[:10])
+            pos += 20
+        root = int(re.search(rb"/Root (\d+) 0 R", self.data[pos:]).group(1))
+        pages = int(re.search(rb"/Pages (\d+) 0 R", self.obj(root)[0]).group(1))
+        kids = re.search(rb"/Kids \[([^\]]*)\]", self.obj(pages)[0]).group(1)
+        self.page_ids = [int(n) for n in re.findall(rb"(\d+) 0 R", kids)]
+
+    def obj(self, n: int):
+        """
+        (dicionário, stream ou None) do objeto n.
+        """
+        start = re.compile(rb"\d+ 0 obj\s*").match(self.data, self.offsets[n]).end()
+        at_stream = self.data.find(b"\nstream\n", start)
+        at_end = self.data.find(b"\nendobj", start)
+        if at_stream == -1 or at_stream > at_end:
+            return self.data[start:at_end], None
+        head = self.data[start:at_stream]
+        length = int(re.search(rb"/Length (\d+)", head).group(1))
+        return head, self.data[at_stream + 8:at_stream + 8 + length]
+
+@traced
 def build_pdf(png_paths, out_pdf):
     if not png_paths:
         print("[ERRO] Nenhuma imagem foi gerada. Veja o PNG de debug e os avisos do log.")
         return
 
-    imgs = [Image.open(p).convert("RGB") for p in png_paths]
-    first, rest = imgs[0], imgs[1:]
-    first.save(out_pdf, save_all=True, append_images=rest)
+    writer = PdfStreamWriter(out_pdf, expected_pages=len(png_paths))
+    for p in png_paths:
+        writer.add_page(p)
+    writer.close()
 
+@traced
 def click_card_like(page, contains_text: str, nth: int = 0) -> bool:
     """
     Qlik action button: o texto geralmente está no <footer class="qv-object-footnote">,
@@ -511,46 +2059,28 @@ def click_card_like(page, contains_text: str, nth: int = 0) -> bool:
     if not txt:
         return False
 
-    stage = page.locator("#qv-stage-container")
+    stage = page.locator(STAGE_SELECTOR)
     whole_word = is_acronym(txt)
-    if whole_word:
-        txt_rx = re.compile(rf"(?<!\w){re.escape(txt)}(?!\w)", re.IGNORECASE)
-    else:
-        txt_rx = re.compile(re.escape(txt), re.IGNORECASE)
-
-    # 1) Prioridade: footer (texto do card)
-    foot = stage.locator("footer.qv-object-footnote", has_text=txt_rx)
-    if foot.count() > nth:
-        # clicar no article pai (área inteira clicável)
-        art = foot.nth(nth).locator("xpath=ancestor::article[contains(@class,'qv-object')]")
-        if art.count() > 0:
-            art.first.click()
-        else:
-            foot.nth(nth).click()
-        return True
-
-    # 2) Fallback: qualquer elemento com o texto (bem amplo)
-    anytxt = stage.get_by_text(txt, exact=whole_word)
-    if anytxt.count() > nth:
-        # tenta subir até o article do objeto e clicar
-        art2 = anytxt.nth(nth).locator("xpath=ancestor::article[contains(@class,'qv-object')]")
-        if art2.count() > 0:
-            art2.first.click()
-        else:
-            anytxt.nth(nth).click()
-        return True
-
-    # 3) Fallback com normalização de acento/case
-    if click_stage_action_by_text(page, txt, nth=nth, whole_word=whole_word):
-        return True
-
-    return False
-
+    txt_rx = _text_rx(txt, whole_word)
+
+    strategies = {
+        "index": lambda page, n: _click_pick(page, index_cards(page, txt, whole_word), n),
+        # 1) Prioridade: footer (texto do card) -> article pai
+        "footnote": lambda page, n: _click_article_of(stage.locator(FOOTNOTE_SELECTOR, has_text=txt_rx), n),
+        # 2) Fallback: qualquer elemento com o texto (bem amplo) -> article pai
+        "stage_text": lambda page, n: _click_article_of(stage.get_by_text(txt, exact=whole_word), n),
+        # 3) Fallback com normalização de acento/case
+        "stage_js": lambda page, n: click_stage_action_by_text(page, txt, nth=n, whole_word=whole_word),
+    }
+    return resolve_cached(page, "card", f"{txt}#{nth}", strategies, nth_options=(nth,))
+
+@traced
 def open_card(page, text_options=None, image_options=None, attempts: int = 4) -> bool:
     text_options = text_options or []
     image_options = image_options or []
 
     for attempt in range(max(1, attempts)):
+        trace_note(attempts=attempt + 1)
         for txt in text_options:
             if click_card_like(page, txt):
                 return True
@@ -559,263 +2089,1854 @@ def open_card(page, text_options=None, image_options=None, attempts: int = 4) ->
             if click_by_bg_image(page, img, nth=0):
                 return True
 
-        if attempt < attempts - 1:
-            wait_qlik(page, extra_ms=1200 + attempt * 350)
+        wait_ms = retry_wait_ms(attempt, attempts)
+        if wait_ms is None:
+            break
+        wait_qlik(page, extra_ms=wait_ms)
 
     return False
 
-def main():
-    Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
-    Path(TMP_DIR).mkdir(parents=True, exist_ok=True)
+# =========================
+# PLANO DE CAPTURA
+# =========================
+# O roteiro é dado (passos com id estável) e não código: um executor roda
+# os passos, e dá para recapturar só alguns passos ou só os que falharam.
+#
+# Passo:
+#   id    identificador estável (usado em --steps e no estado do plano)
+#   do    alternativas [(ação, *args)]; a 1ª que der certo vale
+#   wait  extra_ms do wait_qlik depois do sucesso (sem "do": só espera)
+#   then  filhos, executados só se o passo deu certo
+#   warn  aviso quando nenhuma alternativa funcionou
+# Captura:
+#   shot  rótulo da página (quase-duplicatas da anterior: ver DUP_MODE)
+#   dup   DUP_MODE só desta captura (ex.: "drop" onde a página repetida pode sair)
+
+PLAN_STATE_FILE = "plan_state.json"
+
+def step(step_id, *do, wait=None, then=None, warn=None):
+    return {"id": step_id, "do": list(do), "wait": wait, "then": then or [], "warn": warn}
+
+def shot(step_id, label, dup=None):
+    st = {"id": step_id, "shot": label}
+    if dup:
+        st["dup"] = dup
+    return st
+
+def _wheel(page, dy: int, pause_ms: int = 1500) -> bool:
+    try:
+        page.mouse.wheel(0, dy)
+        page.wait_for_timeout(pause_ms)
+    except:
+        pass
+    invalidate_stage_index(page)
+    return True
+
+# ação -> helper; todas devolvem bool
+PLAN_ACTIONS = {
+    "menu": click_menu_item,
+    "text": click_text,
+    "button": click_button,
+    "card": click_card_like,
+    "open": lambda page, texts, images: open_card(page, text_options=texts, image_options=images),
+    "bg": click_by_bg_image,
+    "tab": click_tab_any_nth,
+    "back": back,
+    "back_to_om": back_to_om,
+    "ensure": ensure_stage_texts,
+    "wheel": _wheel,
+}
+
+def detalhar_steps(prefix: str, base_label: str):
+    """
+    Dentro da tela Detalhar, captura 2 combinações na ordem:
+    1) gráfico de cima em Visão Mensal + gráfico de baixo em Visão Mensal
+    2) gráfico de cima em Visão Acumulado Mensal + gráfico de baixo em Visão Semanal
+    e volta para a tela anterior.
+    """
+    return [
+        step(f"{prefix}.mensal_cima", ("tab", MENSAL_LABELS, [0, 1, 2]),
+             warn=f"{base_label}: não achei aba mensal do gráfico de cima."),
+        step(f"{prefix}.mensal_baixo", ("tab", MENSAL_LABELS, [1, 0, 2, 3]),
+             warn=f"{base_label}: não achei aba mensal do gráfico de baixo."),
+        step(f"{prefix}.mensal_wait", wait=4500),
+        shot(f"{prefix}.mensal", f"{base_label} - Mensal/Mensal"),
+        step(f"{prefix}.acumulado_cima", ("tab", ACUMULADO_LABELS, [0, 1, 2]),
+             warn=f"{base_label}: não achei aba acumulado mensal do gráfico de cima."),
+        step(f"{prefix}.semanal_baixo", ("tab", SEMANAL_LABELS, [0, 1, 2, 3]),
+             warn=f"{base_label}: não achei aba semanal do gráfico de baixo."),
+        step(f"{prefix}.acumulado_wait", wait=4500),
+        shot(f"{prefix}.acumulado", f"{base_label} - Acumulado/Semanal"),
+        step(f"{prefix}.voltar", ("back",)),
+    ]
 
-    ts = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    out_pdf = os.path.join(OUTPUT_DIR, f"e-GovEns_{ts}.pdf")
+def om_cursos_branch(om: str, cursos_labels):
+    """
+    OMs simples (2 páginas): tela principal da OM + card "Cursos da/do <OM>".
+    """
+    key = om.lower()
+    return (om, [
+        step(key, ("menu", om), wait=6500, then=[
+            shot(f"{key}.shot", om),
+            step(f"{key}.cursos", *[("card", lbl) for lbl in cursos_labels], wait=6500, then=[
+                shot(f"{key}.cursos.shot", f"{om} - Cursos"),
+            ]),
+        ]),
+    ])
+
+# ROTEIRO FIXO = PDF ANEXADO. A ordem das capturas no plano é a ordem das
+# páginas no PDF, inclusive no modo paralelo e na recaptura parcial.
+PLAN = [
+    ("HOME", [
+        # CHECKPOINT: se nada funcionar, ao menos 1 captura para diagnóstico
+        shot("home", "00 - HOME (debug)"),
+        # Em ambientes mais lentos, os cards do menu principal podem aparecer depois.
+        step("home.wait", wait=9000),
+    ]),
+    # --- AFA (11 páginas) ---
+    ("AFA", [
+        step("afa", ("menu", "AFA"), wait=6500, then=[
+            shot("afa.shot", "AFA"),
+            # Tabs topo na ordem do PDF
+            step("afa.aviadores", ("text", "Formação Aviadores"), wait=5500, then=[
+                shot("afa.aviadores.shot", "AFA - Formação Aviadores"),
+            ]),
+            step("afa.intendencia", ("text", "Formação Intendência"), wait=5500, then=[
+                shot("afa.intendencia.shot", "AFA - Formação Intendência"),
+            ]),
+            step("afa.infantaria", ("text", "Formação Infantaria"), wait=5500, then=[
+                shot("afa.infantaria.shot", "AFA - Formação Infantaria"),
+            ]),
+            # tentamos as 2 grafias do Simulador, mas só uma vai existir
+            step("afa.simulador", ("text", "Aeronave / Simulador"), ("text", "Aeronave/Simulador"), wait=5500, then=[
+                shot("afa.simulador.shot", "AFA - Aeronave_Simulador"),
+            ]),
+            # Instrução T25 (principal)
+            step("afa.t25", ("text", "Instrução T25"), wait=6000, then=[
+                shot("afa.t25.shot", "AFA - Instrução T25"),
+                # Existem 2 botões "Detalhar" no T25 (CFOAV 2º e 4º) – PDF tem os 2
+                step("afa.t25.det1", ("button", "Detalhar", 0), ("text", "Detalhar", 0), wait=7000,
+                     then=detalhar_steps("afa.t25.det1", "AFA - T25 Detalhar CFOAV 2º Ano")),
+                step("afa.t25.det2", ("button", "Detalhar", 1), ("text", "Detalhar", 1), wait=7000,
+                     then=detalhar_steps("afa.t25.det2", "AFA - T25 Detalhar CFOAV 4º Ano")),
+            ]),
+            # Instrução T27 (principal) – no T27 o PDF tem 1 Detalhar
+            step("afa.t27", ("text", "Instrução T27"), wait=6000, then=[
+                shot("afa.t27.shot", "AFA - Instrução T27"),
+                step("afa.t27.det1", ("button", "Detalhar", 0), ("text", "Detalhar", 0), wait=7000,
+                     then=detalhar_steps("afa.t27.det1", "AFA - T27 Detalhar CFOAV 4º Ano")),
+            ]),
+            # Esforço Aéreo
+            step("afa.esforco", ("text", "Esforço Aéreo"), wait=6000, then=[
+                shot("afa.esforco.shot", "AFA - Esforço Aéreo"),
+            ]),
+        ]),
+    ]),
+    om_cursos_branch("EPCAR", ["Cursos da EPCAR"]),
+    om_cursos_branch("EEAR", ["Cursos da EEAR"]),
+    om_cursos_branch("CIAAR", ["Cursos do CIAAR", "Cursos da CIAAR"]),
+    om_cursos_branch("IEAD", ["Cursos do IEAD", "Cursos da IEAD"]),
+    om_cursos_branch("UNIFA", ["Cursos da UNIFA", "Cursos do UNIFA"]),
+    # --- ECEMAR (4) ---
+    ("ECEMAR", [
+        step("ecemar", ("menu", "ECEMAR"), wait=6500, then=[
+            step("ecemar.confirma", ("ensure", "ECEMAR", [
+                ["Cursos da ECEMAR"],
+                ["PLAMENS exterior", "PLAMENS Exterior", "PLAMENS EXTERIOR"],
+            ])),
+            shot("ecemar.shot", "ECEMAR"),
+            # 1) Cursos da ECEMAR (PDF tem)
+            step("ecemar.cursos", ("open", ["Cursos da ECEMAR", "Cursos do ECEMAR", "Cursos ECEMAR"], ["ecemar"]),
+                 wait=6500, then=[
+                shot("ecemar.cursos.shot", "ECEMAR - Cursos"),
+                step("ecemar.cursos.voltar", ("back_to_om", "ECEMAR")),
+            ]),
+            # 2) PLAMENS exterior (PDF tem 2 capturas seguidas dessa tela)
+            step("ecemar.plamens", ("open", [
+                "PLAMENS exterior",
+                "PLAMENS Exterior",
+                "PLAMENS EXTERIOR",
+                "PLAMENS no exterior",
+            ], ["plamens"]), wait=6500, then=[
+                shot("ecemar.plamens.1", "ECEMAR - PLAMENS exterior (1)"),
+                # segunda captura (descartada se a rolagem não mudou nada)
+                step("ecemar.plamens.rolar", ("wheel", 700)),
+                shot("ecemar.plamens.2", "ECEMAR - PLAMENS exterior (2)", dup="drop"),
+                step("ecemar.plamens.voltar", ("back_to_om", "ECEMAR")),
+            ]),
+        ]),
+    ]),
+    om_cursos_branch("EAOAR", ["Cursos da EAOAR", "Cursos do EAOAR"]),
+    # ==========================================================
+    # BLOCO DIRENS TROCAD0 (conforme seu snippet, click1.png)
+    # ==========================================================
+    ("DIRENS", [
+        step("direns", ("menu", "DIRENS"), wait=6500, then=[
+            shot("direns.shot", "DIRENS"),
+            # subtela é um <button> com background-image click1.png (sem texto)
+            step("direns.exames", ("bg", "click1.png", 0), ("card", "Dados dos Exames"), wait=6500,
+                 warn="DIRENS: não achei button com click1.png para abrir a subtela.", then=[
+                shot("direns.exames.shot", "DIRENS - Dados dos Exames"),
+                step("direns.exames.voltar", ("back_to_om", "DIRENS")),
+            ]),
+        ]),
+    ]),
+    # ==========================================================
+    # BLOCO ASSISTENCIAIS (4) — CBNB / CTRB / ECE por background-image
+    # ==========================================================
+    ("ASSISTENCIAIS", [
+        step("assistenciais", ("menu", "ASSISTENCIAIS"), wait=6500, then=[
+            shot("assistenciais.shot", "ASSISTENCIAIS - Cards"),
+        ] + [
+            step(f"assistenciais.{key}", ("open", txt_opts, img_opts), wait=6500,
+                 warn=f"ASSISTENCIAIS: não achei card {label} (texto/imagem).", then=[
+                shot(f"assistenciais.{key}.shot", label),
+                step(f"assistenciais.{key}.voltar", ("back_to_om", "ASSISTENCIAIS")),
+            ])
+            for key, txt_opts, img_opts, label in [
+                ("cbnb", ["CBNB"], ["cbnb_egovens_2.png", "cbnb"], "ASSISTENCIAIS - CBNB"),
+                ("ctrb", ["CTRB"], ["ctrb_egovens_2.png", "ctrb"], "ASSISTENCIAIS - CTRB"),
+                ("ece", ["ECE"], ["ece_egovens_2.png", "ece_egovens"], "ASSISTENCIAIS - ECE"),
+            ]
+        ]),
+    ]),
+]
+
+def iter_steps(steps):
+    for st in steps:
+        yield st
+        yield from iter_steps(st.get("then") or [])
+
+def plan_shots(plan):
+    """
+    Lista (id, rótulo) de todas as capturas do plano, na ordem do PDF.
+    """
+    return [
+        (st["id"], st["shot"])
+        for _name, steps in plan
+        for st in iter_steps(steps)
+        if "shot" in st
+    ]
 
-    # limpa tmp antigo
-    for f in Path(TMP_DIR).glob("page_*.png"):
+def select_shots(plan, step_ids):
+    """
+    Converte ids de passos em ids de captura: um passo de navegação
+    seleciona todas as capturas da sua subárvore.
+    """
+    wanted = set(step_ids)
+    selected = set()
+    for _name, steps in plan:
+        for st in iter_steps(steps):
+            if st["id"] in wanted:
+                wanted.discard(st["id"])
+                selected.update(s["id"] for s in iter_steps([st]) if "shot" in s)
+    for unknown in sorted(wanted):
+        print(f"[AVISO] Passo '{unknown}' não existe no plano.")
+    return selected
+
+def _subtree_selected(st, selected) -> bool:
+    return any(s["id"] in selected for s in iter_steps([st]) if "shot" in s)
+
+def new_run(plan, selected=None):
+    """
+    Estado de uma execução do plano. selected=None captura tudo.
+    """
+    return {
+        "numbers": {sid: n for n, (sid, _label) in enumerate(plan_shots(plan), start=1)},
+        "selected": selected,
+        "files": {},
+        "paths": {},
+        "status": {},
+        # índice de hashes perceptuais de todas as capturas da execução
+        "hashes": {},
+        # sha256 de cada captura (cache de páginas e diferença p/ o relatório anterior)
+        "keys": {},
+        # última captura por página (id(page) -> id do passo)
+        "last": {},
+        "previous": {},
+        "pdf": None,
+        # plano/PDF do checkpoint gravado a cada captura (ver save_plan_state)
+        "plan": plan,
+        "out_pdf": None,
+        "times": {},
+        # "Voltar" adiado por página (id(page) -> passo): cai fora se o
+        # próximo passo abrir a tela por link direto
+        "pending_return": {},
+        # passo de entrada da OM do ramo corrente por página (recover_page)
+        "entry": {},
+        "expired": False,
+        # ramos que caíram por exceção (navegador/página morta): execução incompleta
+        "interrupted": [],
+        "t0": time.monotonic(),
+        "first_shot_s": None,
+    }
+
+# Índice de links diretos: URL (sheet/state) a que cada passo de navegação
+# levou da última vez que rodou por clique. Se o passo já tem link, abre a
+# tela com page.goto; se o link não der na tela esperada, é esquecido e o
+# passo roda pelo clique de sempre (que grava o link de novo).
+SHEET_LINKS_FILE = "sheet_links.json"
+SHEET_LINKS = {}
+LINK_STATS = {"goto": 0, "fallback": 0, "skipped_back": 0}
+RETURN_ACTIONS = ("back", "back_to_om")
+
+def load_sheet_links():
+    try:
+        with open(os.path.join(TMP_DIR, SHEET_LINKS_FILE), "r", encoding="utf-8") as f:
+            SHEET_LINKS.update(json.load(f))
+    except:
+        pass
+
+def save_sheet_links():
+    try:
+        with open(os.path.join(TMP_DIR, SHEET_LINKS_FILE), "w", encoding="utf-8") as f:
+            json.dump(SHEET_LINKS, f, ensure_ascii=False, indent=2, sort_keys=True)
+    except Exception as e:
+        print(f"[AVISO] Não consegui gravar o índice de links ({e}).")
+
+def print_link_summary():
+    if any(LINK_STATS.values()):
+        print(
+            f"[INFO] Links diretos: {LINK_STATS['goto']} telas abertas por URL, "
+            f"{LINK_STATS['fallback']} voltaram ao clique, {LINK_STATS['skipped_back']} 'Voltar' pulados."
+        )
+
+def is_return_step(st) -> bool:
+    return bool(st.get("do")) and all(action in RETURN_ACTIONS for action, *_args in st["do"])
+
+def sheet_link(step_id: str):
+    """
+    Link utilizável do passo. Se dois passos levaram à mesma tela (ex.: os
+    dois "Detalhar" do T25), o que muda entre eles são as seleções, que não
+    estão na URL: esse link não serve e o passo segue por clique.
+    """
+    link = SHEET_LINKS.get(step_id)
+    if not link:
+        return None
+    shared = any(other != step_id and o.get("sheet") == link["sheet"] for other, o in SHEET_LINKS.items())
+    return None if shared else link
+
+# texto da barra de seleções atuais: o clique pode ter filtrado algo que a URL não leva
+SELECTIONS_JS = """() => {
+    const bar = document.querySelector(".qv-selections-pager, .qvt-selections, .qv-subtoolbar-selections");
+    return bar ? bar.innerText.replace(/\\s+/g, " ").trim() : "";
+}"""
+
+def current_selections_ops(page):
+    try:
+        return (yield ("evaluate", SELECTIONS_JS))
+    except Exception:
+        return ""
+
+def navigated_sheet(page, before_sheet: str):
+    """
+    Sheet nova a que o passo levou (ou None se ficou na mesma tela).
+    """
+    if "/sheet/" not in (page.url or ""):
+        return None
+    sheet = sheet_key(page)
+    return sheet if sheet != before_sheet else None
+
+def record_sheet_link_ops(page, st, before_sheet: str):
+    sheet = navigated_sheet(page, before_sheet)
+    if sheet:
+        url = page.url
+        SHEET_LINKS[st["id"]] = {"url": url, "sheet": sheet, "selections": (yield from current_selections_ops(page))}
+
+@traced
+def goto_sheet_link_ops(page, st, link):
+    """
+    Abre a tela do passo direto pela URL. Confere se caiu na sheet
+    registrada, com objetos no stage e as mesmas seleções; se não, devolve
+    a página para onde estava (para o clique partir do lugar certo) e esquece o link.
+    """
+    before = page.url
+    try:
+        yield ("goto", link["url"])
+        yield ("wait", max(st.get("wait") or 0, 4500))
+        ok = (
+            sheet_key(page) == link["sheet"]
+            and (yield ("count", STAGE_OBJECTS_SELECTOR)) > 0
+            and (yield from current_selections_ops(page)) == link.get("selections", "")
+        )
+    except Exception:
+        ok = False
+    if ok:
+        LINK_STATS["goto"] += 1
+        return True
+
+    LINK_STATS["fallback"] += 1
+    SHEET_LINKS.pop(st["id"], None)
+    print(f"[AVISO] {st['id']}: link direto não abriu a tela; voltando ao clique.")
+    if page.url != before:
         try:
-            f.unlink()
-        except:
+            yield ("goto", before)
+            yield ("wait", 4500)
+        except Exception:
             pass
+    return False
 
-    shots = []
-    idx = 1
+def flush_pending_return_ops(page, run):
+    st = run["pending_return"].pop(id(page), None)
+    if st:
+        with step_span(st) as span_args:
+            span_args["ok"] = yield from _run_actions_ops(page, st, run)
+
+def run_step_ops(page, st, run):
+    with step_span(st) as span_args:
+        ok = yield from _run_step_ops(page, st, run)
+        span_args["ok"] = ok
+        return ok
+
+def _run_step_ops(page, st, run):
+    if DEEP_LINKS and is_return_step(st):
+        # só roda quando (e se) o próximo passo precisar da tela anterior
+        run["pending_return"][id(page)] = st
+        run["status"][st["id"]] = "ok"
+        trace_note(action="adiado")
+        return True
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch(
-            headless=False,
-            channel="chrome"
-        )
-        context = browser.new_context(
-            ignore_https_errors=True,
-            viewport={"width": 1920, "height": 1080},
-            device_scale_factor=1
+    link = sheet_link(st["id"]) if DEEP_LINKS and st.get("do") else None
+    if link and (yield from goto_sheet_link_ops(page, st, link)):
+        if run["pending_return"].pop(id(page), None):
+            LINK_STATS["skipped_back"] += 1
+        trace_note(action="link")
+        run["status"][st["id"]] = "ok"
+        return True
+
+    yield from flush_pending_return_ops(page, run)
+    if "shot" in st:
+        png, data = yield ("shot", run["numbers"][st["id"]], st["shot"])
+        return register_shot(page, st, run, png, data)
+    return (yield from _run_actions_ops(page, st, run))
+
+def _run_actions_ops(page, st, run):
+    before_sheet = sheet_key(page)
+    ok = not st["do"]
+    for alt, (action, *args) in enumerate(st["do"]):
+        try:
+            if (yield ("action", action, args)):
+                ok = True
+                trace_note(action=action, alternative=alt)
+                break
+        except Exception as e:
+            print(f"[AVISO] {st['id']}: '{action}' falhou ({e}).")
+
+    if not ok and st.get("warn"):
+        print(f"[AVISO] {st['warn']}")
+    if ok and st.get("wait"):
+        yield ("wait", st["wait"])
+    if ok and st["do"] and not is_return_step(st):
+        yield from record_sheet_link_ops(page, st, before_sheet)
+    run["status"][st["id"]] = "ok" if ok else "fail"
+    return ok
+
+def run_steps_ops(page, steps, run, depth: int = 0):
+    """
+    Executa uma lista de passos. Na recaptura parcial pula capturas não
+    selecionadas e subárvores sem nenhuma captura selecionada; passos
+    simples (abas, esperas, voltar) da lista ativa continuam rodando.
+    Passo que falha por estouro do STEP_BUDGET_S recarrega a página e volta
+    à tela da OM (recover_page). Devolve True quando isso aconteceu abaixo
+    dos filhos da OM: os níveis de cima dependiam da tela perdida e param;
+    nos filhos diretos da OM (depth 1) a lista segue com o próximo passo.
+    """
+    for st in steps:
+        if skip_step(st, run["selected"]):
+            continue
+        if run_expired():
+            run["expired"] = True
+            return False
+        t0 = time.monotonic()
+        recovered = False
+        if (yield from run_step_ops(page, st, run)):
+            if st.get("then"):
+                recovered = yield from run_steps_ops(page, st["then"], run, depth + 1)
+        elif step_overran(st, t0):
+            recovered = yield from recover_page_ops(page, run, reenter=depth > 0)
+        if recovered and depth > 1:
+            return True
+    return False
+
+def step_overran(st, t0: float) -> bool:
+    return bool(st.get("do")) and bool(STEP_BUDGET_S) and time.monotonic() - t0 >= STEP_BUDGET_S
+
+def branch_entry(steps):
+    """
+    Passo que entra na OM do ramo (o 1º com ação), usado para voltar a ela
+    depois de recarregar a página.
+    """
+    return next((st for st in steps if st.get("do")), None)
+
+RECOVERY_STATS = {"reloads": 0, "isolated": 0}
+
+@traced
+def recover_page_ops(page, run, reenter: bool = True):
+    """
+    Recarrega o QLIK_URL e, com reenter, roda de novo o passo de entrada da
+    OM do ramo corrente. Devolve True (a página foi reposta).
+    """
+    run["pending_return"].pop(id(page), None)
+    drop_cdp_session(page)
+    entry = run["entry"].get(id(page)) if reenter else None
+    print(f"[AVISO] Passo estourou {STEP_BUDGET_S} s; recarregando a página" +
+          (f" e voltando a {entry['id']}." if entry else "."))
+    RECOVERY_STATS["reloads"] += 1
+    try:
+        yield ("goto", QLIK_URL)
+        yield ("wait", 9000)
+        if entry:
+            yield from run_step_ops(page, entry, run)
+    except Exception as e:
+        print(f"[AVISO] Recarga falhou ({e}).")
+    return True
+
+def branch_failed(steps, run) -> bool:
+    return any(run["status"].get(st["id"]) == "fail" for st in iter_steps(steps))
+
+def branch_interrupted(run, name, e):
+    print(f"[AVISO] {name}: ramo interrompido ({e}).")
+    run["interrupted"].append(name)
+
+def run_branch_ops(page, name, steps, run, previous_failed: bool = False):
+    """
+    Roda um ramo (OM) isolado: se o ramo anterior desta página falhou, começa
+    recarregando o QLIK_URL, e exceção num ramo não derruba os seguintes.
+    Devolve True se o ramo terminou com falha.
+    """
+    run["entry"][id(page)] = branch_entry(steps)
+    with trace_span(f"branch:{name}"):
+        try:
+            if previous_failed and not run_expired():
+                RECOVERY_STATS["isolated"] += 1
+                print(f"[INFO] {name}: ramo anterior falhou; começando da página inicial.")
+                yield ("goto", QLIK_URL)
+                yield ("wait", 9000)
+            yield from run_steps_ops(page, steps, run)
+        except Exception as e:
+            branch_interrupted(run, name, e)
+            return True
+    return branch_failed(steps, run)
+
+def run_branches_ops(page, branches, run):
+    """
+    Roteiro de uma página: abre o QLIK_URL e roda os ramos em sequência
+    (o modo paralelo e o async chamam com um ramo por página).
+    """
+    yield ("start",)
+    if branches and branches[0][0] != "HOME":
+        # recaptura parcial ou ramo isolado sem o HOME: mesma espera antes do primeiro menu
+        yield ("wait", 9000)
+    failed = False
+    for name, steps in branches:
+        failed = yield from run_branch_ops(page, name, steps, run, previous_failed=failed)
+
+def print_recovery_summary(run):
+    if RECOVERY_STATS["reloads"] or RECOVERY_STATS["isolated"]:
+        print(
+            f"[INFO] Recuperação: {RECOVERY_STATS['reloads']} recarga(s) por passo estourado, "
+            f"{RECOVERY_STATS['isolated']} ramo(s) recomeçado(s) da página inicial."
         )
-        page = context.new_page()
+    if run.get("expired"):
+        print(f"[AVISO] Prazo de {RUN_DEADLINE_MIN} min esgotado; passos restantes ficaram de fora (use --resume).")
+    if run.get("interrupted"):
+        print(f"[AVISO] Ramo(s) interrompido(s) por erro: {', '.join(run['interrupted'])} (use --resume).")
 
-        page.goto(QLIK_URL, wait_until="domcontentloaded", timeout=WAIT_MAX_MS)
-        wait_qlik(page, extra_ms=4500)
+def skip_step(st, selected) -> bool:
+    if selected is None:
+        return False
+    if "shot" in st and st["id"] not in selected:
+        return True
+    return bool(st.get("then")) and not _subtree_selected(st, selected)
 
-        # CHECKPOINT: se nada funcionar, ao menos 1 captura para diagnóstico
-        idx = add_shot(page, shots, idx, "00 - HOME (debug)")
-        # Em ambientes mais lentos, os cards do menu principal podem aparecer depois.
-        wait_qlik(page, extra_ms=9000)
-        
-        # =========================
-        # ROTEIRO FIXO = PDF ANEXADO
-        # =========================
+def find_duplicate(run, page, h):
+    """
+    Procura a captura mais parecida no índice de hashes da execução.
+    Devolve (id, distância, é_a_anterior_desta_página) ou None.
+    """
+    prev_id = run["last"].get(id(page))
+    best = None
+    for sid, other in list(run["hashes"].items()):
+        dist = hash_distance(h, other)
+        if dist <= DUP_HASH_THRESHOLD and (best is None or dist < best[1]):
+            best = (sid, dist, sid == prev_id)
+    if prev_id and best and not best[2]:
+        # prefere reportar a anterior quando ela também casa
+        dist = hash_distance(h, run["hashes"][prev_id])
+        if dist <= DUP_HASH_THRESHOLD:
+            best = (prev_id, dist, True)
+    return best
+
+def register_shot(page, st, run, png, data) -> bool:
+    """
+    Depois da captura: hash/duplicata, registro na execução, PDF em
+    streaming e checkpoint.
+    """
+    n = run["numbers"][st["id"]]
+    if run.get("first_shot_s") is None:
+        run["first_shot_s"] = time.monotonic() - run["t0"]
+    print(f"[OK] Capturada: {st['shot']} (tela estável em {SHOT_SETTLE_MS.get(id(page), 0)} ms)")
+    if isinstance(png, str) or DEBUG_SAVE_PNG:
+        run["paths"][st["id"]] = shot_png_path(n, st["shot"])
+
+    dup_mode = st.get("dup", DUP_MODE)
+    h = image_hash(data) if dup_mode != "off" else None
+    dup = find_duplicate(run, page, h) if h is not None else None
+    if h is not None:
+        run["hashes"][st["id"]] = h
+        run["last"][id(page)] = st["id"]
+
+    if dup:
+        dup_id, dist, is_prev = dup
+        if is_prev and dup_mode == "drop":
+            try:
+                if run["paths"].pop(st["id"], None):
+                    os.remove(shot_png_path(n, st["shot"]))
+            except:
+                pass
+            print(f"[INFO] {st['shot']}: captura descartada, igual à anterior ({dup_id}, dist. {dist}).")
+            run["status"][st["id"]] = "dup"
+            checkpoint(run, st)
+            return True
+        print(f"[AVISO] {st['shot']}: parecida com {dup_id} (dist. {dist}); clique pode não ter funcionado.")
 
-        # --- AFA (11 páginas) ---
-        if click_menu_item(page, "AFA"):
-            wait_qlik(page, extra_ms=6500)
-            idx = add_shot(page, shots, idx, "AFA")
+    run["files"][st["id"]] = png
+    run["status"][st["id"]] = "ok"
+    run["keys"][st["id"]] = shot_key(data)
+    if run.get("pdf"):
+        # roteiro completo e sequencial: a página já vai para o PDF
+        run["pdf"].add_page(png, run["keys"][st["id"]])
+    checkpoint(run, st)
+    return True
 
-            # Tabs topo na ordem do PDF
-            for tab in ["Formação Aviadores", "Formação Intendência", "Formação Infantaria", "Aeronave / Simulador"]:
-                # tentamos as 2 grafias do Simulador, mas só uma vai existir
-                if tab == "Aeronave / Simulador":
-                    if click_text(page, "Aeronave / Simulador") or click_text(page, "Aeronave/Simulador"):
-                        wait_qlik(page, extra_ms=5500)
-                        idx = add_shot(page, shots, idx, "AFA - Aeronave_Simulador")
-                    continue
-
-                if click_text(page, tab):
-                    wait_qlik(page, extra_ms=5500)
-                    idx = add_shot(page, shots, idx, f"AFA - {tab}")
+_PLAN_STATE_LOCK = threading.Lock()
 
-            # Instrução T25 (principal)
-            if click_text(page, "Instrução T25"):
-                wait_qlik(page, extra_ms=6000)
-                idx = add_shot(page, shots, idx, "AFA - Instrução T25")
+def checkpoint(run, st):
+    """
+    Regrava o estado do plano depois de cada captura, marcado como
+    incompleto: se o Chrome cair ou a sessão expirar no meio, --resume
+    continua daqui.
+    """
+    run["times"][st["id"]] = datetime.now().isoformat(timespec="seconds")
+    if run["out_pdf"]:
+        try:
+            save_plan_state(run["plan"], run, run["out_pdf"], complete=False)
+        except Exception as e:
+            print(f"[AVISO] Não consegui gravar o checkpoint ({e}).")
 
-                # Existem 2 botões "Detalhar" no T25 (CFOAV 2º e 4º) – PDF tem os 2
-                # Clique no 1º Detalhar
-                if click_button(page, "Detalhar", nth=0) or click_text(page, "Detalhar", nth=0):
-                    wait_qlik(page, extra_ms=7000)
-                    idx = capture_detalhar_tabs(page, shots, idx, "AFA - T25 Detalhar CFOAV 2º Ano")
-                    back(page)
-
-                # Clique no 2º Detalhar
-                if click_button(page, "Detalhar", nth=1) or click_text(page, "Detalhar", nth=1):
-                    wait_qlik(page, extra_ms=7000)
-                    idx = capture_detalhar_tabs(page, shots, idx, "AFA - T25 Detalhar CFOAV 4º Ano")
-                    back(page)
-
-            # Instrução T27 (principal)
-            if click_text(page, "Instrução T27"):
-                wait_qlik(page, extra_ms=6000)
-                idx = add_shot(page, shots, idx, "AFA - Instrução T27")
-
-                # No T27 o PDF tem 1 Detalhar
-                if click_button(page, "Detalhar", nth=0) or click_text(page, "Detalhar", nth=0):
-                    wait_qlik(page, extra_ms=7000)
-                    idx = capture_detalhar_tabs(page, shots, idx, "AFA - T27 Detalhar CFOAV 4º Ano")
-                    back(page)
+def resumable_shot(prev) -> bool:
+    if prev.get("status") == "dup":
+        return True
+    return prev.get("status") == "ok" and bool(prev.get("file")) and os.path.exists(prev["file"])
 
-            # Esforço Aéreo
-            if click_text(page, "Esforço Aéreo"):
-                wait_qlik(page, extra_ms=6000)
-                idx = add_shot(page, shots, idx, "AFA - Esforço Aéreo")
-
-        # --- EPCAR (2) ---
-        if click_menu_item(page, "EPCAR"):
-            wait_qlik(page, extra_ms=6500)
-            idx = add_shot(page, shots, idx, "EPCAR")
-            if click_card_like(page, "Cursos da EPCAR"):
-                wait_qlik(page, extra_ms=6500)
-                idx = add_shot(page, shots, idx, "EPCAR - Cursos")
-
-        # --- EEAR (2) ---
-        if click_menu_item(page, "EEAR"):
-            wait_qlik(page, extra_ms=6500)
-            idx = add_shot(page, shots, idx, "EEAR")
-            if click_card_like(page, "Cursos da EEAR"):
-                wait_qlik(page, extra_ms=6500)
-                idx = add_shot(page, shots, idx, "EEAR - Cursos")
-
-        # --- CIAAR (2) ---
-        if click_menu_item(page, "CIAAR"):
-            wait_qlik(page, extra_ms=6500)
-            idx = add_shot(page, shots, idx, "CIAAR")
-            if click_card_like(page, "Cursos do CIAAR") or click_card_like(page, "Cursos da CIAAR"):
-                wait_qlik(page, extra_ms=6500)
-                idx = add_shot(page, shots, idx, "CIAAR - Cursos")
-
-        # --- IEAD (2) ---
-        if click_menu_item(page, "IEAD"):
-            wait_qlik(page, extra_ms=6500)
-            idx = add_shot(page, shots, idx, "IEAD")
-            if click_card_like(page, "Cursos do IEAD") or click_card_like(page, "Cursos da IEAD"):
-                wait_qlik(page, extra_ms=6500)
-                idx = add_shot(page, shots, idx, "IEAD - Cursos")
-
-        # --- UNIFA (2) ---
-        if click_menu_item(page, "UNIFA"):
-            wait_qlik(page, extra_ms=6500)
-            idx = add_shot(page, shots, idx, "UNIFA")
-            if click_card_like(page, "Cursos da UNIFA") or click_card_like(page, "Cursos do UNIFA"):
-                wait_qlik(page, extra_ms=6500)
-                idx = add_shot(page, shots, idx, "UNIFA - Cursos")
-
-        # --- ECEMAR (4) ---
-        if click_menu_item(page, "ECEMAR"):
-            wait_qlik(page, extra_ms=6500)
-            # Garante que estamos na tela principal da ECEMAR antes da 1ª captura.
-            has_cursos = False
-            has_plamens = False
-            for _ in range(2):
-                stage = page.locator("#qv-stage-container")
-                has_cursos = stage.get_by_text("Cursos da ECEMAR", exact=False).count() > 0
-                has_plamens = (
-                    stage.get_by_text("PLAMENS exterior", exact=False).count() > 0
-                    or stage.get_by_text("PLAMENS Exterior", exact=False).count() > 0
-                    or stage.get_by_text("PLAMENS EXTERIOR", exact=False).count() > 0
-                )
-                if has_cursos and has_plamens:
-                    break
-                click_menu_item(page, "ECEMAR")
-                wait_qlik(page, extra_ms=4500)
+def load_plan_manifest():
+    path = os.path.join(TMP_DIR, PLAN_STATE_FILE)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except:
+        return {}
 
-            if not (has_cursos and has_plamens):
-                print("[AVISO] ECEMAR: tela principal não confirmou os 2 cards antes da captura.")
-            idx = add_shot(page, shots, idx, "ECEMAR")
+def load_plan_state():
+    return load_plan_manifest().get("shots", {})
 
-            # 1) Cursos da ECEMAR (PDF tem)
-            if open_card(
-                page,
-                text_options=["Cursos da ECEMAR", "Cursos do ECEMAR", "Cursos ECEMAR"],
-                image_options=["ecemar"],
-            ):
-                wait_qlik(page, extra_ms=6500)
-                idx = add_shot(page, shots, idx, "ECEMAR - Cursos")
-                back_to_om(page, "ECEMAR")
+def save_plan_state(plan, run, out_pdf, complete=True):
+    """
+    Grava o resultado de cada captura (arquivo, hash, status e hora).
+    Capturas não selecionadas nesta execução herdam o registro anterior.
+    complete=False é o checkpoint de uma execução ainda em andamento.
+    """
+    shots = {}
+    for sid, label in plan_shots(plan):
+        prev = run["previous"].get(sid) or {}
+        if run["selected"] is not None and sid not in run["selected"]:
+            shots[sid] = prev or {"label": label, "file": None, "status": "missing"}
+            continue
+        shots[sid] = {
+            "label": label,
+            "file": run["paths"].get(sid),
+            "hash": run["hashes"][sid].hex() if sid in run["hashes"] else None,
+            "key": run["keys"].get(sid),
+            "status": run["status"].get(sid, "missing"),
+            "at": run["times"].get(sid),
+        }
+
+    # tmp + replace: uma queda no meio da gravação não perde o estado anterior
+    path = os.path.join(TMP_DIR, PLAN_STATE_FILE)
+    with _PLAN_STATE_LOCK:
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "pdf": out_pdf,
+                "updated": datetime.now().isoformat(timespec="seconds"),
+                "complete": complete,
+                "shots": shots,
+            }, f, ensure_ascii=False, indent=2)
+        os.replace(path + ".tmp", path)
+
+def print_page_delta(plan, run):
+    """
+    Lista as páginas que mudaram desde o relatório anterior (sha256 da
+    captura contra o registrado no plan_state da execução anterior).
+    """
+    changed, same, new = [], 0, 0
+    for sid, label in plan_shots(plan):
+        key = run["keys"].get(sid)
+        if key is None:
+            continue
+        before = (run["previous"].get(sid) or {}).get("key")
+        if before is None:
+            new += 1
+        elif before == key:
+            same += 1
+        else:
+            changed.append(label)
+    if not changed and not same:
+        return
+    print(
+        f"[INFO] Desde o relatório anterior: {len(changed)} página(s) mudaram, {same} iguais"
+        + (f", {new} sem registro anterior." if new else ".")
+    )
+    for label in changed:
+        print(f"  mudou: {label}")
+
+def spliced_pages(plan, run):
+    """
+    Sequência final de páginas [(id, captura)]: capturas novas no lugar
+    delas e, para as não recapturadas, o arquivo bom da execução anterior.
+    """
+    pages = []
+    for sid, _label in plan_shots(plan):
+        png = run["files"].get(sid)
+        if png is None:
+            prev = run["previous"].get(sid) or {}
+            if prev.get("status") == "ok" and prev.get("file") and os.path.exists(prev["file"]):
+                png = prev["file"]
+        if png:
+            pages.append((sid, png))
+    return pages
+
+# ====== REDE: filtro de recursos e estatística por tela ======
+# Regras (ação, resource_type ou None, regex da URL ou None), a 1ª que casar vale:
+#   block = aborta (telemetria, mídia...)
+#   cache = baixa uma vez e serve da memória para as outras páginas/contextos
+NETWORK_RULES = [
+    # rastreadores só pelo host e telemetria só como trecho inteiro do caminho:
+    # "sentry" solto no meio de uma URL do painel não pode bloquear nada
+    ("block", None, r"^[a-z]+://([^/?#]*\.)?(google-analytics|googletagmanager|doubleclick|hotjar|newrelic|sentry)\."),
+    ("block", None, r"/(telemetry|usage-?stats)(/|\?|$)"),
+    ("block", "ping", None),
+    ("block", "media", None),
+    ("block", "eventsource", None),
+    ("cache", "font", None),
+    ("cache", "stylesheet", None),
+    ("cache", "script", None),
+    ("cache", "image", r"/extensions/|/resources/|\.(png|svg|gif|jpe?g)(\?|$)"),
+]
+
+_NET_CACHE = {}
+_FROM_CACHE = set()
+# por tela (sheet_key): requisições, bytes, bloqueadas, servidas do cache, espera
+SHEET_STATS = {}
+
+def _sheet_stats(sheet: str):
+    return SHEET_STATS.setdefault(sheet, {
+        "requests": 0, "bytes": 0, "blocked": 0, "cached": 0, "cached_bytes": 0, "wait_ms": 0,
+    })
+
+def _request_sheet(request) -> str:
+    try:
+        return sheet_key(request.frame.page)
+    except:
+        return "?"
 
-            # 2) PLAMENS exterior (PDF tem 2 capturas seguidas dessa tela)
-            if open_card(
-                page,
-                text_options=[
-                    "PLAMENS exterior",
-                    "PLAMENS Exterior",
-                    "PLAMENS EXTERIOR",
-                    "PLAMENS no exterior",
-                ],
-                image_options=["plamens"],
-            ):
-                wait_qlik(page, extra_ms=6500)
-                idx = add_shot(page, shots, idx, "ECEMAR - PLAMENS exterior (1)")
-                first_plamens_png = shots[-1] if shots else ""
-
-                # segunda captura
-                try:
-                    page.mouse.wheel(0, 700)
-                    page.wait_for_timeout(1500)
-                except:
-                    pass
-                second_label = "ECEMAR - PLAMENS exterior (2)"
-                second_png = os.path.join(TMP_DIR, f"page_{idx:03d}_{safe(second_label)}.png")
-                screenshot_page(page, second_png)
-                if files_are_identical(first_plamens_png, second_png):
+def network_action(resource_type: str, url: str):
+    for action, rtype, rx in NETWORK_RULES:
+        if rtype and rtype != resource_type:
+            continue
+        if rx and not re.search(rx, url, re.IGNORECASE):
+            continue
+        return action
+    return None
+
+def route_decision(request):
+    """
+    O que fazer com a requisição no filtro de rede (já contando na tela):
+    ("abort",), ("fulfill", status, headers, corpo) do cache em memória,
+    ("fetch",) para baixar e guardar com cache_fetched, ou ("continue",).
+    """
+    action = network_action(request.resource_type, request.url)
+    if action == "block":
+        _sheet_stats(_request_sheet(request))["blocked"] += 1
+        return ("abort",)
+
+    if action == "cache" and request.method == "GET":
+        hit = _NET_CACHE.get(request.url)
+        if not hit:
+            return ("fetch",)
+        status, headers, body = hit
+        stats = _sheet_stats(_request_sheet(request))
+        stats["cached"] += 1
+        stats["cached_bytes"] += len(body)
+        _FROM_CACHE.add(request)
+        return ("fulfill", status, headers, body)
+
+    return ("continue",)
+
+def cache_fetched(request, status: int, headers, body: bytes):
+    if status == 200:
+        _NET_CACHE[request.url] = (status, headers, body)
+
+def _route_request(route, request):
+    kind, *hit = route_decision(request)
+    if kind == "abort":
+        route.abort()
+    elif kind == "fulfill":
+        status, headers, body = hit
+        route.fulfill(status=status, headers=headers, body=body)
+    elif kind == "fetch":
+        try:
+            resp = route.fetch()
+            body = resp.body()
+        except:
+            route.continue_()
+            return
+        cache_fetched(request, resp.status, resp.headers, body)
+        route.fulfill(response=resp, body=body)
+    else:
+        route.continue_()
+
+def _count_response(response):
+    request = response.request
+    if request in _FROM_CACHE:
+        _FROM_CACHE.discard(request)
+        return
+    stats = _sheet_stats(_request_sheet(request))
+    stats["requests"] += 1
+    try:
+        # tamanho pelo content-length (sem round trip); respostas chunked ficam de fora
+        stats["bytes"] += int(response.headers.get("content-length") or 0)
+    except:
+        pass
+
+def setup_network(context, use_route: bool = True):
+    context.on("response", _count_response)
+    if REPLAY_DIR:
+        context.route("**/*", _replay_route)
+    elif NETWORK_FILTER and use_route:
+        context.route("**/*", _route_request)
+
+def _sheet_stats_file(filtered: bool) -> str:
+    return os.path.join(TMP_DIR, "sheet_stats_filtrado.json" if filtered else "sheet_stats_sem_filtro.json")
+
+def save_sheet_stats():
+    try:
+        with open(_sheet_stats_file(NETWORK_FILTER), "w", encoding="utf-8") as f:
+            json.dump(SHEET_STATS, f, indent=2)
+    except Exception as e:
+        print(f"[AVISO] Não consegui gravar a estatística de rede ({e}).")
+
+def print_sheet_comparison():
+    """
+    Compara por tela o tempo de carga (soma dos wait_qlik) e os bytes
+    baixados desta execução com a última execução no outro modo
+    (com/sem filtro de rede), se houver.
+    """
+    try:
+        with open(_sheet_stats_file(not NETWORK_FILTER), "r", encoding="utf-8") as f:
+            other = json.load(f)
+    except:
+        other = None
+
+    filtered, unfiltered = (SHEET_STATS, other) if NETWORK_FILTER else (other, SHEET_STATS)
+    if not filtered or not unfiltered:
+        mode = "--no-filter" if NETWORK_FILTER else "o filtro ligado"
+        print(f"[INFO] Para comparar carga/bytes por tela, rode também com {mode}.")
+        return
+
+    print("\n[INFO] Rede por tela (com filtro x sem filtro):")
+    print(f"  {'tela':<38} {'carga ms':>17} {'KB baixados':>19} {'bloq.':>6} {'cache':>6}")
+    empty = {"bytes": 0, "blocked": 0, "cached": 0, "wait_ms": 0}
+    tot = [0, 0, 0, 0]
+    for sheet in sorted(set(filtered) | set(unfiltered)):
+        f_ = filtered.get(sheet) or empty
+        u_ = unfiltered.get(sheet) or empty
+        tot = [tot[0] + f_["wait_ms"], tot[1] + u_["wait_ms"], tot[2] + f_["bytes"], tot[3] + u_["bytes"]]
+        print(f"  {sheet[:38]:<38} {f_['wait_ms']:>8}/{u_['wait_ms']:<8} "
+              f"{f_['bytes'] // 1024:>9}/{u_['bytes'] // 1024:<9} {f_['blocked']:>6} {f_['cached']:>6}")
+    print(f"  {'TOTAL':<38} {tot[0]:>8}/{tot[1]:<8} {tot[2] // 1024:>9}/{tot[3] // 1024:<9}")
+    if tot[1]:
+        print(f"  economia: {100 - tot[0] * 100 / tot[1]:.0f}% de espera, "
+              f"{(tot[3] - tot[2]) // 1024} KB a menos.")
+
+# ====== GRAVAÇÃO E REPLAY DA SESSÃO ======
+# --record DIR: cada contexto grava um HAR (session_<n>.har, corpo embutido)
+# e os frames de texto dos WebSockets vão para DIR/engine_frames.json.
+# --replay DIR: as requisições HTTP são servidas do HAR (não gravada =
+# abortada, o replay não sai para a rede) e o WebSocket do engine é
+# simulado: cada pedido JSON-RPC recebe a resposta gravada para o mesmo
+# método/handle/params, com o id do pedido novo, no tempo gravado vezes
+# REPLAY_SPEED. Pedidos repetidos recebem as respostas na ordem gravada.
+RECORD_DIR = None
+REPLAY_DIR = None
+REPLAY_FRAMES_FILE = "engine_frames.json"
+_HAR_SEQ = itertools.count(1)
+_RECORD_SOCKETS = []
+_REPLAY = {"http": {}, "engine": {}, "hello": [], "served": {}}
+REPLAY_STATS = {"http": 0, "http_missing": 0, "rpc": 0, "rpc_missing": 0}
+_HAR_SKIP_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+def har_options() -> dict:
+    """
+    Opções do contexto para gravar o HAR (só com --record).
+    """
+    if not RECORD_DIR:
+        return {}
+    Path(RECORD_DIR).mkdir(parents=True, exist_ok=True)
+    return {
+        "record_har_path": os.path.join(RECORD_DIR, f"session_{next(_HAR_SEQ)}.har"),
+        "record_har_content": "embed",
+    }
+
+def record_socket(ws):
+    sock = {"url": ws.url, "t0": time.monotonic(), "frames": []}
+    _RECORD_SOCKETS.append(sock)
+    ws.on("framesent", lambda payload: _record_frame(sock, "sent", payload))
+    ws.on("framereceived", lambda payload: _record_frame(sock, "recv", payload))
+
+def _record_frame(sock, direction: str, payload):
+    if isinstance(payload, str):
+        sock["frames"].append([direction, int((time.monotonic() - sock["t0"]) * 1000), payload])
+
+def save_recording():
+    if not RECORD_DIR:
+        return
+    sockets = [{"url": s["url"], "frames": s["frames"]} for s in _RECORD_SOCKETS]
+    try:
+        with open(os.path.join(RECORD_DIR, REPLAY_FRAMES_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                "url": QLIK_URL,
+                "recorded": datetime.now().isoformat(timespec="seconds"),
+                "sockets": sockets,
+            }, f, ensure_ascii=False)
+    except Exception as e:
+        print(f"[AVISO] Não consegui gravar os frames do engine ({e}).")
+        return
+    frames = sum(len(s["frames"]) for s in sockets)
+    print(f"[INFO] Sessão gravada em {RECORD_DIR}: HAR por contexto + {frames} frames de {len(sockets)} WebSocket(s).")
+
+def _rpc_key(msg):
+    return msg["method"], msg.get("handle"), json.dumps(msg.get("params"), sort_keys=True)
+
+def load_replay() -> str:
+    """
+    Carrega os HAR e os frames gravados em REPLAY_DIR. Devolve o QLIK_URL
+    da gravação (o replay só conhece as URLs que foram gravadas).
+    """
+    for har in sorted(Path(REPLAY_DIR).glob("session_*.har")):
+        with open(har, "r", encoding="utf-8") as f:
+            entries = json.load(f)["log"]["entries"]
+        for entry in entries:
+            req, resp = entry["request"], entry["response"]
+            # requisição abortada/bloqueada ou upgrade de WebSocket: nada a servir
+            if resp.get("status", 0) <= 0 or resp["status"] == 101:
+                continue
+            content = resp.get("content") or {}
+            text = content.get("text") or ""
+            body = base64.b64decode(text) if content.get("encoding") == "base64" else text.encode("utf-8")
+            headers = {
+                h["name"]: h["value"] for h in resp.get("headers", [])
+                if h["name"].lower() not in _HAR_SKIP_HEADERS
+            }
+            _REPLAY["http"].setdefault((req["method"], req["url"]), []).append(
+                (resp["status"], headers, body, entry.get("time") or 0)
+            )
+
+    try:
+        with open(os.path.join(REPLAY_DIR, REPLAY_FRAMES_FILE), "r", encoding="utf-8") as f:
+            recording = json.load(f)
+    except:
+        recording = {"sockets": []}
+    for sock in recording["sockets"]:
+        sent, hello, last = {}, [], None
+        for direction, t, payload in sock["frames"]:
+            for msg in _rpc_messages(payload):
+                if direction == "sent" and "id" in msg and "method" in msg:
+                    sent[msg["id"]] = (_rpc_key(msg), t)
+                elif direction == "recv" and "id" in msg and "method" not in msg and msg["id"] in sent:
+                    key, t_sent = sent.pop(msg["id"])
+                    last = {"reply": msg, "ms": t - t_sent, "then": []}
+                    _REPLAY["engine"].setdefault(key, []).append(last)
+                elif direction == "recv" and "id" not in msg:
+                    # notificação: a da abertura vai no connect, as outras atrás da resposta anterior
+                    (hello if last is None else last["then"]).append(msg)
+        if hello and not _REPLAY["hello"]:
+            _REPLAY["hello"] = hello
+
+    print(
+        f"[INFO] Replay de {REPLAY_DIR}: {sum(map(len, _REPLAY['http'].values()))} respostas HTTP, "
+        f"{sum(map(len, _REPLAY['engine'].values()))} respostas do engine "
+        f"(velocidade {REPLAY_SPEED}x, +{REPLAY_LATENCY_MS} ms)."
+    )
+    return recording.get("url")
+
+def replay_delay(ms: float) -> int:
+    return int(ms * REPLAY_SPEED + REPLAY_LATENCY_MS)
+
+def _replay_next(key, replies):
+    n = _REPLAY["served"].get(key, 0)
+    _REPLAY["served"][key] = n + 1
+    return replies[min(n, len(replies) - 1)]
+
+def replay_http(request):
+    """
+    Resposta gravada da requisição: (status, headers, corpo, atraso_ms) ou None.
+    """
+    key = (request.method, request.url)
+    entries = _REPLAY["http"].get(key)
+    if not entries:
+        REPLAY_STATS["http_missing"] += 1
+        return None
+    REPLAY_STATS["http"] += 1
+    status, headers, body, ms = _replay_next(key, entries)
+    return status, headers, body, replay_delay(ms)
+
+def replay_rpc(msg):
+    """
+    Frames a devolver para um pedido JSON-RPC do engine: [(payload, atraso_ms)].
+    """
+    key = _rpc_key(msg)
+    replies = _REPLAY["engine"].get(key)
+    if not replies:
+        REPLAY_STATS["rpc_missing"] += 1
+        error = {"code": -32601, "message": f"replay: {msg['method']} não gravado"}
+        return [(json.dumps({"jsonrpc": "2.0", "id": msg["id"], "error": error}), replay_delay(0))]
+    REPLAY_STATS["rpc"] += 1
+    rec = _replay_next(key, replies)
+    return [(json.dumps(dict(rec["reply"], id=msg["id"])), replay_delay(rec["ms"]))] + [
+        (json.dumps(m), 0) for m in rec["then"]
+    ]
+
+def _replay_route(route, request):
+    hit = replay_http(request)
+    if hit is None:
+        route.abort()
+        return
+    status, headers, body, delay_ms = hit
+    if delay_ms:
+        try:
+            # o handler roda no seu próprio greenlet: a espera não segura as outras requisições
+            request.frame.page.wait_for_timeout(delay_ms)
+        except:
+            pass
+    route.fulfill(status=status, headers=headers, body=body)
+
+def setup_replay_page(page):
+    """
+    No replay, troca os WebSockets da página pelo engine simulado. Chamar
+    antes do goto (open_start_page).
+    """
+    if REPLAY_DIR:
+        page.route_web_socket(re.compile(r"^wss?://"), lambda ws: _replay_socket(page, ws))
+
+def replay_socket_opened(page):
+    """
+    Estado do engine da página para o socket simulado (ou None) e as
+    notificações da abertura, a mandar logo no connect.
+    """
+    state = _ENGINE.get(id(page))
+    if state:
+        state["sockets"] += 1
+    return state, [json.dumps(msg) for msg in _REPLAY["hello"]]
+
+def replay_requests(state, ws, payload):
+    """
+    Pedidos JSON-RPC num frame que a página mandou ao engine simulado
+    (já contados como em voo).
+    """
+    if state:
+        _engine_sent(state, ws, payload)
+    return [msg for msg in _rpc_messages(payload) if "id" in msg and "method" in msg]
+
+def replay_replied(state, ws, payload):
+    if state:
+        _engine_received(state, ws, payload)
+
+def _replay_socket(page, ws):
+    state, hello = replay_socket_opened(page)
+
+    def on_message(payload):
+        for msg in replay_requests(state, ws, payload):
+            for reply, delay_ms in replay_rpc(msg):
+                if delay_ms:
                     try:
-                        os.remove(second_png)
+                        page.wait_for_timeout(delay_ms)
                     except:
-                        pass
-                    print("[INFO] ECEMAR - PLAMENS exterior: 2ª captura descartada por duplicidade.")
-                else:
-                    shots.append(second_png)
-                    print(f"[OK] Capturada: {second_label}")
-                    idx += 1
-
-                back_to_om(page, "ECEMAR")
-
-        # --- EAOAR (2) ---
-        if click_menu_item(page, "EAOAR"):
-            wait_qlik(page, extra_ms=6500)
-            idx = add_shot(page, shots, idx, "EAOAR")
-            if click_card_like(page, "Cursos da EAOAR") or click_card_like(page, "Cursos do EAOAR"):
-                wait_qlik(page, extra_ms=6500)
-                idx = add_shot(page, shots, idx, "EAOAR - Cursos")
-
-        # ==========================================================
-        # BLOCO DIRENS TROCAD0 (conforme seu snippet, click1.png)
-        # ==========================================================
-        # --- DIRENS (2) ---
-        if click_menu_item(page, "DIRENS"):
-            wait_qlik(page, extra_ms=6500)
-            idx = add_shot(page, shots, idx, "DIRENS")
+                        return
+                ws.send(reply)
+                replay_replied(state, ws, reply)
+
+    ws.on_message(on_message)
+    for payload in hello:
+        ws.send(payload)
+
+def print_replay_summary():
+    if REPLAY_DIR:
+        print(
+            f"[INFO] Replay: {REPLAY_STATS['http']} respostas HTTP do HAR ({REPLAY_STATS['http_missing']} não gravadas, "
+            f"abortadas), {REPLAY_STATS['rpc']} pedidos do engine ({REPLAY_STATS['rpc_missing']} sem gravação)."
+        )
 
-            # subtela é um <button> com background-image click1.png (sem texto)
-            if click_by_bg_image(page, "click1.png", nth=0) or click_card_like(page, "Dados dos Exames"):
-                wait_qlik(page, extra_ms=6500)
-                idx = add_shot(page, shots, idx, "DIRENS - Dados dos Exames")
-                back_to_om(page, "DIRENS")
-            else:
-                print("[AVISO] DIRENS: não achei button com click1.png para abrir a subtela.")
-
-               # ==========================================================
-        # BLOCO ASSISTENCIAIS (4) — CBNB / CTRB / ECE por background-image
-        # ==========================================================
-        if click_menu_item(page, "ASSISTENCIAIS"):
-            wait_qlik(page, extra_ms=6500)
-            idx = add_shot(page, shots, idx, "ASSISTENCIAIS - Cards")
-
-            assistenciais_cards = [
-                (["CBNB"], ["cbnb_egovens_2.png", "cbnb"], "ASSISTENCIAIS - CBNB"),
-                (["CTRB"], ["ctrb_egovens_2.png", "ctrb"], "ASSISTENCIAIS - CTRB"),
-                (["ECE"], ["ece_egovens_2.png", "ece_egovens"], "ASSISTENCIAIS - ECE"),
-            ]
+# endpoint CDP de um Chrome já aberto (job de lote): conecta em vez de lançar
+CDP_ENDPOINT = None
+
+def launch_browser(p):
+    if CDP_ENDPOINT:
+        return p.chromium.connect_over_cdp(CDP_ENDPOINT)
+    return p.chromium.launch(**launch_options())
+
+def launch_options() -> dict:
+    return {"headless": HEADLESS, "channel": BROWSER_CHANNEL}
+
+CONTEXT_OPTIONS = {
+    "ignore_https_errors": True,
+    "viewport": {"width": 1920, "height": 1080},
+    "device_scale_factor": 1,
+}
+
+def storage_state_path() -> str:
+    return os.path.join(SESSION_DIR, "storage_state.json")
+
+def profile_dir() -> str:
+    return os.path.join(SESSION_DIR, "profile")
+
+_SESSION_TMP_SEQ = itertools.count(1)
+
+def storage_state_tmp() -> str:
+    """
+    Temporário único por gravação (processo + sequência): jobs do --batch,
+    threads do modo paralelo e tarefas do qlik_async gravam a sessão ao
+    mesmo tempo, e só o os.replace final (commit_storage_state) pode ser disputado.
+    """
+    Path(SESSION_DIR).mkdir(parents=True, exist_ok=True)
+    return f"{storage_state_path()}.{os.getpid()}-{next(_SESSION_TMP_SEQ)}.tmp"
+
+def commit_storage_state(tmp: str):
+    os.replace(tmp, storage_state_path())
+
+def fresh_storage_state():
+    """
+    Caminho do storage state salvo, se existir e não estiver velho
+    (SESSION_MAX_AGE_H); senão None e o contexto começa do zero.
+    """
+    path = storage_state_path()
+    if not REUSE_STORAGE_STATE or not os.path.exists(path):
+        return None
+    age_h = (time.time() - os.path.getmtime(path)) / 3600
+    if age_h > SESSION_MAX_AGE_H:
+        print(f"[INFO] Sessão salva tem {age_h:.0f} h; ignorando (SESSION_MAX_AGE_H={SESSION_MAX_AGE_H}).")
+        return None
+    return path
+
+def save_storage_state(context):
+    if not REUSE_STORAGE_STATE:
+        return
+    try:
+        tmp = storage_state_tmp()
+        context.storage_state(path=tmp)
+        commit_storage_state(tmp)
+    except Exception as e:
+        print(f"[AVISO] Não consegui salvar a sessão ({e}).")
+
+def reset_session():
+    """
+    Invalida a sessão reaproveitada: apaga o storage state e o perfil persistente.
+    """
+    try:
+        os.remove(storage_state_path())
+    except:
+        pass
+    shutil.rmtree(profile_dir(), ignore_errors=True)
+    print(f"[INFO] Sessão salva apagada ({SESSION_DIR}).")
+
+def context_options() -> dict:
+    """
+    Opções do contexto novo: sessão salva (se servir), viewport e HAR do --record.
+    """
+    return {"storage_state": fresh_storage_state(), **CONTEXT_OPTIONS, **har_options()}
+
+def persistent_context_options() -> dict:
+    Path(profile_dir()).mkdir(parents=True, exist_ok=True)
+    return {"user_data_dir": profile_dir(), **launch_options(), **CONTEXT_OPTIONS, **har_options()}
 
-            for txt_opts, img_opts, label in assistenciais_cards:
-                if open_card(page, text_options=txt_opts, image_options=img_opts):
-                    wait_qlik(page, extra_ms=6500)
-                    idx = add_shot(page, shots, idx, label)
-                    back_to_om(page, "ASSISTENCIAIS")
-                else:
-                    print(f"[AVISO] ASSISTENCIAIS: não achei card {label} (texto/imagem).")
+def new_capture_context(browser):
+    context = browser.new_context(**context_options())
+    setup_network(context)
+    return context
 
+def open_capture_context(p):
+    """
+    Abre o contexto do roteiro sequencial. Com PERSISTENT_PROFILE usa um
+    perfil do Chrome em disco (cookies + cache HTTP de JS/CSS/imagens),
+    então a partir da 2ª execução o mashup já sobe autenticado e com os
+    bundles em cache. Devolve (context, fechar).
+    """
+    if PERSISTENT_PROFILE and not CDP_ENDPOINT:
+        context = p.chromium.launch_persistent_context(**persistent_context_options())
+        # com route o Chromium desliga o cache HTTP: aqui quem cacheia é o perfil
+        setup_network(context, use_route=False)
+        return context, context.close
+
+    browser = launch_browser(p)
+    context = new_capture_context(browser)
+
+    def close():
         context.close()
         browser.close()
+    return context, close
+
+@traced
+def open_start_page(page):
+    track_engine(page)
+    setup_replay_page(page)
+    page.goto(QLIK_URL, wait_until="domcontentloaded", timeout=WAIT_MAX_MS)
+    wait_qlik(page, extra_ms=4500)
 
-    build_pdf(shots, out_pdf)
+def capture_branch_isolated(browser, name, steps, run):
+    """
+    Executa um ramo do plano em contexto/página próprios, partindo do QLIK_URL.
+    Usado pelo modo paralelo.
+    """
+    context = new_capture_context(browser)
+    try:
+        page = context.new_page()
+        run_ops(page, run_branches_ops(page, [(name, steps)], run))
+        save_storage_state(context)
+    except Exception as e:
+        branch_interrupted(run, name, e)
+    finally:
+        try:
+            context.close()
+        except:
+            pass
+
+def _parallel_worker(jobs, run):
+    # Playwright sync não pode ser compartilhado entre threads:
+    # cada worker tem o seu próprio driver/browser.
+    with sync_playwright() as p:
+        browser = launch_browser(p)
+        try:
+            while True:
+                try:
+                    name, steps = jobs.get_nowait()
+                except queue.Empty:
+                    break
+                capture_branch_isolated(browser, name, steps, run)
+                print(f"[INFO] Ramo {name} concluído.")
+        finally:
+            browser.close()
+
+def capture_parallel(branches, run, workers):
+    """
+    Captura os ramos do plano em paralelo (um contexto por ramo). A ordem
+    das páginas vem da numeração do plano, não da ordem de término.
+    """
+    jobs = queue.Queue()
+    for branch in branches:
+        jobs.put(branch)
+
+    threads = [
+        threading.Thread(target=_parallel_worker, args=(jobs, run), daemon=True)
+        for _ in range(max(1, min(workers, len(branches))))
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+def capture_sequential(branches, run):
+    with sync_playwright() as p:
+        context, close = open_capture_context(p)
+        page = context.pages[0] if context.pages else context.new_page()
+        run_ops(page, run_branches_ops(page, branches, run))
+        save_storage_state(context)
+        close()
+
+# Roteiros disponíveis para --route: o e-GovEns completo ou só a tela do URL
+ROUTES = {
+    "egovens": PLAN,
+    "sheet": [("TELA", [shot("tela", "Tela")])],
+}
+
+# =========================
+# SEÇÕES, SHARDS E MERGE
+# =========================
+# --only AFA,ECEMAR roda só esses ramos (OMs); --shard i/n reparte os ramos
+# entre n processos/máquinas. Cada parte grava um PDF parcial e, ao lado,
+# <pdf>.pages.json com o número de cada página no roteiro completo; o
+# --merge junta as partes nessa ordem copiando os objetos das páginas.
+# Sem --tmp-dir, cada parte trabalha em TMP_DIR/parcial/<parte> (estado do
+# plano e capturas próprios), semeada com os caches da pasta principal.
+PARTIAL_SEED_FILES = (LOCATOR_CACHE_FILE, SHEET_LINKS_FILE, WAIT_HISTORY_FILE)
+
+def select_branches(plan, names):
+    wanted = {n.strip().upper() for n in names if n.strip()}
+    if not wanted:
+        raise ValueError(f"--only espera seções separadas por vírgula ({', '.join(name for name, _steps in plan)}).")
+    unknown = wanted - {name.upper() for name, _steps in plan}
+    if unknown:
+        raise ValueError(
+            f"seção(ões) {', '.join(sorted(unknown))} não existe(m) no roteiro "
+            f"({', '.join(name for name, _steps in plan)})."
+        )
+    return [(name, steps) for name, steps in plan if name.upper() in wanted]
+
+def shard_branches(plan, index: int, count: int):
+    """
+    Ramos do shard index (1..count). Reparte pelo nº de capturas, o maior
+    ramo primeiro para o shard menos carregado; determinístico, então
+    todos os processos chegam à mesma partição. Mantém a ordem do roteiro.
+    """
+    sizes = [sum(1 for st in iter_steps(steps) if "shot" in st) for _name, steps in plan]
+    loads = [0] * count
+    owner = {}
+    for k in sorted(range(len(plan)), key=lambda k: (-sizes[k], k)):
+        target = min(range(count), key=lambda i: (loads[i], i))
+        owner[k] = target
+        loads[target] += sizes[k]
+    return [branch for k, branch in enumerate(plan) if owner[k] == index - 1]
+
+def parse_shard(text: str):
+    m = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", text or "")
+    if not m or not 1 <= int(m.group(1)) <= int(m.group(2)):
+        raise ValueError(f"--shard espera i/n com 1 <= i <= n (recebi '{text}').")
+    return int(m.group(1)), int(m.group(2))
+
+def partial_tmp_dir(tag: str) -> str:
+    path = os.path.join(TMP_DIR, "parcial", tag)
+    Path(path).mkdir(parents=True, exist_ok=True)
+    for name in PARTIAL_SEED_FILES:
+        if not os.path.exists(os.path.join(path, name)) and os.path.exists(os.path.join(TMP_DIR, name)):
+            shutil.copy(os.path.join(TMP_DIR, name), os.path.join(path, name))
+    return path
+
+def shard_manifest_path(pdf: str) -> str:
+    return os.path.splitext(pdf)[0] + ".pages.json"
+
+def save_shard_manifest(out_pdf, route: str, part: str, plan, pages, shard=None):
+    """
+    Manifesto do PDF parcial: cada página com o id, o rótulo e o número no
+    roteiro completo (ordem do merge). shard = (i, n) do --shard, para o
+    merge saber se faltou alguma parte.
+    """
+    numbers = {sid: n for n, (sid, _label) in enumerate(plan_shots(ROUTES[route]), start=1)}
+    labels = dict(plan_shots(ROUTES[route]))
+    with open(shard_manifest_path(out_pdf), "w", encoding="utf-8") as f:
+        json.dump({
+            "route": route,
+            "part": part,
+            "shard": list(shard) if shard else None,
+            "branches": [name for name, _steps in plan],
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "pages": [{"id": sid, "label": labels[sid], "n": numbers[sid]} for sid, _png in pages],
+        }, f, ensure_ascii=False, indent=2)
+
+def _merge_part_paths(path: str):
+    """
+    (PDF, manifesto) de uma parte do --merge, dada pelo PDF ou pelo .pages.json.
+    """
+    if path.endswith(".pages.json"):
+        return path[:-len(".pages.json")] + ".pdf", path
+    return path, shard_manifest_path(path)
+
+@traced
+def merge_shards(pdfs, out_pdf) -> int:
+    """
+    Junta PDFs parciais na ordem do roteiro (manifestos .pages.json),
+    copiando as páginas sem decodificar/recodificar as imagens.
+    """
+    pages = {}
+    routes = set()
+    shards = {}
+    for path in pdfs:
+        pdf, manifest_path = _merge_part_paths(path)
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("shard"):
+                index, count = manifest["shard"]
+                shards.setdefault(count, set()).add(index)
+            if not manifest["pages"] and not os.path.exists(pdf):
+                # shard sem ramos: só o manifesto, para não parecer parte perdida
+                routes.add(manifest["route"])
+                print(f"[INFO] {manifest_path}: parte vazia ({manifest.get('part', '')}).")
+                continue
+            src = PdfPageSource(pdf)
+        except Exception as e:
+            print(f"[ERRO] {path}: não consegui ler o PDF/manifesto ({e}).")
+            return 0
+        if len(src.page_ids) != len(manifest["pages"]):
+            print(f"[ERRO] {pdf}: {len(src.page_ids)} páginas no PDF e {len(manifest['pages'])} no manifesto.")
+            return 0
+        routes.add(manifest["route"])
+        for page_id, entry in zip(src.page_ids, manifest["pages"]):
+            if entry["n"] in pages:
+                print(f"[AVISO] {entry['label']} aparece em mais de uma parte; fica a de {pages[entry['n']][0].path}.")
+                continue
+            pages[entry["n"]] = (src, page_id)
+        print(f"[INFO] {pdf}: {len(src.page_ids)} páginas ({manifest.get('part', '')}).")
+
+    for count, seen in sorted(shards.items()):
+        missing = sorted(set(range(1, count + 1)) - seen)
+        if missing:
+            print(f"[AVISO] Faltam os shards {', '.join(f'{i}/{count}' for i in missing)} no merge.")
+    if len(routes) > 1:
+        print(f"[AVISO] Partes de roteiros diferentes ({', '.join(sorted(routes))}); juntando pela numeração.")
+    elif routes and routes.issubset(ROUTES):
+        missing = [label for n, (_sid, label) in enumerate(plan_shots(ROUTES[routes.pop()]), start=1) if n not in pages]
+        if missing:
+            print(f"[AVISO] {len(missing)} página(s) do roteiro em nenhuma parte: {', '.join(missing)}.")
+
+    if not pages:
+        print("[ERRO] Nenhuma página nas partes informadas.")
+        return 0
+    writer = PdfStreamWriter(out_pdf, expected_pages=len(pages), workers=1)
+    for n in sorted(pages):
+        writer.add_pdf_page(*pages[n])
+    return writer.close()
+
+# =========================
+# LOTE DE RELATÓRIOS
+# =========================
+# jobs.json: lista de {"name", "url", "route", "output", "priority", "timeout_min", "args"}
+#   route     chave de ROUTES (padrão "egovens")
+#   output    nome base do PDF (padrão: name); sai em OUTPUT_DIR/<output>_<data>.pdf
+#   priority  maior roda antes (padrão 0)
+#   args      argumentos extras da linha de comando do job (ex.: ["--steps", "afa"])
+# Cada job é um processo "python qlik_to_pdf.py ..." com TMP próprio (caches
+# e estado do plano por painel) que se conecta por CDP ao mesmo Chrome: um
+# contexto por job, até BATCH_SLOTS ao mesmo tempo. Processo separado dá o
+# timeout de graça (mata o processo; o Chrome descarta o contexto dele).
+
+def load_jobs(path):
+    with open(path, "r", encoding="utf-8") as f:
+        jobs = json.load(f)
+    for n, job in enumerate(jobs):
+        job.setdefault("name", f"job{n + 1}")
+        job.setdefault("route", "egovens")
+        job.setdefault("output", job["name"])
+        job.setdefault("priority", 0)
+        job.setdefault("timeout_min", BATCH_JOB_TIMEOUT_MIN)
+        job.setdefault("args", [])
+        if job["route"] not in ROUTES:
+            raise ValueError(f"job {job['name']}: roteiro '{job['route']}' não existe ({', '.join(ROUTES)}).")
+        if not job.get("url"):
+            raise ValueError(f"job {job['name']}: falta a 'url' do painel.")
+    # sorted é estável: mesma prioridade mantém a ordem do arquivo
+    return sorted(jobs, key=lambda j: -j["priority"])
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _start_job(job, endpoint, ts):
+    job_tmp = os.path.join(TMP_DIR, "jobs", safe(job["name"]))
+    Path(job_tmp).mkdir(parents=True, exist_ok=True)
+    job["pdf"] = os.path.join(OUTPUT_DIR, f"{safe(job['output'])}_{ts}.pdf")
+    job["tmp"] = job_tmp
+    cmd = [
+        sys.executable, os.path.abspath(__file__),
+        "--url", job["url"],
+        "--route", job["route"],
+        "--out", job["pdf"],
+        "--tmp-dir", job_tmp,
+        "--cdp", endpoint,
+    ] + [str(a) for a in job["args"]]
+    log = open(os.path.join(job_tmp, "job.log"), "w", encoding="utf-8")
+    job["t0"] = time.monotonic()
+    print(f"[INFO] Lote: iniciando {job['name']} (prioridade {job['priority']}).")
+    env = dict(os.environ, PYTHONIOENCODING="utf-8")
+    return subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, env=env), log
+
+def _finish_job(job, proc, log, timed_out):
+    log.close()
+    job["s"] = round(time.monotonic() - job["t0"], 1)
+    state = {}
+    try:
+        with open(os.path.join(job["tmp"], PLAN_STATE_FILE), "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except:
+        pass
+    shots = state.get("shots", {})
+    job["pages"] = sum(1 for s in shots.values() if s.get("status") == "ok")
+    job["missing"] = sum(1 for s in shots.values() if s.get("status") not in ("ok", "dup"))
+    if timed_out:
+        job["status"] = "timeout"
+    elif proc.returncode != 0 or not os.path.exists(job["pdf"]):
+        job["status"] = "erro"
+    else:
+        job["status"] = "ok" if not job["missing"] else "parcial"
+    print(f"[INFO] Lote: {job['name']} terminou: {job['status']} em {job['s']} s, {job['pages']} página(s).")
+
+def run_batch(jobs_path, slots):
+    """
+    Roda os jobs do arquivo com no máximo `slots` ao mesmo tempo, todos no
+    mesmo Chrome, e grava o resumo do lote ao lado dos PDFs.
+    """
+    jobs = load_jobs(jobs_path)
+    Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
+    ts = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    pending = deque(jobs)
+    running = []
+    t0 = time.monotonic()
+
+    with sync_playwright() as p:
+        port = _free_port()
+        browser = p.chromium.launch(
+            headless=HEADLESS,
+            channel=BROWSER_CHANNEL,
+            args=[f"--remote-debugging-port={port}"],
+        )
+        endpoint = f"http://127.0.0.1:{port}"
+        try:
+            while pending or running:
+                while pending and len(running) < max(1, slots):
+                    job = pending.popleft()
+                    proc, log = _start_job(job, endpoint, ts)
+                    running.append((job, proc, log))
+                for item in list(running):
+                    job, proc, log = item
+                    timed_out = time.monotonic() - job["t0"] > job["timeout_min"] * 60
+                    if proc.poll() is None and not timed_out:
+                        continue
+                    if proc.poll() is None:
+                        print(f"[AVISO] Lote: {job['name']} passou de {job['timeout_min']} min; encerrando.")
+                        proc.kill()
+                        proc.wait()
+                    running.remove(item)
+                    _finish_job(job, proc, log, timed_out)
+                time.sleep(0.5)
+        finally:
+            for job, proc, log in running:
+                proc.kill()
+                log.close()
+            browser.close()
+
+    print_batch_summary(jobs, time.monotonic() - t0, ts)
+
+def print_batch_summary(jobs, wall_s, ts):
+    done = [j for j in jobs if "status" in j]
+    pages = sum(j["pages"] for j in done)
+    print(f"\n[INFO] Lote: {len(done)} job(s) em {wall_s / 60:.1f} min; "
+          f"{pages} páginas ({pages / max(wall_s / 60, 1e-9):.1f} por minuto).")
+    print(f"  {'job':<28} {'status':<8} {'s':>8} {'pág':>5} {'faltam':>7}  pdf")
+    for j in done:
+        print(f"  {j['name']:<28} {j['status']:<8} {j['s']:>8} {j['pages']:>5} {j['missing']:>7}  {j['pdf']}")
+    failed = [j["name"] for j in done if j["status"] not in ("ok",)]
+    if failed:
+        print(f"[AVISO] Jobs com problema: {', '.join(failed)} (log em TMP/jobs/<job>/job.log).")
+
+    summary = os.path.join(OUTPUT_DIR, f"lote_{ts}.json")
+    fields = ("name", "route", "priority", "status", "s", "pages", "missing", "pdf")
+    with open(summary, "w", encoding="utf-8") as f:
+        json.dump({
+            "wall_s": round(wall_s, 1),
+            "jobs": [{k: j.get(k) for k in fields} for j in jobs],
+        }, f, ensure_ascii=False, indent=2)
+    print(f"Resumo do lote: {summary}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Captura o e-GovEns (Qlik) e gera o PDF.")
+    parser.add_argument("--steps", default="",
+                        help="recaptura só estes passos (ids separados por vírgula) e remonta o PDF")
+    parser.add_argument("--failed", action="store_true",
+                        help="recaptura só as páginas que falharam/faltaram na execução anterior")
+    parser.add_argument("--resume", action="store_true",
+                        help="continua uma execução interrompida: captura só o que faltou e monta o PDF dela")
+    parser.add_argument("--list-steps", action="store_true",
+                        help="lista os ids dos passos do plano e sai")
+    parser.add_argument("--headless", action="store_true",
+                        help="roda sem janela (Chromium do Playwright se o Chrome não estiver instalado)")
+    parser.add_argument("--persistent-profile", action="store_true",
+                        help="usa perfil do Chrome persistente (cookies + cache HTTP em disco) entre execuções")
+    parser.add_argument("--reset-session", action="store_true",
+                        help="apaga a sessão/perfil salvos antes de começar (sessão expirada ou estranha)")
+    session = parser.add_mutually_exclusive_group()
+    session.add_argument("--record", metavar="DIR",
+                         help="grava o tráfego da sessão (HAR + frames do engine) em DIR")
+    session.add_argument("--replay", metavar="DIR",
+                         help="roda offline servindo a sessão gravada em DIR pelo page.route")
+    parser.add_argument("--replay-speed", type=float,
+                        help=f"multiplicador dos tempos gravados no replay (padrão {REPLAY_SPEED}; 0 = sem espera)")
+    parser.add_argument("--replay-latency-ms", type=int,
+                        help="latência fixa somada a cada resposta no replay")
+    parser.add_argument("--deadline-min", type=float,
+                        help=f"prazo da captura em minutos (padrão {RUN_DEADLINE_MIN}; 0 = sem prazo)")
+    parser.add_argument("--fixed-waits", action="store_true",
+                        help="usa os tetos fixos do código no wait_qlik, sem o histórico de esperas")
+    parser.add_argument("--relink", action="store_true",
+                        help="ignora os links diretos salvos: navega tudo por clique e refaz o índice")
+    parser.add_argument("--pdf-encoder", choices=["auto", "flate", "palette", "jpeg"],
+                        help="codificação das páginas do PDF (padrão: PDF_ENCODER)")
+    parser.add_argument("--pdf-max-mb", type=float,
+                        help="orçamento de tamanho do PDF em MB (padrão: PDF_MAX_MB, 0 = sem limite)")
+    parser.add_argument("--pdf-workers", type=int,
+                        help="processos para codificar as páginas do PDF (padrão: PDF_WORKERS)")
+    parser.add_argument("--batch",
+                        help="roda os jobs deste arquivo JSON (vários painéis, um PDF por job)")
+    parser.add_argument("--batch-slots", type=int, default=BATCH_SLOTS,
+                        help="jobs simultâneos do lote (contextos no mesmo Chrome)")
+    parser.add_argument("--url", help="URL inicial (padrão: QLIK_URL)")
+    parser.add_argument("--route", default="egovens", choices=sorted(ROUTES),
+                        help="roteiro de captura")
+    parser.add_argument("--out", help="caminho do PDF (padrão: OUTPUT_DIR/e-GovEns_<data>.pdf)")
+    parser.add_argument("--tmp-dir", help="pasta de trabalho (padrão: TMP_DIR)")
+    parser.add_argument("--only", help="roda só estas seções/OMs do roteiro (ex.: AFA,ECEMAR) num PDF parcial")
+    parser.add_argument("--shard", help="roda a parte i de n das OMs do roteiro (ex.: 2/3) num PDF parcial")
+    parser.add_argument("--merge", nargs="+", metavar="PDF",
+                        help="junta PDFs parciais (--only/--shard) na ordem do roteiro e sai "
+                             "(shard vazio: passe o .pages.json dele)")
+    parser.add_argument("--cdp", help="conecta por CDP a um Chrome já aberto em vez de lançar um")
+    parser.add_argument("--no-filter", action="store_true",
+                        help="desliga o filtro de rede (base de comparação de carga/bytes por tela)")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="captura pelo qlik_async (várias páginas num único event loop)")
+    args = parser.parse_args(argv)
+    # erro de uso sai pelo argparse (mensagem + uso), não como traceback
+    try:
+        if args.shard:
+            args.shard = parse_shard(args.shard)
+        if args.only:
+            select_branches(ROUTES[args.route], args.only.split(","))
+    except ValueError as e:
+        parser.error(str(e))
+    return args
+
+def main(argv=None):
+    global HEADLESS, BROWSER_CHANNEL, NETWORK_FILTER, PERSISTENT_PROFILE, DEEP_LINKS, PDF_ENCODER, PDF_MAX_MB
+    global PDF_WORKERS, QLIK_URL, TMP_DIR, OUTPUT_DIR, CDP_ENDPOINT, ASYNC_CAPTURE, ADAPTIVE_WAITS
+    global RUN_DEADLINE_MIN, RUN_DEADLINE_AT, RECORD_DIR, REPLAY_DIR, REPLAY_SPEED, REPLAY_LATENCY_MS
+
+    args = parse_args(argv)
+    if args.headless:
+        HEADLESS = True
+        if os.name != "nt" and not shutil.which("google-chrome"):
+            BROWSER_CHANNEL = None
+    if args.no_filter:
+        NETWORK_FILTER = False
+    if args.persistent_profile:
+        PERSISTENT_PROFILE = True
+    if args.reset_session:
+        reset_session()
+    if args.relink:
+        DEEP_LINKS = False
+    if args.fixed_waits:
+        ADAPTIVE_WAITS = False
+    if args.deadline_min is not None:
+        RUN_DEADLINE_MIN = args.deadline_min
+    if args.record:
+        RECORD_DIR = args.record
+    if args.replay_speed is not None:
+        REPLAY_SPEED = args.replay_speed
+    if args.replay_latency_ms is not None:
+        REPLAY_LATENCY_MS = args.replay_latency_ms
+    if args.replay:
+        REPLAY_DIR = args.replay
+        recorded_url = load_replay()
+        if recorded_url and not args.url:
+            QLIK_URL = recorded_url
+    if args.pdf_encoder:
+        PDF_ENCODER = args.pdf_encoder
+    if args.pdf_max_mb is not None:
+        PDF_MAX_MB = args.pdf_max_mb
+    if args.pdf_workers:
+        PDF_WORKERS = args.pdf_workers
+    if args.url:
+        QLIK_URL = args.url
+    if args.tmp_dir:
+        TMP_DIR = args.tmp_dir
+    if args.out:
+        OUTPUT_DIR = os.path.dirname(os.path.abspath(args.out))
+    if args.cdp:
+        CDP_ENDPOINT = args.cdp
+    if args.use_async:
+        ASYNC_CAPTURE = True
+    if args.batch:
+        run_batch(args.batch, args.batch_slots)
+        return
+    if args.merge:
+        Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
+        out_pdf = args.out or os.path.join(OUTPUT_DIR, f"e-GovEns_{datetime.now():%Y-%m-%d_%H-%M-%S}.pdf")
+        if merge_shards(args.merge, out_pdf):
+            print(f"\nOK - PDF gerado em: {out_pdf}")
+        return
+    plan = ROUTES[args.route]
+    part = None
+    if args.only:
+        plan = select_branches(plan, args.only.split(","))
+        part = "+".join(name for name, _steps in plan)
+    if args.shard:
+        index, count = args.shard
+        plan = shard_branches(plan, index, count)
+        part = f"{part or args.route}_shard{index}de{count}"
+        print(f"[INFO] Shard {index}/{count}: {', '.join(name for name, _steps in plan) or 'nenhum ramo'}.")
+    if part and not args.tmp_dir:
+        TMP_DIR = partial_tmp_dir(safe(part))
+    if args.list_steps:
+        for _name, steps in plan:
+            for st in iter_steps(steps):
+                desc = f"captura: {st['shot']}" if "shot" in st else ", ".join(a[0] for a in st["do"]) or "espera"
+                print(f"{st['id']:<40} {desc}")
+        return
+
+    Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
+    Path(TMP_DIR).mkdir(parents=True, exist_ok=True)
+
+    ts = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    out_pdf = args.out or os.path.join(OUTPUT_DIR, f"e-GovEns_{ts}{'_' + safe(part) if part else ''}.pdf")
+    if part and not plan:
+        # shard sem ramos (n maior que o nº de OMs): nem abre o navegador
+        save_shard_manifest(out_pdf, args.route, part, plan, [], args.shard)
+        print(f"[INFO] Nada a capturar nesta parte; manifesto vazio em {shard_manifest_path(out_pdf)}.")
+        return
+
+    manifest = load_plan_manifest()
+    previous = manifest.get("shots", {})
+    load_locator_cache()
+    load_wait_history()
+    if PAGE_CACHE:
+        load_page_cache()
+    if DEEP_LINKS:
+        load_sheet_links()
+    selected = None
+    if args.steps:
+        selected = select_shots(plan, [s.strip() for s in args.steps.split(",") if s.strip()])
+    if args.failed:
+        failed = {sid for sid, _label in plan_shots(plan) if (previous.get(sid) or {}).get("status") not in ("ok", "dup")}
+        selected = failed if selected is None else selected | failed
+    if args.resume:
+        if manifest.get("complete", True):
+            print("[INFO] A última execução terminou; nada a retomar (para refazer falhas use --failed).")
+            return
+        # "ok" sem arquivo (SHOTS_IN_MEMORY sem PNG de debug) também se perdeu
+        missing = {
+            sid for sid, _label in plan_shots(plan)
+            if not resumable_shot(previous.get(sid) or {})
+        }
+        selected = missing if selected is None else selected | missing
+        # mesmo PDF da execução interrompida
+        out_pdf = manifest.get("pdf") or out_pdf
+        print(f"[INFO] Retomando {manifest.get('updated', '')}: faltam {len(missing)} captura(s).")
+
+    if selected is None:
+        # limpa tmp antigo (na recaptura parcial as páginas anteriores são reaproveitadas)
+        for f in Path(TMP_DIR).glob("page_*.png"):
+            try:
+                f.unlink()
+            except:
+                pass
+    elif not selected and args.resume:
+        # tudo capturado, mas a execução caiu antes do PDF: só monta
+        run = new_run(plan, selected)
+        run["previous"] = previous
+        pages = spliced_pages(plan, run)
+        print("[INFO] Todas as capturas já estão salvas; montando o PDF.")
+        build_pdf([png for _sid, png in pages], out_pdf)
+        if part and os.path.exists(out_pdf):
+            save_shard_manifest(out_pdf, args.route, part, plan, pages, args.shard)
+        save_plan_state(plan, run, out_pdf, complete=os.path.exists(out_pdf))
+        print(f"\nOK - PDF gerado em: {out_pdf}")
+        print(f"Total de páginas: {len(pages)}")
+        return
+    elif not selected:
+        print("[INFO] Nada a recapturar.")
+        return
+
+    run = new_run(plan, selected)
+    run["previous"] = previous
+    run["out_pdf"] = out_pdf
+    # incompleto desde já: uma queda antes do 1º checkpoint não deixa o
+    # complete=True da execução anterior valendo para o --resume
+    save_plan_state(plan, run, out_pdf, complete=False)
+    branches = [
+        (name, steps) for name, steps in plan
+        if selected is None or any(_subtree_selected(st, selected) for st in steps)
+    ]
+
+    RUN_DEADLINE_AT = time.monotonic() + RUN_DEADLINE_MIN * 60 if RUN_DEADLINE_MIN else None
+    try:
+        if PARALLEL_WORKERS <= 1 and selected is None:
+            # as capturas chegam na ordem do PDF: grava durante a captura
+            run["pdf"] = PdfStreamWriter(out_pdf, expected_pages=len(run["numbers"]))
+        if ASYNC_CAPTURE:
+            # rodando como script este módulo é __main__: o qlik_async tem que
+            # enxergar esta mesma cópia (config e estado), não importar outra
+            sys.modules.setdefault("qlik_to_pdf", sys.modules[__name__])
+            import qlik_async
+            qlik_async.run_capture(branches, run, PARALLEL_WORKERS)
+        elif PARALLEL_WORKERS > 1:
+            capture_parallel(branches, run, PARALLEL_WORKERS)
+        else:
+            capture_sequential(branches, run)
+    except Exception as e:
+        # o checkpoint já tem tudo o que foi capturado até aqui; o PDF sai no --resume
+        if run["pdf"]:
+            run["pdf"].abort()
+        save_locator_cache()
+        save_wait_history(run)
+        save_page_cache()
+        save_recording()
+        save_sheet_links()
+        done = sum(1 for sid in run["numbers"] if run["status"].get(sid) in ("ok", "dup"))
+        print(f"[ERRO] Captura interrompida ({e}).")
+        print(f"[INFO] {done} captura(s) salvas; rode com --resume para continuar de onde parou.")
+        return
+
+    if run["first_shot_s"] is not None:
+        print(f"[INFO] Início até a 1ª captura: {run['first_shot_s']:.1f} s")
+    print_wait_summary()
+    print_engine_summary()
+    print_settle_summary()
+    print_locator_summary()
+    print_link_summary()
+    print_recovery_summary(run)
+    print_replay_summary()
+    save_recording()
+    save_locator_cache()
+    save_wait_history(run)
+    save_sheet_links()
+    save_sheet_stats()
+    print_sheet_comparison()
+    failed = [
+        sid for sid in run["numbers"]
+        if (selected is None or sid in selected) and run["status"].get(sid) not in ("ok", "dup")
+    ]
+    print_page_delta(plan, run)
+    pages = spliced_pages(plan, run)
+    shots = [png for _sid, png in pages]
+    if failed:
+        print(f"[AVISO] {len(failed)} página(s) sem captura: {', '.join(failed)} (use --failed para recapturar).")
+
+    if run["pdf"]:
+        with trace_span("pdf_close"):
+            closed = run["pdf"].close()
+        if not closed:
+            print("[ERRO] Nenhuma imagem foi gerada. Veja o PNG de debug e os avisos do log.")
+    else:
+        build_pdf(shots, out_pdf)
+    # só depois do PDF: se ele cair, o --resume monta de novo. Prazo
+    # esgotado, ramo caído ou captura faltando também ficam incompletos
+    save_plan_state(plan, run, out_pdf, complete=not (run["expired"] or run["interrupted"] or failed))
+    if part and os.path.exists(out_pdf):
+        save_shard_manifest(out_pdf, args.route, part, plan, pages, args.shard)
+    save_page_cache()
+    print_page_cache_summary()
+
+    if TRACE_ENABLED:
+        trace_json = os.path.splitext(out_pdf)[0] + ".trace.json"
+        export_trace(trace_json)
+        print_trace_summary()
+        print(f"Trace (chrome://tracing): {trace_json}")
     print(f"\nOK - PDF gerado em: {out_pdf}")
     print(f"Imagens temporárias em: {TMP_DIR}")
     print(f"Total de páginas: {len(shots)}")
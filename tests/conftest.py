@@ -0,0 +1,100 @@
+"""
+Testes sem navegador: o que roda no Python puro (plano, PDF, shards,
+estado do --resume). O navegador entra como objetos falsos.
+"""
+import contextlib
+import hashlib
+import io
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import qlik_to_pdf as q  # noqa: E402
+
+
+def label_color(label: str):
+    return tuple(hashlib.md5(label.encode("utf-8")).digest()[:3])
+
+
+def png_bytes(color, size=(64, 36)) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", size, color).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """
+    Pastas de trabalho temporárias e config sem efeitos fora delas
+    (sem trace, sem pool de processos, sem prazo).
+    """
+    monkeypatch.setattr(q, "TMP_DIR", str(tmp_path / "tmp"))
+    monkeypatch.setattr(q, "OUTPUT_DIR", str(tmp_path / "pdfs"))
+    monkeypatch.setattr(q, "SESSION_DIR", str(tmp_path / "session"))
+    monkeypatch.setattr(q, "REUSE_STORAGE_STATE", False)
+    monkeypatch.setattr(q, "TRACE_ENABLED", False)
+    monkeypatch.setattr(q, "PDF_WORKERS", 1)
+    monkeypatch.setattr(q, "PDF_REPORT", False)
+    monkeypatch.setattr(q, "RUN_DEADLINE_MIN", 0)
+    monkeypatch.setattr(q, "RUN_DEADLINE_AT", None)
+    for name in ("LOCATOR_CACHE", "SHEET_LINKS", "WAIT_HISTORY", "PAGE_CACHE_INDEX", "SHEET_STATS"):
+        monkeypatch.setattr(q, name, {})
+    os.makedirs(q.TMP_DIR)
+    return tmp_path
+
+
+class FakePage:
+    """
+    Página falsa: com alive=False toda chamada de navegação falha como um
+    navegador que caiu.
+    """
+
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.url = "http://qlik/sense/app/x/sheet/home/state/analysis"
+
+    def on(self, _event, _fn):
+        pass
+
+    def goto(self, url, **_kwargs):
+        if not self.alive:
+            raise RuntimeError("Target page, context or browser has been closed")
+        self.url = url
+
+
+@pytest.fixture
+def fake_browser(monkeypatch):
+    """
+    Troca o Playwright do roteiro sequencial por uma FakePage. Devolve um
+    dict: "page" (a página da próxima execução), "shots" (ids capturados) e
+    "die_after" (quantas capturas até o navegador cair; None = nunca).
+    """
+    state = {"page": None, "shots": [], "die_after": None}
+
+    class FakeContext:
+        @property
+        def pages(self):
+            return [state["page"]]
+
+    def capture_shot(page, idx, label):
+        if state["die_after"] is not None and len(state["shots"]) >= state["die_after"]:
+            page.alive = False
+        if not page.alive:
+            raise RuntimeError("Target page, context or browser has been closed")
+        data = png_bytes(label_color(label))
+        path = q.shot_png_path(idx, label)
+        with open(path, "wb") as f:
+            f.write(data)
+        state["shots"].append(label)
+        return path, data
+
+    monkeypatch.setattr(q, "sync_playwright", lambda: contextlib.nullcontext(None))
+    monkeypatch.setattr(q, "open_capture_context", lambda _p: (FakeContext(), lambda: None))
+    monkeypatch.setattr(q, "open_start_page", lambda page: None)
+    monkeypatch.setattr(q, "wait_qlik", lambda page, extra_ms=0: 0)
+    monkeypatch.setattr(q, "capture_shot", capture_shot)
+    return state
@@ -0,0 +1,75 @@
+import io
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import qlik_to_pdf as q
+
+URL = "http://qlik/sense/app/x"
+
+
+def write_jobs(tmp_path, jobs):
+    path = tmp_path / "jobs.json"
+    path.write_text(json.dumps(jobs), encoding="utf-8")
+    return str(path)
+
+
+def test_load_jobs_fills_defaults_and_orders_by_priority(tmp_path):
+    jobs = q.load_jobs(write_jobs(tmp_path, [
+        {"url": URL},
+        {"name": "urgente", "url": URL, "priority": 5},
+        {"name": "tambem", "url": URL, "priority": 5},
+        {"name": "depois", "url": URL, "priority": -1},
+    ]))
+    assert [j["name"] for j in jobs] == ["urgente", "tambem", "job1", "depois"]
+    first = jobs[2]
+    assert first["route"] == "egovens"
+    assert first["output"] == "job1"
+    assert first["timeout_min"] == q.BATCH_JOB_TIMEOUT_MIN
+    assert first["args"] == []
+
+
+@pytest.mark.parametrize("job, message", [
+    ({"name": "x", "url": URL, "route": "nao_existe"}, "job x: roteiro 'nao_existe' não existe"),
+    ({"name": "x"}, "job x: falta a 'url' do painel."),
+    ({"name": "x", "url": ""}, "job x: falta a 'url' do painel."),
+])
+def test_load_jobs_rejects_bad_jobs_before_starting(tmp_path, job, message):
+    with pytest.raises(ValueError, match=message):
+        q.load_jobs(write_jobs(tmp_path, [{"url": URL}, job]))
+
+
+def finished_job(tmp_path, shots, returncode=0, pdf=True, timed_out=False):
+    job = {"name": "j", "t0": 0, "tmp": str(tmp_path), "pdf": str(tmp_path / "j.pdf")}
+    if pdf:
+        (tmp_path / "j.pdf").write_bytes(b"%PDF")
+    if shots is not None:
+        state = {"complete": True, "shots": {sid: {"status": status} for sid, status in shots.items()}}
+        (tmp_path / q.PLAN_STATE_FILE).write_text(json.dumps(state), encoding="utf-8")
+    q._finish_job(job, SimpleNamespace(returncode=returncode), io.StringIO(), timed_out)
+    return job
+
+
+def test_finish_job_counts_pages_and_missing(tmp_path):
+    job = finished_job(tmp_path, {"a": "ok", "b": "dup", "c": "ok"})
+    assert (job["status"], job["pages"], job["missing"]) == ("ok", 2, 0)
+
+
+def test_finish_job_with_missing_shots_is_partial(tmp_path):
+    job = finished_job(tmp_path, {"a": "ok", "b": "fail", "c": "missing", "d": "dup"})
+    assert (job["status"], job["pages"], job["missing"]) == ("parcial", 1, 2)
+
+
+@pytest.mark.parametrize("kwargs, status", [
+    ({"timed_out": True}, "timeout"),
+    ({"returncode": 1}, "erro"),
+    ({"pdf": False}, "erro"),
+])
+def test_finish_job_failures(tmp_path, kwargs, status):
+    assert finished_job(tmp_path, {"a": "ok"}, **kwargs)["status"] == status
+
+
+def test_finish_job_without_state_file(tmp_path):
+    job = finished_job(tmp_path, None, returncode=1, pdf=False)
+    assert (job["status"], job["pages"], job["missing"]) == ("erro", 0, 0)
@@ -0,0 +1,120 @@
+import asyncio
+import base64
+
+import pytest
+
+import qlik_async as qa
+import qlik_to_pdf as q
+
+CLIP = {"x": 0, "y": 80, "width": 1280, "height": 640}
+
+
+class FakeCdp:
+    def __init__(self, log):
+        self.log = log
+
+    def send(self, method, params):
+        self.log.append((method, params))
+        return {"data": base64.b64encode(b"quadro").decode()}
+
+
+class ProbePage:
+    """
+    Página rolada em (0, 700) com sessão CDP falsa; frames é a sequência de
+    quadros que as sondas devolvem (o último se repete).
+    """
+
+    def __init__(self, frames=()):
+        self.sent = []
+        self.handlers = []
+        self.frames = list(frames)
+        self.sleeps = []
+        self.main_frame = object()
+        self.viewport_size = {"width": 1280, "height": 720}
+        self.context = self
+
+    def new_cdp_session(self, _page):
+        return FakeCdp(self.sent)
+
+    def on(self, event, fn):
+        self.handlers.append((event, fn))
+
+    def evaluate(self, js, _arg=None):
+        assert js == q.SCROLL_JS
+        return [0, 700]
+
+    def wait_for_timeout(self, ms):
+        self.sleeps.append(ms)
+
+    def close(self):
+        for event, fn in self.handlers:
+            if event == "close":
+                fn(self)
+
+
+class AsyncProbePage(ProbePage):
+    async def new_cdp_session(self, page):
+        cdp = super().new_cdp_session(page)
+
+        class AsyncCdp:
+            async def send(self, method, params):
+                return cdp.send(method, params)
+
+        return AsyncCdp()
+
+    async def evaluate(self, js, arg=None):
+        return super().evaluate(js, arg)
+
+
+@pytest.fixture
+def clean_sessions(monkeypatch):
+    monkeypatch.setattr(q, "_CDP_SESSIONS", {})
+    monkeypatch.setattr(q, "_INDEX_HOOKED", set())
+    monkeypatch.setattr(q, "_STAGE_INDEX", {})
+
+
+@pytest.mark.parametrize("page_cls", [ProbePage, AsyncProbePage])
+def test_probe_clip_is_moved_to_document_coordinates(clean_sessions, page_cls):
+    page = page_cls()
+    if page_cls is ProbePage:
+        frame = q.probe_frame(page, CLIP)
+    else:
+        frame = asyncio.run(qa.probe_frame(page, CLIP))
+
+    assert frame == b"quadro"
+    method, params = page.sent[0]
+    assert method == "Page.captureScreenshot"
+    assert params["clip"] == {"x": 0, "y": 780, "width": 1280, "height": 640, "scale": q.SHOT_PROBE_SCALE}
+
+
+def test_recreated_cdp_session_hooks_close_once(clean_sessions):
+    page = ProbePage()
+    for _ in range(3):
+        q.probe_frame(page, CLIP)
+        q.drop_cdp_session(page)
+    q.probe_frame(page, CLIP)
+
+    assert [event for event, _fn in page.handlers].count("close") == 1
+    page.close()
+    assert id(page) not in q._CDP_SESSIONS
+
+
+def test_pixels_stable_after_identical_frames(workdir, monkeypatch):
+    monkeypatch.setattr(q, "probe_frame", lambda page, _clip: page.frames.pop(0) if len(page.frames) > 1 else page.frames[0])
+    page = ProbePage(frames=[b"a", b"b", b"c", b"c", b"c", b"d"])
+    q.run_ops(page, q.wait_pixels_stable_ops(page, CLIP))
+
+    # a, b, c mudam; dois c iguais ao primeiro completam SHOT_STABLE_FRAMES
+    assert page.frames[0] == b"d"
+    assert page.sleeps == [q.SHOT_FRAME_INTERVAL_MS] * 4
+
+
+def test_pixels_never_stable_give_up_at_the_cap(workdir, monkeypatch, capsys):
+    frames = iter(range(10 ** 6))
+    monkeypatch.setattr(q, "probe_frame", lambda _page, _clip: next(frames))
+    monkeypatch.setattr(q, "SHOT_MAX_SETTLE_MS", 0)
+    page = ProbePage()
+    q.run_ops(page, q.wait_pixels_stable_ops(page, CLIP))
+
+    assert page.sleeps == []
+    assert "não estabilizou" in capsys.readouterr().out
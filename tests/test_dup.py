@@ -0,0 +1,98 @@
+import io
+import os
+
+import pytest
+from PIL import Image, ImageDraw
+
+import qlik_to_pdf as q
+from conftest import png_bytes
+from qlik_to_pdf import shot
+
+PLAN = [("A", [shot("a1", "A1"), shot("a2", "A2"), shot("a3", "A3", dup="drop")])]
+
+
+def screen(color=(255, 255, 255), bar=None, cursor=False, size=(320, 180)) -> bytes:
+    """
+    Tela falsa: fundo, uma barra escura em `bar` (x0, x1) e, com cursor,
+    um traço fino e claro no canto (mexe pouco na média do bloco).
+    """
+    im = Image.new("RGB", size, color)
+    draw = ImageDraw.Draw(im)
+    if bar:
+        draw.rectangle((bar[0], 20, bar[1], 160), fill=(0, 60, 120))
+    if cursor:
+        draw.line((300, 10, 300, 13), fill=(200, 200, 200))
+    buf = io.BytesIO()
+    im.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_hash_ignores_cursor_and_sees_a_changed_chart():
+    base = q.image_hash(screen(bar=(20, 120)))
+    assert q.hash_distance(base, q.image_hash(screen(bar=(20, 120), cursor=True))) <= q.DUP_HASH_THRESHOLD
+    assert q.hash_distance(base, q.image_hash(screen(bar=(160, 300)))) > q.DUP_HASH_THRESHOLD
+    assert q.hash_distance(base, base[:10]) > q.DUP_HASH_THRESHOLD
+
+
+def test_find_duplicate_prefers_the_previous_shot_of_the_page(workdir):
+    run = q.new_run(PLAN)
+    h = q.image_hash(screen(bar=(20, 120)))
+    other = q.image_hash(screen(bar=(160, 300)))
+    run["hashes"] = {"a1": h, "a2": h, "b1": other}
+    page = object()
+
+    run["last"][id(page)] = "a2"
+    assert q.find_duplicate(run, page, h) == ("a2", 0, True)
+    run["last"][id(page)] = "b1"
+    dup_id, _dist, is_prev = q.find_duplicate(run, page, h)
+    assert dup_id in ("a1", "a2") and not is_prev
+    assert q.find_duplicate(run, page, q.image_hash(screen((200, 0, 0)))) is None
+
+
+def register(run, page, st, data):
+    n = run["numbers"][st["id"]]
+    path = q.shot_png_path(n, st["shot"])
+    with open(path, "wb") as f:
+        f.write(data)
+    assert q.register_shot(page, st, run, path, data)
+    return path
+
+
+@pytest.mark.parametrize("mode", ["flag", "drop"])
+def test_register_shot_drops_a_repeat_only_where_asked(workdir, monkeypatch, mode):
+    monkeypatch.setattr(q, "DUP_MODE", mode)
+    run = q.new_run(PLAN)
+    page = object()
+    steps = {st["id"]: st for st in PLAN[0][1]}
+    same = png_bytes((10, 20, 30))
+
+    register(run, page, steps["a1"], same)
+    a2 = register(run, page, steps["a2"], same)
+    a3 = register(run, page, steps["a3"], same)
+
+    # a3 pede dup="drop" e sai em qualquer modo; a2 segue o DUP_MODE
+    assert run["status"]["a3"] == "dup"
+    assert "a3" not in run["files"] and not os.path.exists(a3)
+    if mode == "drop":
+        assert run["status"]["a2"] == "dup"
+        assert "a2" not in run["files"] and not os.path.exists(a2)
+    else:
+        assert run["status"]["a2"] == "ok"
+        assert run["files"]["a2"] == a2
+    assert run["status"]["a1"] == "ok"
+
+
+def test_flag_warns_and_keeps_the_page(workdir, monkeypatch, capsys):
+    monkeypatch.setattr(q, "DUP_MODE", "flag")
+    run = q.new_run(PLAN)
+    page = object()
+    same = png_bytes((10, 20, 30))
+    register(run, page, PLAN[0][1][0], same)
+    register(run, page, PLAN[0][1][1], same)
+    assert "[AVISO] A2: parecida com a1" in capsys.readouterr().out
+    assert list(run["files"]) == ["a1", "a2"]
+
+
+def test_plamens_second_shot_is_dropped_when_the_scroll_did_nothing():
+    steps = {st["id"]: st for _name, branch in q.PLAN for st in q.iter_steps(branch)}
+    assert steps["ecemar.plamens.2"].get("dup") == "drop"
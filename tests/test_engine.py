@@ -0,0 +1,127 @@
+import json
+
+import pytest
+
+import qlik_to_pdf as q
+
+
+class Emitter:
+    def __init__(self):
+        self.handlers = {}
+
+    def on(self, event, fn):
+        self.handlers.setdefault(event, []).append(fn)
+
+    def emit(self, event, arg):
+        for fn in self.handlers.get(event, []):
+            fn(arg)
+
+
+class FakeSocket(Emitter):
+    """
+    WebSocket do engine: send/reply disparam os mesmos eventos que o
+    Playwright (framesent/framereceived) com o payload em texto.
+    """
+
+    def send(self, *msgs):
+        self.emit("framesent", json.dumps(msgs[0] if len(msgs) == 1 else list(msgs)))
+
+    def reply(self, *msgs):
+        self.emit("framereceived", json.dumps(msgs[0] if len(msgs) == 1 else list(msgs)))
+
+
+class EnginePage(Emitter):
+    def wait_for_timeout(self, _ms):
+        pass
+
+    def open_socket(self):
+        ws = FakeSocket()
+        self.emit("websocket", ws)
+        return ws
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setattr(q, "_ENGINE", {})
+    monkeypatch.setattr(q, "ENGINE_STATS", {"requests": 0, "methods": {}, "waits": 0})
+    page = EnginePage()
+    q.track_engine(page)
+    return page
+
+
+def rpc(n, method="GetLayout"):
+    return {"jsonrpc": "2.0", "id": n, "method": method, "handle": 1, "params": []}
+
+
+def test_batched_frames_count_each_request_and_reply(engine):
+    ws = engine.open_socket()
+    ws.send(rpc(1), rpc(2, "GetHyperCubeData"), rpc(3))
+    assert sorted(q.engine_in_flight(engine)) == ["GetHyperCubeData", "GetLayout", "GetLayout"]
+
+    ws.reply({"id": 1, "result": {}}, {"id": 3, "result": {}})
+    assert q.engine_in_flight(engine) == ["GetHyperCubeData"]
+    assert q.ENGINE_STATS["requests"] == 3
+    assert q.ENGINE_STATS["methods"] == {"GetLayout": 2, "GetHyperCubeData": 1}
+
+
+def test_notifications_unknown_ids_and_garbage_change_nothing(engine):
+    ws = engine.open_socket()
+    ws.send(rpc(1))
+    ws.send({"jsonrpc": "2.0", "method": "OnConnected"})  # notificação do cliente, sem id
+    ws.reply({"jsonrpc": "2.0", "method": "OnConnected", "params": {}})
+    ws.reply({"jsonrpc": "2.0", "change": [1], "id": 1, "method": "OnChange"})
+    ws.reply({"id": 99, "result": {}})
+    ws.emit("framereceived", "não é json")
+    ws.emit("framereceived", b"\x00binario")
+    assert q.engine_in_flight(engine) == ["GetLayout"]
+
+
+def test_same_id_on_two_sockets_is_two_requests(engine):
+    one, two = engine.open_socket(), engine.open_socket()
+    one.send(rpc(1))
+    two.send(rpc(1))
+    one.reply({"id": 1, "result": {}})
+    assert q.engine_in_flight(engine) == ["GetLayout"]
+
+
+def test_socket_close_drops_only_its_requests(engine):
+    one, two = engine.open_socket(), engine.open_socket()
+    one.send(rpc(1), rpc(2))
+    two.send(rpc(1, "GetProperties"))
+    state = q._ENGINE[id(engine)]
+
+    one.emit("close", one)
+    assert q.engine_in_flight(engine) == ["GetProperties"]
+    assert state["idle_since"] is None
+    two.emit("close", two)
+    assert q.engine_in_flight(engine) == []
+    assert state["idle_since"] is not None
+
+
+def test_page_without_socket_is_no_signal(engine):
+    assert q.engine_in_flight(engine) is None
+    assert q.engine_in_flight(EnginePage()) is None
+
+
+def test_engine_idle_waits_for_replies_and_grace(engine, monkeypatch):
+    monkeypatch.setattr(q, "WAIT_ENGINE_GRACE_MS", 0)
+    ws = engine.open_socket()
+    ws.send(rpc(1))
+    assert q.run_ops(engine, q.engine_idle_ops(engine, 0)) is False
+
+    ws.reply({"id": 1, "result": {}})
+    assert q.run_ops(engine, q.engine_idle_ops(engine, 0)) is True
+
+
+def test_engine_idle_without_state_returns_false(engine, monkeypatch):
+    assert q.run_ops(engine, q.engine_idle_ops(EnginePage(), 1000)) is False
+
+    # página fecha no meio da espera: o estado some e a espera não quebra
+    monkeypatch.setattr(q, "WAIT_ENGINE_GRACE_MS", 10 ** 6)
+    engine.open_socket()
+    gen = q.engine_idle_ops(engine, 10 ** 6)
+    assert next(gen) == ("sleep", 25)
+    engine.emit("close", engine)
+    with pytest.raises(StopIteration) as stop:
+        gen.send(None)
+    assert stop.value.value is False
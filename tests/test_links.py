@@ -0,0 +1,157 @@
+import pytest
+
+import qlik_to_pdf as q
+from conftest import FakePage
+from qlik_to_pdf import shot, step
+
+HOME = "http://qlik/sense/app/x/sheet/home/state/analysis"
+
+
+def sheet_url(sheet):
+    return f"http://qlik/sense/app/x/sheet/{sheet}/state/analysis"
+
+
+class LinkPage(FakePage):
+    """
+    FakePage com o que o link direto confere: objetos no stage, barra de
+    seleções e, em `redirect`, URLs que caem em outra tela.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.url = HOME
+        self.selections = ""
+        self.objects = 3
+        self.redirect = {}
+        self.visited = []
+
+    def goto(self, url, **kwargs):
+        self.visited.append(url)
+        super().goto(self.redirect.get(url, url), **kwargs)
+
+    def evaluate(self, js, _arg=None):
+        assert js == q.SELECTIONS_JS
+        return self.selections
+
+    def locator(self, _selector):
+        page = self
+
+        class Count:
+            def count(self):
+                return page.objects
+
+        return Count()
+
+
+@pytest.fixture
+def links(workdir, fake_browser, monkeypatch):
+    """
+    Ações falsas: "menu" abre a sheet com o nome dado, "back" volta ao HOME.
+    Devolve (página, log das ações e capturas).
+    """
+    monkeypatch.setattr(q, "DEEP_LINKS", True)
+    monkeypatch.setattr(q, "LINK_STATS", {"goto": 0, "fallback": 0, "skipped_back": 0})
+    page = LinkPage()
+    log = []
+
+    def menu(page, name):
+        log.append(f"menu:{name}")
+        page.url = sheet_url(name)
+        return True
+
+    def back(page):
+        log.append("back")
+        page.url = HOME
+        return True
+
+    monkeypatch.setitem(q.PLAN_ACTIONS, "menu", menu)
+    monkeypatch.setitem(q.PLAN_ACTIONS, "back", back)
+    monkeypatch.setattr(q, "capture_shot", lambda _page, idx, label: log.append(f"shot:{label}") or (b"", b""))
+    monkeypatch.setattr(q, "register_shot", lambda page, st, run, png, data: run["status"].__setitem__(st["id"], "ok") or True)
+    return page, log
+
+
+def run_steps(page, steps):
+    run = q.new_run([("A", steps)])
+    q.run_ops(page, q.run_steps_ops(page, steps, run))
+    return run
+
+
+def test_shared_sheet_link_is_not_used(workdir):
+    q.SHEET_LINKS.update({
+        "t25.detalhar.1": {"url": sheet_url("det"), "sheet": "det", "selections": "Ano 2024"},
+        "t25.detalhar.2": {"url": sheet_url("det"), "sheet": "det", "selections": "Ano 2025"},
+        "afa": {"url": sheet_url("afa"), "sheet": "afa", "selections": ""},
+    })
+    assert q.sheet_link("t25.detalhar.1") is None
+    assert q.sheet_link("t25.detalhar.2") is None
+    assert q.sheet_link("afa")["sheet"] == "afa"
+    assert q.sheet_link("nunca.rodou") is None
+
+
+def test_click_records_the_link_and_next_run_opens_it_by_url(links):
+    page, log = links
+    steps = [step("afa", ("menu", "afa"), then=[shot("afa.shot", "AFA")])]
+    run_steps(page, steps)
+    assert log == ["menu:afa", "shot:AFA"]
+    assert q.SHEET_LINKS["afa"] == {"url": sheet_url("afa"), "sheet": "afa", "selections": ""}
+
+    log.clear()
+    page.url = HOME
+    run = run_steps(page, steps)
+    assert log == ["shot:AFA"]
+    assert page.visited == [sheet_url("afa")]
+    assert run["status"]["afa"] == "ok"
+    assert q.LINK_STATS["goto"] == 1
+
+
+@pytest.mark.parametrize("broken", ["other_sheet", "empty_stage", "selections"])
+def test_failed_link_check_falls_back_to_the_click(links, broken):
+    page, log = links
+    q.SHEET_LINKS["afa"] = {"url": sheet_url("afa"), "sheet": "afa", "selections": ""}
+    if broken == "other_sheet":
+        page.redirect[sheet_url("afa")] = sheet_url("login")
+    elif broken == "empty_stage":
+        page.objects = 0
+    else:
+        page.selections = "Ano 2024"
+
+    run = run_steps(page, [step("afa", ("menu", "afa"), then=[shot("afa.shot", "AFA")])])
+
+    # voltou para onde estava antes de clicar e o clique regravou o link
+    assert page.visited == [sheet_url("afa"), HOME]
+    assert log == ["menu:afa", "shot:AFA"]
+    assert run["status"]["afa"] == "ok"
+    assert q.LINK_STATS == {"goto": 0, "fallback": 1, "skipped_back": 0}
+    assert q.SHEET_LINKS["afa"]["selections"] == page.selections
+
+
+def test_pending_return_runs_before_the_next_shot(links):
+    page, log = links
+    run = run_steps(page, [
+        step("afa", ("menu", "afa"), then=[shot("afa.shot", "AFA")]),
+        step("afa.voltar", ("back",)),
+        shot("home.shot", "Home"),
+    ])
+    assert log == ["menu:afa", "shot:AFA", "back", "shot:Home"]
+    assert run["status"]["afa.voltar"] == "ok"
+    assert q.LINK_STATS["skipped_back"] == 0
+
+
+def test_pending_return_is_skipped_when_the_next_step_opens_by_link(links):
+    page, log = links
+    q.SHEET_LINKS["eear"] = {"url": sheet_url("eear"), "sheet": "eear", "selections": ""}
+    run_steps(page, [
+        step("afa", ("menu", "afa")),
+        step("afa.voltar", ("back",)),
+        step("eear", ("menu", "eear"), then=[shot("eear.shot", "EEAR")]),
+    ])
+    assert log == ["menu:afa", "shot:EEAR"]
+    assert q.LINK_STATS["skipped_back"] == 1
+
+
+def test_step_that_stays_on_the_sheet_records_no_link(links, monkeypatch):
+    page, _log = links
+    monkeypatch.setitem(q.PLAN_ACTIONS, "menu", lambda page, name: True)
+    run_steps(page, [step("filtro", ("menu", "filtro"))])
+    assert "filtro" not in q.SHEET_LINKS
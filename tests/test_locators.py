@@ -0,0 +1,91 @@
+import pytest
+
+import qlik_to_pdf as q
+
+
+class StubPage:
+    url = "http://qlik/sense/app/x/sheet/abc123/state/analysis"
+
+
+@pytest.fixture
+def locators(workdir, monkeypatch):
+    monkeypatch.setattr(q, "LOCATOR_STATS", {"hit": 0, "miss": 0})
+    return StubPage()
+
+
+def strategies(calls, works):
+    """
+    Cascata do helper "tab" em que só as tentativas de `works` acham o alvo.
+    """
+    def strategy(name):
+        def run(_page, nth):
+            calls.append((name, nth))
+            return (name, nth) in works
+        return run
+
+    return {name: strategy(name) for name in q.STRATEGY_ORDER["tab"]}
+
+
+def test_candidates_without_cache_follow_the_cascade_per_nth(locators):
+    key, candidates, first = q.locator_candidates(locators, "tab", "visão", nth_options=(0, 1))
+    assert key == "tab|abc123|visão"
+    assert first is None
+    order = q.STRATEGY_ORDER["tab"]
+    assert candidates == [(name, 0) for name in order] + [(name, 1) for name in order]
+
+
+def test_cached_strategy_is_tried_first_and_not_repeated(locators):
+    q.LOCATOR_CACHE["tab|abc123|visão"] = {"strategy": "js", "nth": 1}
+    _key, candidates, first = q.locator_candidates(locators, "tab", "visão", nth_options=(0, 1))
+    assert first == ("js", 1)
+    assert candidates[0] == ("js", 1)
+    assert candidates.count(("js", 1)) == 1
+    assert len(candidates) == 2 * len(q.STRATEGY_ORDER["tab"])
+
+
+def test_cache_hit_runs_a_single_strategy(locators):
+    q.LOCATOR_CACHE["tab|abc123|visão"] = {"strategy": "tab_button", "nth": 0}
+    calls = []
+    assert q.resolve_cached(locators, "tab", "visão", strategies(calls, {("tab_button", 0)}))
+    assert calls == [("tab_button", 0)]
+    assert q.LOCATOR_STATS == {"hit": 1, "miss": 0}
+
+
+def test_miss_records_the_strategy_that_worked(locators):
+    calls = []
+    assert q.resolve_cached(locators, "tab", "visão", strategies(calls, {("js", 1)}), nth_options=(0, 1))
+    assert calls[-1] == ("js", 1)
+    assert q.LOCATOR_CACHE["tab|abc123|visão"] == {"strategy": "js", "nth": 1}
+    assert q.LOCATOR_STATS == {"hit": 0, "miss": 1}
+
+    # o cache antigo deixou de valer: outra estratégia assume e é gravada
+    calls.clear()
+    assert q.resolve_cached(locators, "tab", "visão", strategies(calls, {("role", 0)}), nth_options=(0, 1))
+    assert calls[:2] == [("js", 1), ("index", 0)]
+    assert q.LOCATOR_CACHE["tab|abc123|visão"] == {"strategy": "role", "nth": 0}
+    assert q.LOCATOR_STATS == {"hit": 0, "miss": 2}
+
+
+def test_stale_entry_is_dropped_when_nothing_works(locators):
+    q.LOCATOR_CACHE["tab|abc123|visão"] = {"strategy": "js", "nth": 0}
+    calls = []
+    assert not q.resolve_cached(locators, "tab", "visão", strategies(calls, set()))
+    assert len(calls) == len(q.STRATEGY_ORDER["tab"])
+    assert "tab|abc123|visão" not in q.LOCATOR_CACHE
+    assert q.LOCATOR_STATS == {"hit": 0, "miss": 1}
+
+
+def test_unknown_cached_strategy_is_dropped(locators):
+    q.LOCATOR_CACHE["tab|abc123|visão"] = {"strategy": "xpath_antigo", "nth": 0}
+    _key, candidates, first = q.locator_candidates(locators, "tab", "visão")
+    assert first is None
+    assert candidates[0] == ("index", 0)
+    assert "tab|abc123|visão" not in q.LOCATOR_CACHE
+
+
+def test_cache_is_per_sheet(locators):
+    q.LOCATOR_CACHE["tab|abc123|visão"] = {"strategy": "js", "nth": 0}
+    other = StubPage()
+    other.url = "http://qlik/sense/app/x/sheet/outra/state/analysis"
+    _key, _candidates, first = q.locator_candidates(other, "tab", "visão")
+    assert first is None
@@ -0,0 +1,97 @@
+from types import SimpleNamespace
+
+import pytest
+
+import qlik_to_pdf as q
+
+APP = "https://egovens.fab.mil.br/sense/app/7a1c"
+
+# requisições que o painel precisa: nenhuma regra pode bloquear
+DASHBOARD = [
+    ("document", f"{APP}/sheet/home/state/analysis"),
+    ("xhr", "https://egovens.fab.mil.br/api/v1/apps/7a1c/data/metadata"),
+    ("xhr", "https://egovens.fab.mil.br/qrs/about?xrfkey=abc"),
+    ("fetch", "https://egovens.fab.mil.br/api/hub/v1/user/info"),
+    ("fetch", "https://egovens.fab.mil.br/api/v1/reload-tasks/usage"),
+    ("websocket", "wss://egovens.fab.mil.br/app/7a1c?reloadUri=x"),
+    ("script", "https://egovens.fab.mil.br/resources/assets/client/client.js?1700000000"),
+    ("script", "https://egovens.fab.mil.br/extensions/qlik-multi-kpi/qlik-multi-kpi.js"),
+    ("stylesheet", "https://egovens.fab.mil.br/resources/autogenerated/qlik-styles.css"),
+    ("font", "https://egovens.fab.mil.br/resources/fonts/QlikView-Sans.woff2"),
+    ("image", "https://egovens.fab.mil.br/content/Default/Click_Curso-AFA.png"),
+    ("image", "https://egovens.fab.mil.br/api/v1/apps/7a1c/thumbnail"),
+    ("other", "https://egovens.fab.mil.br/sense/app/7a1c/sheet/presentry/state/analysis"),
+    ("xhr", "https://egovens.fab.mil.br/api/v1/apps/7a1c/telemetry-dashboard"),
+    ("image", "https://egovens.fab.mil.br/content/Default/hotjar_doubleclick.png"),
+]
+
+
+@pytest.mark.parametrize("rtype, url", DASHBOARD)
+def test_no_rule_blocks_dashboard_requests(rtype, url):
+    assert q.network_action(rtype, url) != "block"
+
+
+@pytest.mark.parametrize("rtype, url, action", [
+    ("script", "https://www.googletagmanager.com/gtag/js?id=G-X", "block"),
+    ("xhr", "https://www.google-analytics.com/g/collect?v=2", "block"),
+    ("xhr", "https://o1.ingest.sentry.io/api/5/envelope/", "block"),
+    ("fetch", "https://egovens.fab.mil.br/api/telemetry/events", "block"),
+    ("xhr", "https://egovens.fab.mil.br/usagestats?x=1", "block"),
+    ("script", "https://js-agent.newrelic.com/nr-1234.min.js", "block"),
+    ("ping", "https://egovens.fab.mil.br/qualquer", "block"),
+    ("media", "https://egovens.fab.mil.br/content/Default/intro.mp4", "block"),
+    ("font", "https://egovens.fab.mil.br/resources/fonts/QlikView-Sans.woff2", "cache"),
+    ("script", "https://egovens.fab.mil.br/resources/assets/client/client.js", "cache"),
+    ("image", "https://egovens.fab.mil.br/content/Default/Click_Curso-AFA.png", "cache"),
+    ("image", "https://egovens.fab.mil.br/api/v1/apps/7a1c/thumbnail", None),
+    ("xhr", "https://egovens.fab.mil.br/api/v1/apps/7a1c/data/metadata", None),
+    ("document", f"{APP}/sheet/home/state/analysis", None),
+])
+def test_network_action(rtype, url, action):
+    assert q.network_action(rtype, url) == action
+
+
+class Request:
+    """
+    Request do Playwright: o filtro lê o tipo, a URL, o método e a página.
+    """
+    frame = SimpleNamespace(page=SimpleNamespace(url=f"{APP}/sheet/home/state/analysis"))
+
+    def __init__(self, resource_type, url, method="GET"):
+        self.resource_type = resource_type
+        self.url = url
+        self.method = method
+
+
+@pytest.fixture
+def net(monkeypatch):
+    monkeypatch.setattr(q, "_NET_CACHE", {})
+    monkeypatch.setattr(q, "_FROM_CACHE", set())
+    monkeypatch.setattr(q, "SHEET_STATS", {})
+    return Request
+
+
+def test_route_decision_blocks_and_counts_on_the_sheet(net):
+    assert q.route_decision(net("ping", "https://egovens.fab.mil.br/x")) == ("abort",)
+    assert q.route_decision(net("xhr", "https://egovens.fab.mil.br/api/v1/apps")) == ("continue",)
+    assert q.SHEET_STATS["home"]["blocked"] == 1
+
+
+def test_cached_resource_is_fetched_once_then_served_from_memory(net):
+    url = "https://egovens.fab.mil.br/resources/assets/client/client.js"
+    first = net("script", url)
+    assert q.route_decision(first) == ("fetch",)
+    q.cache_fetched(first, 200, {"content-type": "text/javascript"}, b"js")
+
+    again = net("script", url)
+    assert q.route_decision(again) == ("fulfill", 200, {"content-type": "text/javascript"}, b"js")
+    assert again in q._FROM_CACHE
+    assert q.SHEET_STATS["home"]["cached"] == 1
+    assert q.SHEET_STATS["home"]["cached_bytes"] == 2
+
+
+def test_only_ok_gets_are_cached(net):
+    url = "https://egovens.fab.mil.br/resources/fonts/QlikView-Sans.woff2"
+    q.cache_fetched(net("font", url), 304, {}, b"")
+    assert q.route_decision(net("font", url)) == ("fetch",)
+    assert q.route_decision(net("font", url, method="POST")) == ("continue",)
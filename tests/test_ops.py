@@ -0,0 +1,159 @@
+import asyncio
+
+import pytest
+
+import qlik_async as qa
+import qlik_to_pdf as q
+from conftest import label_color, png_bytes
+from qlik_to_pdf import shot, step
+
+PLAN = [
+    ("A", [step("a", ("menu", "falha"), ("menu", "A"), then=[shot("a1", "A1"), shot("a2", "A2")])]),
+    ("B", [step("b", ("menu", "sumiu"), warn="B não abriu", then=[shot("b1", "B1")])]),
+    ("C", [shot("c1", "C1"), shot("c2", "C2")]),
+]
+
+
+class OpsPage:
+    """
+    Página falsa só com o que os geradores *_ops pedem direto à página;
+    evaluate responde "pronto" e as esperas não esperam.
+    """
+
+    def __init__(self, alive_shots=None):
+        self.url = "http://qlik/sense/app/x/sheet/home/state/analysis"
+        self.alive_shots = alive_shots
+        self.sleeps = 0
+
+    def on(self, _event, _fn):
+        pass
+
+    def goto(self, url, **_kwargs):
+        self.url = url
+
+
+class AsyncOpsPage(OpsPage):
+    async def goto(self, url, **kwargs):
+        super().goto(url, **kwargs)
+
+
+def fake_helpers(page, log):
+    """
+    Ações, captura e espera falsas comuns aos dois drivers: "falha" levanta,
+    "sumiu" não acha nada, a captura cai depois de page.alive_shots.
+    """
+    def action(name):
+        if name == "falha":
+            raise RuntimeError("clique interceptado")
+        log.append(f"menu:{name}")
+        return name != "sumiu"
+
+    def capture(idx, label):
+        if page.alive_shots is not None and len([x for x in log if x.startswith("shot:")]) >= page.alive_shots:
+            raise RuntimeError("Target page, context or browser has been closed")
+        log.append(f"shot:{label}")
+        data = png_bytes(label_color(label))
+        return data, data
+
+    return action, capture
+
+
+def run_sync(monkeypatch, page, log):
+    action, capture = fake_helpers(page, log)
+    monkeypatch.setitem(q.PLAN_ACTIONS, "menu", lambda _page, name: action(name))
+    monkeypatch.setattr(q, "open_start_page", lambda _page: log.append("start"))
+    monkeypatch.setattr(q, "wait_qlik", lambda _page, extra_ms=0: log.append(f"wait:{extra_ms}"))
+    monkeypatch.setattr(q, "capture_shot", lambda _page, idx, label: capture(idx, label))
+    run = q.new_run(PLAN)
+    q.run_ops(page, q.run_branches_ops(page, PLAN, run))
+    return run
+
+
+def run_async(monkeypatch, page, log):
+    action, capture = fake_helpers(page, log)
+
+    async def menu(_page, name):
+        await asyncio.sleep(0)
+        return action(name)
+
+    async def start(_page):
+        log.append("start")
+
+    async def wait(_page, extra_ms=0):
+        log.append(f"wait:{extra_ms}")
+
+    async def capture_shot(_page, idx, label):
+        await asyncio.sleep(0)
+        return capture(idx, label)
+
+    monkeypatch.setitem(qa.PLAN_ACTIONS, "menu", menu)
+    monkeypatch.setattr(qa, "open_start_page", start)
+    monkeypatch.setattr(qa, "wait_qlik", wait)
+    monkeypatch.setattr(qa, "capture_shot", capture_shot)
+    run = q.new_run(PLAN)
+    asyncio.run(qa.run_ops(page, q.run_branches_ops(page, PLAN, run)))
+    return run
+
+
+@pytest.mark.parametrize("alive_shots", [None, 1])
+def test_both_drivers_run_the_same_plan(workdir, monkeypatch, alive_shots):
+    sync_log, async_log = [], []
+    sync_run = run_sync(monkeypatch, OpsPage(alive_shots), sync_log)
+    async_run = run_async(monkeypatch, AsyncOpsPage(alive_shots), async_log)
+
+    assert async_log == sync_log
+    for key in ("status", "interrupted", "keys"):
+        assert async_run[key] == sync_run[key]
+
+    if alive_shots is None:
+        # a 1ª alternativa levantou e a 2ª valeu; B falhou e C recomeçou da página inicial
+        assert sync_run["status"] == {"a": "ok", "a1": "ok", "a2": "ok", "b": "fail", "c1": "ok", "c2": "ok"}
+        assert sync_log.count("start") == 1
+        # espera do início (o 1º ramo não é o HOME) e a do recomeço do C
+        assert sync_log.count("wait:9000") == 2
+        assert [x for x in sync_log if x.startswith("shot:")] == ["shot:A1", "shot:A2", "shot:C1", "shot:C2"]
+    else:
+        # a captura caiu no meio de A: o ramo é interrompido e os seguintes ainda tentam
+        assert sync_run["interrupted"] == ["A", "C"]
+        assert "a2" not in sync_run["status"]
+
+
+class WaitPage(OpsPage):
+    """
+    Página cujo sleep cai (navegador fechando no meio da espera do engine).
+    """
+
+    def wait_for_timeout(self, _ms):
+        self.sleeps += 1
+        raise RuntimeError("Target page, context or browser has been closed")
+
+    def evaluate(self, _js, _arg=None):
+        return {"ready": True}
+
+
+class AsyncWaitPage(WaitPage):
+    async def wait_for_timeout(self, ms):
+        return super().wait_for_timeout(ms)
+
+    async def evaluate(self, js, arg=None):
+        return super().evaluate(js, arg)
+
+
+@pytest.mark.parametrize("page_cls", [WaitPage, AsyncWaitPage])
+def test_engine_wait_failure_falls_back_to_dom_check(workdir, monkeypatch, page_cls):
+    page = page_cls()
+    monkeypatch.setitem(q._ENGINE, id(page), {"pending": {(1, 1): "GetLayout"}, "idle_since": None, "sockets": 1})
+    monkeypatch.setattr(q, "WAIT_LOG", [])
+    gen = q.wait_qlik_ops(page, 3000)
+    if page_cls is WaitPage:
+        q.run_ops(page, gen)
+    else:
+        asyncio.run(qa.run_ops(page, gen))
+
+    assert page.sleeps == 1
+    assert q.WAIT_LOG[-1][2] is True
+
+
+def test_bg_image_tokens_use_the_file_name():
+    tokens = q.bg_image_tokens("/content/Default/Click_Curso-AFA.png")
+    assert {"click_curso-afa.png", "click_curso-afa", "click", "curso", "afa"} <= set(tokens)
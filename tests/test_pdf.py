@@ -0,0 +1,174 @@
+import io
+import os
+import random
+import re
+import struct
+import zlib
+
+import pytest
+from PIL import Image
+
+import qlik_to_pdf as q
+from conftest import label_color, png_bytes
+
+
+def decode_image(src, page_id):
+    """
+    Imagem da página do PDF de volta em RGB. O stream Flate é o IDAT do PNG
+    (preditores PNG), então basta remontar o PNG em volta dele.
+    """
+    img_id = int(re.search(rb"/Im0 (\d+) 0 R", src.obj(page_id)[0]).group(1))
+    head, stream = src.obj(img_id)
+    if b"/DCTDecode" in head:
+        return Image.open(io.BytesIO(stream)).convert("RGB")
+    width, height, bits = (
+        int(re.search(rb"/%s (\d+)" % key, head).group(1)) for key in (b"Width", b"Height", b"BitsPerComponent")
+    )
+    indexed = re.search(rb"/Indexed /DeviceRGB \d+ <([0-9a-f]*)>", head)
+    chunks = [(b"IHDR", struct.pack(">IIBBBBB", width, height, bits, 3 if indexed else 2, 0, 0, 0))]
+    if indexed:
+        chunks.append((b"PLTE", bytes.fromhex(indexed.group(1).decode())))
+    chunks += [(b"IDAT", stream), (b"IEND", b"")]
+    png = b"\x89PNG\r\n\x1a\n" + b"".join(
+        struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body))
+        for kind, body in chunks
+    )
+    return Image.open(io.BytesIO(png)).convert("RGB")
+
+
+def noise_png(seed: int, size=(96, 54)) -> bytes:
+    rnd = random.Random(seed)
+    im = Image.frombytes("RGB", size, bytes(rnd.randrange(256) for _ in range(size[0] * size[1] * 3)))
+    buf = io.BytesIO()
+    im.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def stripes_png(colors, size=(90, 40)) -> bytes:
+    im = Image.new("RGB", size)
+    for x in range(size[0]):
+        for y in range(size[1]):
+            im.putpixel((x, y), colors[x * len(colors) // size[0]])
+    buf = io.BytesIO()
+    im.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def write_pdf(path, shots, workers=1):
+    writer = q.PdfStreamWriter(str(path), expected_pages=len(shots), workers=workers)
+    for data in shots:
+        writer.add_page(data)
+    return writer, writer.close()
+
+
+@pytest.fixture
+def pdf_config(workdir, monkeypatch):
+    monkeypatch.setattr(q, "PAGE_CACHE", False)
+    monkeypatch.setattr(q, "PDF_MAX_MB", 0)
+    monkeypatch.setattr(q, "PDF_ENCODER", "flate")
+    return workdir
+
+
+@pytest.mark.parametrize("data", [
+    stripes_png([(255, 255, 255), (0, 92, 169), (230, 57, 70), (30, 30, 30)]),
+    noise_png(1),
+], ids=["paleta", "rgb"])
+def test_flate_pages_round_trip_without_loss(pdf_config, data):
+    out = pdf_config / "flate.pdf"
+    writer, pages = write_pdf(out, [data])
+
+    assert pages == 1
+    assert not os.path.exists(str(out) + ".part")
+    assert [name for name, *_rest in writer.report] == ["flate"]
+    src = q.PdfPageSource(str(out))
+    original = Image.open(io.BytesIO(data)).convert("RGB")
+    assert decode_image(src, src.page_ids[0]).tobytes() == original.tobytes()
+
+
+def test_few_colors_become_an_exact_palette():
+    rgb = Image.open(io.BytesIO(stripes_png([(255, 255, 255), (0, 92, 169)]))).convert("RGB")
+    _name, _data, _filter, colorspace, _parms, bits = q.encode_page(rgb, "flate")
+    assert colorspace.startswith(b"[/Indexed")
+    assert bits <= 8
+
+
+def test_auto_keeps_the_smaller_encoding():
+    for data in (noise_png(2), png_bytes((10, 20, 30))):
+        rgb = Image.open(io.BytesIO(data)).convert("RGB")
+        sizes = {"flate": len(q.encode_flate(rgb)[0]), "jpeg": len(q.encode_jpeg(rgb, 85)[0])}
+        name, encoded, *_rest = q.encode_page(rgb, "auto", jpeg_quality=85)
+        assert name == min(sizes, key=sizes.get)
+        assert len(encoded) == min(sizes.values())
+
+
+def test_page_budget_degrades_until_the_page_fits():
+    rgb = Image.open(io.BytesIO(noise_png(3))).convert("RGB")
+    budget = len(q.encode_jpeg(rgb, 45)[0])
+    name, data, filter_name, *_rest = q.encode_page(rgb, "flate", max_bytes=budget)
+    assert name in ("palette",) + tuple(f"jpeg{n}" for n in q.JPEG_FALLBACK_QUALITIES)
+    assert len(data) <= budget
+    # sem orçamento que caiba, fica com o menor de todos
+    name, data, *_rest = q.encode_page(rgb, "flate", max_bytes=1)
+    assert name == "jpeg30" or len(data) <= len(q.encode_jpeg(rgb, 30)[0])
+
+
+def test_pool_writes_pages_in_the_order_they_were_added(pdf_config):
+    labels = [f"P{n}" for n in range(6)]
+    out = pdf_config / "pool.pdf"
+    _writer, pages = write_pdf(out, [png_bytes(label_color(label)) for label in labels], workers=2)
+
+    assert pages == len(labels)
+    src = q.PdfPageSource(str(out))
+    colors = [decode_image(src, page_id).getpixel((0, 0)) for page_id in src.page_ids]
+    assert colors == [label_color(label) for label in labels]
+
+
+def test_writer_without_pages_leaves_no_file(pdf_config):
+    out = pdf_config / "vazio.pdf"
+    _writer, pages = write_pdf(out, [])
+    assert pages == 0
+    assert not os.path.exists(out)
+    assert not os.path.exists(str(out) + ".part")
+
+
+@pytest.fixture
+def page_cache(pdf_config, monkeypatch):
+    monkeypatch.setattr(q, "PAGE_CACHE", True)
+    monkeypatch.setattr(q, "PAGE_CACHE_MB", 300)
+    monkeypatch.setattr(q, "PAGE_CACHE_STATS", {"hit": 0, "miss": 0, "evicted": 0})
+    return pdf_config
+
+
+def test_page_cache_copies_pages_encoded_by_a_previous_run(page_cache):
+    shots = [png_bytes(label_color("A")), noise_png(4)]
+    first, _pages = write_pdf(page_cache / "um.pdf", shots)
+    q.save_page_cache()
+    q.PAGE_CACHE_INDEX.clear()
+
+    q.load_page_cache()
+    second, _pages = write_pdf(page_cache / "dois.pdf", shots)
+
+    assert q.PAGE_CACHE_STATS == {"hit": 2, "miss": 2, "evicted": 0}
+    assert [cached for *_rest, cached in second.report] == [True, True]
+    one, two = q.PdfPageSource(str(page_cache / "um.pdf")), q.PdfPageSource(str(page_cache / "dois.pdf"))
+    for a, b in zip(one.page_ids, two.page_ids):
+        assert decode_image(one, a).tobytes() == decode_image(two, b).tobytes()
+    # o cache fica no disco local da sessão, não no TMP_DIR da rede
+    assert os.listdir(q.page_cache_dir())
+    assert not os.path.exists(os.path.join(q.TMP_DIR, q.PAGE_CACHE_DIR))
+
+
+def test_save_page_cache_keeps_what_other_processes_wrote(page_cache):
+    write_pdf(page_cache / "um.pdf", [png_bytes(label_color("A"))])
+    mine = dict(q.PAGE_CACHE_INDEX)
+    q.save_page_cache()
+
+    # outro processo (job do lote, shard) grava a sua página depois do nosso load
+    q.PAGE_CACHE_INDEX.clear()
+    write_pdf(page_cache / "outro.pdf", [png_bytes(label_color("B"))])
+    q.save_page_cache()
+    q.PAGE_CACHE_INDEX.clear()
+    q.PAGE_CACHE_INDEX.update(mine)
+
+    q.save_page_cache()
+    assert len(q._read_page_cache_index()) == 2
@@ -0,0 +1,109 @@
+import pytest
+
+import qlik_to_pdf as q
+
+
+def card(h, text, foot="", button=None):
+    return {"h": h, "text": text, "foot": foot, "button": button}
+
+
+def btn(h, name="", style="", bg="", in_stage=True):
+    return {"h": h, "name": name, "style": style, "bg": bg, "inStage": in_stage}
+
+
+def tab(h, text, title="", aria=""):
+    return {"h": h, "text": text, "title": title, "aria": aria}
+
+
+# índice montado à mão no formato do STAGE_INDEX_JS (textos já normalizados)
+INDEX = {
+    "cards": [
+        card(0, "academia da forca aerea afa", foot="cursos da afa"),
+        card(1, "cursos da eear", foot="", button=btn(10)),
+        card(2, "cursos da afa resumo", foot=""),
+        card(3, "safari de dados", foot="safari"),
+        card(4, "plamens exterior", foot="plamens exterior"),
+    ],
+    "buttons": [
+        btn(20, name="afa"),
+        btn(21, name="voltar", in_stage=False),
+        btn(22, style="background-image: url(/content/Default/Click_Curso-AFA.png)",
+            bg="url(/content/default/click_curso-afa.png)"),
+        btn(23, style="background-image: url(/content/Default/Click_Curso-AFA.png)",
+            bg="url(/content/default/click_curso-afa.png)", in_stage=False),
+        btn(24, bg="url(/content/default/click%20curso%20eear.png) url(/content/default/click curso eear.png)"),
+    ],
+    "tabs": [
+        tab(30, "visao geral"),
+        tab(31, "visao geral"),
+        tab(32, "", aria="cursos"),
+        tab(33, "cursos por om", title="cursos por om"),
+    ],
+}
+
+
+def hs(items):
+    return [item["h"] for item in items]
+
+
+@pytest.mark.parametrize("text, whole_word, expected", [
+    ("AFA", True, [0, 2]),        # footnote primeiro, depois o texto do card
+    ("afa", False, [0, 3, 2]),    # sem palavra inteira o footnote "safari" também casa
+    ("Cursos da", False, [0, 1, 2]),
+    ("PLAMENS Exterior", False, [4]),
+    ("Ação", False, []),
+    ("", False, []),
+])
+def test_match_cards(text, whole_word, expected):
+    assert hs(q.match_cards(INDEX["cards"], text, whole_word)) == expected
+
+
+def test_footnote_match_wins_over_card_text():
+    cards = [card(0, "cursos da afa"), card(1, "outro", foot="cursos da afa")]
+    assert hs(q.match_cards(cards, "cursos da afa", False)) == [1, 0]
+
+
+@pytest.mark.parametrize("name, whole_word, expected", [
+    ("AFA", True, [[20], [0, 2]]),
+    ("Cursos da EEAR", False, [[], [10]]),  # card com botão: clica o botão
+    ("Voltar", False, [[21], []]),
+])
+def test_menu_picks(name, whole_word, expected):
+    assert [hs(items) for items in q.menu_picks(INDEX, name, whole_word)] == expected
+
+
+@pytest.mark.parametrize("labels, expected", [
+    (["Visão geral"], [[30, 31], [30, 31]]),
+    (["Cursos"], [[32], [32, 33]]),               # aria-label exato antes do "contém"
+    (["Cursos por OM", "Cursos"], [[33], [32], [32, 33]]),
+    (["Inexistente"], [[], []]),
+])
+def test_tab_picks(labels, expected):
+    assert [hs(items) for items in q.tab_picks(INDEX, labels)] == expected
+
+
+def test_bg_picks_prefer_the_stage_and_fall_back_to_tokens():
+    raw = "/content/Default/Click_Curso-AFA.png"
+    picks = q.bg_picks(INDEX, raw, q.bg_image_tokens(raw))
+    # os pedaços soltos ("click", "curso") também casam o 24, mas depois
+    assert [hs(items) for items in picks] == [[22], [22, 23], [22, 23, 24]]
+
+    raw = "/content/Default/Click curso EEAR.png"
+    picks = q.bg_picks(INDEX, raw, q.bg_image_tokens(raw))
+    assert [hs(items) for items in picks] == [[], [], [24, 22, 23]]
+
+
+@pytest.mark.parametrize("nth, expected", [(0, 30), (1, 31), (2, None)])
+def test_click_picks_takes_the_nth_of_the_first_list_that_has_it(monkeypatch, nth, expected):
+    clicked = []
+    monkeypatch.setattr(q, "click_indexed", lambda _page, item: clicked.append(item["h"]) or True)
+    assert q._click_picks(None, q.tab_picks(INDEX, ["Visão geral"]), nth) is (expected is not None)
+    assert clicked == ([expected] if expected is not None else [])
+
+
+def test_click_picks_skips_lists_too_short_for_nth(monkeypatch):
+    clicked = []
+    monkeypatch.setattr(q, "click_indexed", lambda _page, item: clicked.append(item["h"]) or True)
+    # nth=1: a lista exata de "Cursos" só tem uma aba, vale a do "contém"
+    assert q._click_picks(None, q.tab_picks(INDEX, ["Cursos"]), 1)
+    assert clicked == [33]
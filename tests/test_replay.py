@@ -0,0 +1,152 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import qlik_to_pdf as q
+
+
+class RecordedSocket:
+    """
+    WebSocket gravado pelo record_socket: dispara framesent/framereceived.
+    """
+    url = "wss://qlik/app/x"
+
+    def __init__(self):
+        self.handlers = {}
+
+    def on(self, event, fn):
+        self.handlers.setdefault(event, []).append(fn)
+
+    def frame(self, event, *msgs):
+        payload = json.dumps(msgs[0] if len(msgs) == 1 else list(msgs))
+        for fn in self.handlers.get(event, []):
+            fn(payload)
+
+
+def rpc(n, method="GetLayout", handle=1, params=None):
+    return {"jsonrpc": "2.0", "id": n, "method": method, "handle": handle, "params": params or []}
+
+
+@pytest.fixture
+def replay(tmp_path, monkeypatch):
+    monkeypatch.setattr(q, "RECORD_DIR", str(tmp_path / "rec"))
+    monkeypatch.setattr(q, "REPLAY_DIR", str(tmp_path / "rec"))
+    monkeypatch.setattr(q, "REPLAY_SPEED", 1.0)
+    monkeypatch.setattr(q, "REPLAY_LATENCY_MS", 0)
+    monkeypatch.setattr(q, "_RECORD_SOCKETS", [])
+    monkeypatch.setattr(q, "_REPLAY", {"http": {}, "engine": {}, "hello": [], "served": {}})
+    monkeypatch.setattr(q, "REPLAY_STATS", {"http": 0, "http_missing": 0, "rpc": 0, "rpc_missing": 0})
+    monkeypatch.setattr(q, "QLIK_URL", "http://qlik/sense/app/x")
+    (tmp_path / "rec").mkdir()
+    return tmp_path / "rec"
+
+
+def record_session():
+    """
+    Sessão pequena: notificação de abertura, o mesmo GetLayout duas vezes
+    (respostas diferentes), um lote com dois pedidos e uma notificação
+    depois de uma resposta.
+    """
+    ws = RecordedSocket()
+    q.record_socket(ws)
+    ws.frame("framereceived", {"jsonrpc": "2.0", "method": "OnConnected", "params": {"qSessionState": "SESSION_CREATED"}})
+    ws.frame("framesent", rpc(1))
+    ws.frame("framereceived", {"jsonrpc": "2.0", "id": 1, "result": {"qLayout": "v1"}})
+    ws.frame("framereceived", {"jsonrpc": "2.0", "change": [1]})
+    ws.frame("framesent", rpc(2))
+    ws.frame("framereceived", {"jsonrpc": "2.0", "id": 2, "result": {"qLayout": "v2"}})
+    ws.frame("framesent", rpc(3, "GetHyperCubeData", 5, [{"qTop": 0}]), rpc(4, "GetProperties", 5))
+    ws.frame("framereceived", {"jsonrpc": "2.0", "id": 4, "result": {"qProp": "p"}}, {"jsonrpc": "2.0", "id": 3, "result": {"qData": "d"}})
+    q.save_recording()
+
+
+def replies(msg):
+    return [json.loads(payload) for payload, _delay in q.replay_rpc(msg)]
+
+
+def test_recorded_frames_replay_with_the_page_ids(replay):
+    record_session()
+    assert q.load_replay() == "http://qlik/sense/app/x"
+    assert q._REPLAY["hello"] == [{"jsonrpc": "2.0", "method": "OnConnected", "params": {"qSessionState": "SESSION_CREATED"}}]
+
+    # a página nova numera diferente: a resposta volta com o id do pedido dela
+    first = replies(rpc(101))
+    assert first == [
+        {"jsonrpc": "2.0", "id": 101, "result": {"qLayout": "v1"}},
+        {"jsonrpc": "2.0", "change": [1]},
+    ]
+    assert replies(rpc(102)) == [{"jsonrpc": "2.0", "id": 102, "result": {"qLayout": "v2"}}]
+    # gravação esgotada: repete a última
+    assert replies(rpc(103)) == [{"jsonrpc": "2.0", "id": 103, "result": {"qLayout": "v2"}}]
+
+    # lote respondido fora de ordem: cada pedido acha a sua resposta pelo conteúdo
+    assert replies(rpc(7, "GetProperties", 5)) == [{"jsonrpc": "2.0", "id": 7, "result": {"qProp": "p"}}]
+    assert replies(rpc(8, "GetHyperCubeData", 5, [{"qTop": 0}]))[0]["result"] == {"qData": "d"}
+    assert q.REPLAY_STATS["rpc"] == 5
+
+
+def test_unrecorded_request_gets_a_json_rpc_error(replay):
+    record_session()
+    q.load_replay()
+    (reply,) = replies(rpc(9, "GetHyperCubeData", 5, [{"qTop": 100}]))
+    assert reply["id"] == 9
+    assert reply["error"]["code"] == -32601
+    assert q.REPLAY_STATS["rpc_missing"] == 1
+
+
+def har_entry(status, text):
+    return {
+        "time": 40,
+        "request": {"method": "GET", "url": "http://qlik/api/about"},
+        "response": {
+            "status": status,
+            "headers": [{"name": "Content-Length", "value": "1"}, {"name": "X-A", "value": "b"}],
+            "content": {"text": text},
+        },
+    }
+
+
+def test_http_entries_replay_in_order(replay):
+    har = {"log": {"entries": [har_entry(200, "um"), har_entry(200, "dois"), har_entry(0, "abortada")]}}
+    (replay / "session_1.har").write_text(json.dumps(har), encoding="utf-8")
+    q.load_replay()
+
+    request = SimpleNamespace(method="GET", url="http://qlik/api/about")
+    assert q.replay_http(request) == (200, {"X-A": "b"}, b"um", 40)
+    assert q.replay_http(request) == (200, {"X-A": "b"}, b"dois", 40)
+    assert q.replay_http(request)[2] == b"dois"
+    assert q.replay_http(SimpleNamespace(method="GET", url="http://qlik/outra")) is None
+    assert q.REPLAY_STATS == {"http": 3, "http_missing": 1, "rpc": 0, "rpc_missing": 0}
+
+
+class RouteSocket:
+    """
+    WebSocketRoute do Playwright no replay: a página manda por on_message
+    e recebe o que o engine simulado faz send.
+    """
+
+    def __init__(self):
+        self.sent = []
+        self.handler = None
+
+    def on_message(self, fn):
+        self.handler = fn
+
+    def send(self, payload):
+        self.sent.append(json.loads(payload))
+
+
+def test_simulated_socket_answers_and_keeps_the_engine_count(replay, monkeypatch):
+    record_session()
+    q.load_replay()
+    monkeypatch.setattr(q, "_ENGINE", {})
+    page = SimpleNamespace(on=lambda *_a: None, wait_for_timeout=lambda _ms: None)
+    q.track_engine(page)
+    ws = RouteSocket()
+    q._replay_socket(page, ws)
+
+    assert ws.sent[0]["method"] == "OnConnected"
+    ws.handler(json.dumps([rpc(50), rpc(51, "GetProperties", 5)]))
+    assert [m.get("id") for m in ws.sent[1:]] == [50, None, 51]
+    assert q.engine_in_flight(page) == []
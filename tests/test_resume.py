@@ -0,0 +1,114 @@
+import os
+
+import pytest
+
+import qlik_to_pdf as q
+from conftest import FakePage
+from qlik_to_pdf import shot
+
+ROUTE = [
+    ("A", [shot("a1", "A1"), shot("a2", "A2")]),
+    ("B", [shot("b1", "B1")]),
+]
+
+
+def run_main(monkeypatch, *args):
+    monkeypatch.setitem(q.ROUTES, "teste", ROUTE)
+    q.main(["--route", "teste", *args])
+
+
+def test_crash_mid_run_leaves_state_incomplete(workdir, fake_browser, monkeypatch):
+    fake_browser["page"] = page = FakePage()
+    fake_browser["die_after"] = 1
+    run_main(monkeypatch)
+
+    manifest = q.load_plan_manifest()
+    assert manifest["complete"] is False
+    assert manifest["shots"]["a1"]["status"] == "ok"
+    assert manifest["shots"]["a2"]["status"] == "missing"
+    assert manifest["shots"]["b1"]["status"] == "missing"
+    assert not page.alive
+
+
+def test_resume_after_crash_captures_only_the_missing_pages(workdir, fake_browser, monkeypatch, capsys):
+    fake_browser["page"] = FakePage()
+    fake_browser["die_after"] = 1
+    run_main(monkeypatch)
+    out_pdf = q.load_plan_manifest()["pdf"]
+
+    fake_browser["page"] = FakePage()
+    fake_browser["die_after"] = None
+    fake_browser["shots"].clear()
+    run_main(monkeypatch, "--resume")
+
+    assert "nada a retomar" not in capsys.readouterr().out
+    assert fake_browser["shots"] == ["A2", "B1"]
+    manifest = q.load_plan_manifest()
+    assert manifest["complete"] is True
+    assert manifest["pdf"] == out_pdf
+    assert all(s["status"] == "ok" for s in manifest["shots"].values())
+    assert len(q.PdfPageSource(out_pdf).page_ids) == 3
+
+
+def test_browser_dead_from_the_start_is_resumable(workdir, fake_browser, monkeypatch, capsys):
+    fake_browser["page"] = FakePage(alive=False)
+    run_main(monkeypatch)
+    assert q.load_plan_manifest()["complete"] is False
+
+    fake_browser["page"] = FakePage()
+    run_main(monkeypatch, "--resume")
+    assert "Retomando" in capsys.readouterr().out
+    assert fake_browser["shots"] == ["A1", "A2", "B1"]
+    assert q.load_plan_manifest()["complete"] is True
+
+
+def test_missing_shot_without_crash_is_not_complete(workdir, fake_browser, monkeypatch):
+    # passo que não achou o alvo: a captura filha fica faltando
+    route = [("A", [q.step("a", ("menu", "A"), then=[shot("a1", "A1")]), shot("a2", "A2")])]
+    monkeypatch.setitem(q.PLAN_ACTIONS, "menu", lambda page, name: False)
+    monkeypatch.setitem(q.ROUTES, "teste", route)
+    fake_browser["page"] = FakePage()
+    q.main(["--route", "teste"])
+
+    manifest = q.load_plan_manifest()
+    assert manifest["shots"]["a1"]["status"] == "missing"
+    assert manifest["complete"] is False
+
+
+def test_resume_builds_the_pdf_when_only_the_pdf_was_lost(workdir, fake_browser, monkeypatch, capsys):
+    def broken_close(self):
+        raise OSError("disco cheio")
+
+    with monkeypatch.context() as m:
+        m.setattr(q.PdfStreamWriter, "close", broken_close)
+        fake_browser["page"] = FakePage()
+        with pytest.raises(OSError):
+            run_main(monkeypatch)
+    manifest = q.load_plan_manifest()
+    out_pdf = manifest["pdf"]
+    assert manifest["complete"] is False
+    assert all(s["status"] == "ok" for s in manifest["shots"].values())
+    assert not os.path.exists(out_pdf)
+
+    fake_browser["page"] = FakePage()
+    fake_browser["shots"].clear()
+    run_main(monkeypatch, "--resume")
+
+    assert "Nada a recapturar" not in capsys.readouterr().out
+    assert fake_browser["shots"] == []
+    assert q.load_plan_manifest()["complete"] is True
+    assert len(q.PdfPageSource(out_pdf).page_ids) == 3
+
+
+def test_new_run_is_incomplete_before_the_first_checkpoint(workdir, fake_browser, monkeypatch):
+    fake_browser["page"] = FakePage()
+    run_main(monkeypatch)
+    assert q.load_plan_manifest()["complete"] is True
+
+    def crash(_p):
+        assert q.load_plan_manifest()["complete"] is False
+        raise RuntimeError("Chrome não abriu")
+
+    monkeypatch.setattr(q, "open_capture_context", crash)
+    run_main(monkeypatch)
+    assert q.load_plan_manifest()["complete"] is False
@@ -0,0 +1,110 @@
+import json
+import os
+import re
+
+import pytest
+
+import qlik_to_pdf as q
+from conftest import FakePage
+from qlik_to_pdf import shot
+
+ROUTE = [
+    ("A", [shot("a1", "A1"), shot("a2", "A2")]),
+    ("B", [shot("b1", "B1")]),
+    ("C", [shot("c1", "C1")]),
+]
+
+
+def page_images(pdf):
+    """
+    Stream da imagem de cada página, na ordem do PDF.
+    """
+    src = q.PdfPageSource(pdf)
+    images = []
+    for page_id in src.page_ids:
+        img_id = int(re.search(rb"/Im0 (\d+) 0 R", src.obj(page_id)[0]).group(1))
+        images.append(src.obj(img_id)[1])
+    return images
+
+
+def test_shards_cover_every_branch_once_in_route_order():
+    plan = q.PLAN
+    for count in (1, 2, 3, 5):
+        parts = [q.shard_branches(plan, i, count) for i in range(1, count + 1)]
+        names = [name for part in parts for name, _steps in part]
+        assert sorted(names) == sorted(name for name, _steps in plan)
+        for part in parts:
+            order = [name for name, _steps in part]
+            assert order == [name for name, _steps in plan if name in order]
+        assert parts == [q.shard_branches(plan, i, count) for i in range(1, count + 1)]
+
+
+def test_shards_balance_shot_counts():
+    sizes = [len(q.plan_shots(q.shard_branches(q.PLAN, i, 3))) for i in (1, 2, 3)]
+    biggest = max(sum(1 for st in q.iter_steps(steps) if "shot" in st) for _name, steps in q.PLAN)
+    assert max(sizes) - min(sizes) <= biggest
+
+
+@pytest.mark.parametrize("argv", [
+    ["--shard", "4/3"],
+    ["--shard", "0/3"],
+    ["--shard", "dois"],
+    ["--only", "XYZ"],
+    ["--only", ","],
+])
+def test_bad_only_or_shard_is_a_usage_error(argv, capsys):
+    with pytest.raises(SystemExit) as exc:
+        q.parse_args(argv)
+    assert exc.value.code == 2
+    assert "error:" in capsys.readouterr().err
+
+
+def test_only_is_case_insensitive_and_keeps_route_order():
+    plan = q.select_branches(q.PLAN, ["ecemar", " afa "])
+    assert [name for name, _steps in plan] == ["AFA", "ECEMAR"]
+
+
+def run_shard(workdir, monkeypatch, index, count):
+    monkeypatch.setitem(q.ROUTES, "teste", ROUTE)
+    out = str(workdir / "pdfs" / f"s{index}.pdf")
+    q.main(["--route", "teste", "--shard", f"{index}/{count}", "--out", out,
+            "--tmp-dir", str(workdir / f"tmp{index}")])
+    return out
+
+
+def test_merge_puts_shard_pages_in_route_order(workdir, fake_browser, monkeypatch):
+    fake_browser["page"] = FakePage()
+    parts = [run_shard(workdir, monkeypatch, i, 2) for i in (2, 1)]
+    merged = str(workdir / "pdfs" / "todo.pdf")
+    q.main(["--merge", *parts, "--out", merged])
+
+    by_number = {}
+    for pdf in parts:
+        manifest = json.load(open(q.shard_manifest_path(pdf), encoding="utf-8"))
+        for entry, image in zip(manifest["pages"], page_images(pdf)):
+            by_number[entry["n"]] = image
+    assert sorted(by_number) == [1, 2, 3, 4]
+    assert page_images(merged) == [by_number[n] for n in sorted(by_number)]
+
+
+def test_empty_shard_writes_a_manifest_without_a_browser(workdir, fake_browser, monkeypatch, capsys):
+    def no_browser():
+        raise AssertionError("shard vazio não deveria abrir o navegador")
+
+    fake_browser["page"] = FakePage()
+    parts = [run_shard(workdir, monkeypatch, i, 4) for i in (1, 2, 3)]
+    monkeypatch.setattr(q, "sync_playwright", no_browser)
+    empty = run_shard(workdir, monkeypatch, 4, 4)
+
+    assert not os.path.exists(empty)
+    manifest = json.load(open(q.shard_manifest_path(empty), encoding="utf-8"))
+    assert manifest["pages"] == [] and manifest["shard"] == [4, 4]
+
+    capsys.readouterr()
+    merged = str(workdir / "pdfs" / "todo.pdf")
+    q.main(["--merge", parts[0], parts[2], q.shard_manifest_path(empty), "--out", merged])
+    out = capsys.readouterr().out
+    assert "parte vazia" in out
+    assert "Faltam os shards 2/4" in out
+    assert "B1" in out
+    assert len(page_images(merged)) == 3
@@ -0,0 +1,101 @@
+import qlik_to_pdf as q
+from conftest import FakePage
+from qlik_to_pdf import shot, step
+from test_shards import page_images
+
+ROUTE = [
+    ("A", [step("a", ("menu", "A"), then=[
+        shot("a.home", "A Home"),
+        step("a.tab", ("tab", ["Visão"], [0]), then=[shot("a.tab1", "A Tab1"), shot("a.tab2", "A Tab2")]),
+        step("a.back", ("back",)),
+        shot("a.fim", "A Fim"),
+    ])]),
+    ("B", [step("b", ("menu", "B"), then=[shot("b1", "B1")])]),
+]
+
+
+def fake_actions(monkeypatch, log, broken=()):
+    """
+    Ações que só registram o que rodou; as de `broken` não acham o alvo.
+    """
+    def action(name):
+        def run(page, *args):
+            log.append(f"{name}:{args[0] if args and name == 'menu' else ''}".rstrip(":"))
+            return not (args and args[0] in broken)
+        return run
+
+    for name in ("menu", "tab", "back"):
+        monkeypatch.setitem(q.PLAN_ACTIONS, name, action(name))
+
+
+def run_main(monkeypatch, fake_browser, *args):
+    monkeypatch.setitem(q.ROUTES, "teste", ROUTE)
+    fake_browser["page"] = FakePage()
+    fake_browser["shots"].clear()
+    q.main(["--route", "teste", *args])
+
+
+def test_navigation_step_selects_the_shots_of_its_subtree(capsys):
+    assert q.select_shots(ROUTE, ["a.tab"]) == {"a.tab1", "a.tab2"}
+    assert q.select_shots(ROUTE, ["b", "a.fim"]) == {"b1", "a.fim"}
+    assert q.select_shots(ROUTE, ["a"]) == {"a.home", "a.tab1", "a.tab2", "a.fim"}
+    assert q.select_shots(ROUTE, ["nao.existe"]) == set()
+    assert "Passo 'nao.existe' não existe no plano." in capsys.readouterr().out
+
+
+def test_skip_step_keeps_simple_steps_of_the_active_list():
+    selected = {"a.tab1"}
+    steps = {st["id"]: st for st in q.iter_steps(ROUTE[0][1] + ROUTE[1][1])}
+    assert not q.skip_step(steps["a"], selected)
+    assert not q.skip_step(steps["a.tab"], selected)
+    assert not q.skip_step(steps["a.back"], selected)
+    assert q.skip_step(steps["a.home"], selected)
+    assert q.skip_step(steps["b"], selected)
+    assert not any(q.skip_step(st, None) for st in steps.values())
+
+
+def test_every_step_of_the_real_plan_selects_its_own_shots():
+    shots = {sid for sid, _label in q.plan_shots(q.PLAN)}
+    for _name, steps in q.PLAN:
+        for st in q.iter_steps(steps):
+            subtree = {s["id"] for s in q.iter_steps([st]) if "shot" in s}
+            assert q.select_shots(q.PLAN, [st["id"]]) == subtree <= shots
+
+
+def test_steps_recaptures_only_the_subtree_and_splices_the_pdf(workdir, fake_browser, monkeypatch):
+    log = []
+    fake_actions(monkeypatch, log)
+    run_main(monkeypatch, fake_browser)
+    out_pdf = q.load_plan_manifest()["pdf"]
+    full = page_images(out_pdf)
+    assert len(full) == 5
+
+    log.clear()
+    run_main(monkeypatch, fake_browser, "--steps", "a.tab")
+
+    assert fake_browser["shots"] == ["A Tab1", "A Tab2"]
+    # a OM e a aba rodam; o "Voltar" fica adiado (nada depois precisa dele)
+    # e o ramo B nem abre
+    assert log == ["menu:A", "tab"]
+    manifest = q.load_plan_manifest()
+    assert manifest["complete"] is True
+    assert page_images(manifest["pdf"]) == full
+
+
+def test_failed_recaptures_only_what_is_missing(workdir, fake_browser, monkeypatch):
+    log = []
+    fake_actions(monkeypatch, log, broken=("B",))
+    run_main(monkeypatch, fake_browser)
+    manifest = q.load_plan_manifest()
+    assert manifest["shots"]["b1"]["status"] == "missing"
+    assert manifest["complete"] is False
+
+    log.clear()
+    fake_actions(monkeypatch, log)
+    run_main(monkeypatch, fake_browser, "--failed")
+
+    assert fake_browser["shots"] == ["B1"]
+    assert log == ["menu:B"]
+    manifest = q.load_plan_manifest()
+    assert manifest["complete"] is True
+    assert len(page_images(manifest["pdf"])) == 5
@@ -0,0 +1,112 @@
+import time
+
+import pytest
+
+import qlik_to_pdf as q
+
+
+@pytest.fixture
+def waits(workdir, monkeypatch):
+    monkeypatch.setattr(q, "ADAPTIVE_WAITS", True)
+    monkeypatch.setattr(q, "STEP_BUDGET_S", 0)
+    monkeypatch.setattr(q, "_WAIT_RUN", {"used": set(), "timeouts": set()})
+    monkeypatch.setattr(q, "WAIT_BUDGET_STATS", {"adaptive": 0, "saved_ms": 0})
+    return workdir
+
+
+def history(key, ms, widen=0):
+    q.WAIT_HISTORY[key] = {"ms": list(ms), "widen": widen}
+
+
+def budget(extra_ms, step_id="passo"):
+    with q.step_span({"id": step_id}):
+        return q.wait_budget(extra_ms)
+
+
+def test_p95():
+    assert q._p95(range(1, 101)) == 95
+    assert q._p95([7]) == 7
+    assert q._p95([1, 2, 3, 4, 50]) == 50
+
+
+def test_default_cap_until_there_is_enough_history(waits):
+    assert budget(9000) == ("passo@9000", 9000)
+    assert budget(1000) == ("passo@1000", q.WAIT_MIN_CAP_MS)
+    history("passo@9000", [1000] * (q.WAIT_HISTORY_MIN - 1))
+    assert budget(9000) == ("passo@9000", 9000)
+    assert q.wait_budget(6500) == ("inicio@6500", 6500)
+
+
+@pytest.mark.parametrize("ms, widen, extra, cap", [
+    ([4000] * 5, 0, 9000, 4000 * 1.2 + 500),   # p95 × 1,2 + 500
+    ([100] * 5, 0, 9000, q.WAIT_MIN_CAP_MS),  # nunca abaixo do piso
+    ([9000] * 5, 0, 6000, 9000 * 1.2 + 500),  # acima do fixo, até 2×
+    ([9000] * 5, 1, 6000, 6000 * 2),          # dobra, mas para no teto de 2×
+    ([2000] * 5, 2, 9000, (2000 * 1.2 + 500) * 4),
+])
+def test_adaptive_cap(waits, ms, widen, extra, cap):
+    history(f"passo@{extra}", ms, widen)
+    assert budget(extra) == (f"passo@{extra}", int(cap))
+    assert q.WAIT_BUDGET_STATS["adaptive"] == 1
+    assert q.WAIT_BUDGET_STATS["saved_ms"] == extra - int(cap)
+
+
+def test_timeout_widens_once_per_run_and_keeps_samples_clean(waits):
+    key = "passo@9000"
+    history(key, [4000] * 5)
+    q.record_wait(key, 5300, False)
+    q.record_wait(key, 5300, False)
+    assert q.WAIT_HISTORY[key] == {"ms": [4000] * 5, "widen": 1}
+    assert budget(9000) == (key, int(min((4000 * 1.2 + 500) * 2, 9000 * 2)))
+
+    for _ in range(q.WAIT_WIDEN_MAX + 2):
+        q._WAIT_RUN["timeouts"].clear()
+        q.record_wait(key, 1, False)
+    assert q.WAIT_HISTORY[key]["widen"] == q.WAIT_WIDEN_MAX
+
+
+def test_ready_waits_keep_the_last_n_samples(waits):
+    for n in range(q.WAIT_HISTORY_N + 5):
+        q.record_wait("passo@9000", n, True)
+    assert q.WAIT_HISTORY["passo@9000"]["ms"] == list(range(5, q.WAIT_HISTORY_N + 5))
+
+
+def test_run_end_narrows_clean_points_and_widens_failed_steps(waits):
+    history("ok@9000", [1000] * 5, widen=2)
+    history("falhou@9000", [1000] * 5, widen=0)
+    history("estourou@9000", [1000] * 5, widen=0)
+    history("parado@9000", [1000] * 5, widen=2)
+    for step_id in ("ok", "falhou", "estourou"):
+        budget(9000, step_id)
+    q.record_wait("estourou@9000", 9000, False)
+
+    q.save_wait_history({"status": {"ok": "ok", "falhou": "fail", "estourou": "fail"}})
+
+    assert q.WAIT_HISTORY["ok@9000"]["widen"] == 1
+    assert q.WAIT_HISTORY["falhou@9000"]["widen"] == 1
+    # o estouro já dobrou durante a execução; não dobra de novo no fim
+    assert q.WAIT_HISTORY["estourou@9000"]["widen"] == 1
+    # ponto que não rodou nesta execução fica como estava
+    assert q.WAIT_HISTORY["parado@9000"]["widen"] == 2
+
+    saved = dict(q.WAIT_HISTORY)
+    q.WAIT_HISTORY.clear()
+    q.load_wait_history()
+    assert q.WAIT_HISTORY == saved
+
+
+def test_cap_is_clamped_to_the_step_and_run_deadline(waits, monkeypatch):
+    # prazo menor que o teto fixo: corta e não entra no histórico
+    monkeypatch.setattr(q, "STEP_BUDGET_S", 3)
+    key, cap = budget(9000)
+    assert key is None and 2500 < cap <= 3000
+
+    # teto do histórico maior que o que sobra da execução: para no prazo
+    monkeypatch.setattr(q, "STEP_BUDGET_S", 0)
+    history("passo@3000", [4000] * 5)
+    monkeypatch.setattr(q, "RUN_DEADLINE_AT", time.monotonic() + 4.5)
+    key, cap = budget(3000)
+    assert key == "passo@3000" and 4000 < cap <= 4500
+
+    monkeypatch.setattr(q, "RUN_DEADLINE_AT", time.monotonic() - 1)
+    assert budget(3000) == (None, 0)